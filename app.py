@@ -1,19 +1,97 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
 import sqlite3
 import mysql.connector
-from time import time  # cache timestamps
+from time import time, perf_counter  # cache timestamps
 import os
+import json
+import gzip
+import re
+import math
+import metrics
+import spatial
+import hashlib
+import textwrap
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial, wraps
 from flask_cors import CORS
 
+try:
+    import fcntl
+except ImportError:  # no cross-process lock (Windows): slow-log rotation is per process
+    fcntl = None
+
 USE_SQLITE = os.environ.get("USE_SQLITE") == "1"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SQLITE_PATH = os.path.join(BASE_DIR, "snapshot.db")
 
+# make_sqlite_snapshot.py publishes every build as snapshots/snapshot-<stamp>.db
+# and then atomically rewrites snapshot.current to name it; a bare snapshot.db
+# (which the builder keeps a copy of the published file) is used when there
+# is no pointer. SNAPSHOT_POINTER serves another build
+# (make_sqlite_snapshot.py --pointer), e.g. a benchmark.py scale.
+SNAPSHOT_POINTER    = os.path.abspath(os.getenv("SNAPSHOT_POINTER", os.path.join(BASE_DIR, "snapshot.current")))
+SNAPSHOT_CHECK_SECS = float(os.getenv("SNAPSHOT_CHECK_SECS", "2"))
+_snapshot = {"path": None, "checked": 0.0}
+_pinned_snapshot = contextvars.ContextVar("pinned_snapshot", default=None)
+
+def snapshot_path():
+    """
+    Path of the published snapshot: the one pinned for this request (see
+    pin_snapshot()), else re-read from the pointer at most every SNAPSHOT_CHECK_SECS.
+    """
+    pinned = _pinned_snapshot.get()
+    if pinned is not None:
+        return pinned
+    now = time()
+    if _snapshot["path"] is not None and now - _snapshot["checked"] < SNAPSHOT_CHECK_SECS:
+        return _snapshot["path"]
+    path = SQLITE_PATH
+    try:
+        with open(SNAPSHOT_POINTER, encoding="utf-8") as fh:
+            name = fh.read().strip()
+        name = os.path.join(os.path.dirname(SNAPSHOT_POINTER), name) if name else ""
+        if name and os.path.exists(name):
+            path = name
+    except OSError:
+        pass
+    _snapshot["path"], _snapshot["checked"] = path, now
+    return path
+
+@contextmanager
+def pin_snapshot(path=None):
+    """
+    Answer every snapshot_path() in the block (this thread / context only) with
+    one pointer read, so the pooled connection, data_version() and whatever is
+    cached per version -- customer dimension ids, the rollup catalog -- all
+    describe the same file even if a new snapshot is published meanwhile.
+    """
+    token = _pinned_snapshot.set(path or snapshot_path())
+    try:
+        yield
+    finally:
+        _pinned_snapshot.reset(token)
+
+def snapshot_is_current():
+    """
+    False inside a block pinned to a snapshot that has been replaced since:
+    it still reads its own file, but must not swap shared per-version state back.
+    """
+    pinned = _pinned_snapshot.get()
+    return pinned is None or pinned == _snapshot["path"]
+
 import sqlite3  # make sure this is at the top of app.py
 
 class SQLiteCursorWrapper:
-    def __init__(self, cursor):
+    def __init__(self, cursor, dictionary=True):
         self._cursor = cursor
+        self._dictionary = dictionary  # dict rows (mysql dictionary=True) or tuples
         self._empty_result = False  # flag for demo mode
 
     def execute(self, sql, params=None):
@@ -49,23 +127,32 @@ class SQLiteCursorWrapper:
                 return self
             raise
 
+    def _row(self, r):
+        return dict(r) if self._dictionary else tuple(r)
+
     def fetchall(self):
         if self._empty_result:
             return []  # no data instead of error
         rows = self._cursor.fetchall()
-        return [dict(r) for r in rows]
+        return [self._row(r) for r in rows]
+
+    def fetchmany(self, size=None):
+        if self._empty_result:
+            return []
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        return [self._row(r) for r in rows]
 
     def fetchone(self):
         if self._empty_result:
             return None
         r = self._cursor.fetchone()
-        return dict(r) if r is not None else None
+        return self._row(r) if r is not None else None
 
     def __iter__(self):
         if self._empty_result:
             return iter([])
         for r in self._cursor:
-            yield dict(r)
+            yield self._row(r)
 
     def __getattr__(self, name):
         return getattr(self._cursor, name)
@@ -76,15 +163,26 @@ class SQLiteConnectionWrapper:
         self._conn = conn
 
     def cursor(self, *args, **kwargs):
-        # ignore dictionary=True from mysql style
-        kwargs.pop("dictionary", None)
+        # dictionary=True (mysql style) -> dict rows, otherwise tuples
+        dictionary = kwargs.pop("dictionary", False)
+        kwargs.pop("buffered", None)  # mysql-only
         cur = self._conn.cursor(*args, **kwargs)
-        return SQLiteCursorWrapper(cur)
+        return SQLiteCursorWrapper(cur, dictionary=dictionary)
 
     def __getattr__(self, name):
         return getattr(self._conn, name)
 
 
+class _ArgsRequest:
+    """Just enough of a request for parse_filters()."""
+    def __init__(self, args):
+        self.args = args
+
+
+class InvalidArgument(ValueError):
+    """A chart argument the endpoint answers with 400."""
+
+
 def parse_filters(req):
     """Uniform filter extraction."""
     return {
@@ -108,19 +206,32 @@ def build_customer_filters(alias_fact: str, f, *, use_sold_to_name: bool=False):
     """
     joins = [f"left JOIN customer cus ON cus.ship_to = {alias_fact}.ship_to"]
     wh, p = [], []
+    # snapshot with dim_* tables: integer surrogate keys resolved here, in memory
+    dims = customer_dimensions()
 
     if f["region"] != "ALL":
-        wh.append("cus.bde_state = %s"); p.append(f["region"])
+        if dims:
+            wh.append("cus.region_sk = %s"); p.append(dims["region"].get(f["region"], 0))
+        else:
+            wh.append("cus.bde_state = %s"); p.append(f["region"])
     if f["salesman"] != "ALL":
-        wh.append("UPPER(TRIM(cus.salesman_name)) = UPPER(TRIM(%s))"); p.append(f["salesman"])
+        if dims:
+            wh.append("cus.salesman_sk = %s"); p.append(dims["salesman"].get(sql_upper_trim(f["salesman"]), 0))
+        else:
+            wh.append("UPPER(TRIM(cus.salesman_name)) = UPPER(TRIM(%s))"); p.append(f["salesman"])
     if f["sold_to_group"] != "ALL":
-        wh.append("cus.sold_to_group = %s"); p.append(f["sold_to_group"])
+        if dims:
+            wh.append("cus.sold_to_group_sk = %s"); p.append(dims["sold_to_group"].get(f["sold_to_group"], 0))
+        else:
+            wh.append("cus.sold_to_group = %s"); p.append(f["sold_to_group"])
 
     # sold_to: id (A.. / digits) or match by name via customer
     if f["sold_to"] != "ALL":
         sv = f["sold_to"]
         if not use_sold_to_name and (sv.isdigit() or sv.upper().startswith("A")):
             wh.append(f"{alias_fact}.ship_to = %s"); p.append(sv)
+        elif dims:
+            wh.append("cus.sold_to_name_sk = %s"); p.append(dims["sold_to_name"].get(sv, 0))
         else:
             wh.append("cus.sold_to_name = %s"); p.append(sv)
 
@@ -224,788 +335,1780 @@ def category_target_filters(alias: str, category: str):
 
     return joins, wh
 
-app = Flask(__name__, static_folder="static")
-CORS(app, resources={r"/api/*": {"origins": "*"}})
-
-def get_connection():
-    # If USE_SQLITE=1 (on Render), use the local snapshot.db file
-    if USE_SQLITE:
-        conn = sqlite3.connect(SQLITE_PATH)
-        conn.row_factory = sqlite3.Row  # rows behave like dicts
-        return SQLiteConnectionWrapper(conn)
-
-    # Otherwise use MySQL (your current local setup)
-    cfg = {
-        "host": os.getenv("DB_HOST", "127.0.0.1"),
-        "port": int(os.getenv("DB_PORT", "3306")),
-        "user": os.getenv("DB_USER", "root"),
-        "password": os.getenv("DB_PASS", ""),
-        "database": os.getenv("DB_NAME", "my_new_database"),  # change to your real db
-        "autocommit": True,
-    }
-    try:
-        return mysql.connector.connect(**cfg)
-    except mysql.connector.Error as e:
-        # temporary: don't kill the app, just log
-        print("DB connection failed:", e)
-        return None
-@app.get("/api/ping")
-def ping():
-    return {"ok": True}
+# ----------------------------- Rollup routing ---------------------------------
+# make_sqlite_snapshot.py writes pre-aggregated <fact>__by_ship / __by_product /
+# __by_time tables listed in _rollups. Sales queries go to the smallest one that
+# carries every column they filter or group on, else to the raw fact.
+# The raw facts (and profit_2501_10) are listed too, under their own name, once
+# they carry the category flag columns; those replace category_filters() joins.
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "1") == "1"
+
+_CUSTOMER_FILTER_KEYS = ("region", "salesman", "sold_to_group", "sold_to", "ship_to")
+# category -> flag columns its predicate needs
+_CATEGORY_COLUMNS = {
+    "PCLT":       ("line",),
+    "TBR":        ("line",),
+    "18PLUS":     ("line", "plus18"),
+    "ISEG":       ("iseg_n",),
+    "LOWPROFILE": ("lowprofile_n",),
+    "SUV":        ("suv_n",),
+    "HM":         ("hm_n",),
+}
+# categories whose raw JOIN can fan out; flagged tables keep the match count instead
+_CATEGORY_COUNT = {"ISEG": "iseg_n", "LOWPROFILE": "lowprofile_n", "SUV": "suv_n", "HM": "hm_n"}
+
+
+class FactSource:
+    """The table a sales query reads: the raw fact, or one of its rollups."""
+
+    def __init__(self, fact, f, table=None, columns=None):
+        self.fact = fact
+        self.f = f
+        self.table = table or fact
+        self.columns = columns  # None -> unlisted raw fact (MySQL / older snapshot)
+
+    def has(self, col):
+        return self.columns is None or col in self.columns
+
+    def _flagged(self, category):
+        """True when this source answers `category` from flag columns instead of a JOIN."""
+        needed = _CATEGORY_COLUMNS.get(category, ())
+        return self.columns is not None and all(c in self.columns for c in needed)
+
+    def category_filters(self, alias):
+        """(joins, wheres) for the category filter: flag-column tests when listed, else category_filters()."""
+        cat = (self.f["category"] or "ALL").upper()
+        if not self._flagged(cat):
+            return category_filters(alias, self.f["category"])
+        wh = []
+        if cat in ("PCLT", "TBR"):
+            wh.append(f"{alias}.line = '{cat}'")
+        elif cat == "18PLUS":
+            wh.append(f"{alias}.line = 'PCLT'")
+            wh.append(f"{alias}.plus18 = 1")
+        elif cat in _CATEGORY_COUNT:
+            wh.append(f"{alias}.{_CATEGORY_COUNT[cat]} > 0")
+        return [], wh
+
+    def filters(self, alias, customer=True, product=True):
+        """
+        (joins, wheres, params) for the customer, category and
+        product_group/pattern filters, in this source's terms.
+        """
+        f = self.f
+        if customer and self.has("ship_to"):
+            joins, wh, params = build_customer_filters(alias, f, use_sold_to_name=False)
+        else:
+            # routed here only when no customer filter is set; cus_n keeps the join's fan-out
+            joins, wh, params = [], [], []
 
-# ------------------------------------------------------------------------------
+        cat_joins, cat_where = self.category_filters(alias)
+        joins += cat_joins
+        wh    += cat_where
 
-@app.route("/")
-def index():
-    return app.send_static_file("index.html")
+        # direct fields (indexable)
+        if product and f["product_group"] != "ALL":
+            wh.append(f"{alias}.product_group = %s")
+            params.append(f["product_group"])
+        if product and f["pattern"] != "ALL":
+            wh.append(f"{alias}.pattern = %s")
+            params.append(f["pattern"])
+        return joins, wh, params
+
+    def total(self, alias, value):
+        """SUM(<alias>.<value>), re-applying the join fan-out a listed table folded into counts."""
+        if self.columns is None:
+            return f"SUM({alias}.{value})"
+        factors = [f"{alias}.{value}"]
+        cat = (self.f["category"] or "ALL").upper()
+        if cat in _CATEGORY_COUNT and self._flagged(cat):
+            factors.append(f"{alias}.{_CATEGORY_COUNT[cat]}")
+        if "cus_n" in self.columns:
+            factors.append(f"{alias}.cus_n")
+        return f"SUM({' * '.join(factors)})"
+
+
+_rollups = {"entry": (object(), {})}  # (data version, catalog), swapped as one
+
+def rollup_catalog():
+    """{fact: [(table, columns, row_count)]} from the snapshot's _rollups, per data version."""
+    version = data_version()
+    seen, catalog = _rollups["entry"]
+    if seen != version:
+        catalog = {}
+        try:
+            with get_cursor(dictionary=False) as cur:
+                cur.execute("SELECT name, fact, columns, row_count FROM _rollups", label="rollup_catalog.sql")
+                for name, fact, columns, n in cur.fetchall():
+                    catalog.setdefault(fact, []).append((name, frozenset(columns.split(",")), n))
+        except Exception:
+            catalog = {}  # MySQL / older snapshot: raw facts only
+        if snapshot_is_current():
+            _rollups["entry"] = (version, catalog)
+    return catalog
+
+def listed_source(fact, f):
+    """`fact` itself with its catalog columns (flag columns) when listed, else the unlisted raw fact."""
+    for table, columns, _ in rollup_catalog().get(fact, ()):
+        if table == fact:
+            return FactSource(fact, f, table, columns)
+    return FactSource(fact, f)
+
+# ----------------------------- Customer dimension -------------------------------
+# make_sqlite_snapshot.py writes dim_region / dim_salesman / dim_sold_to_group /
+# dim_sold_to_name (id, key) and a matching <name>_sk column on customer. The
+# keys are small, so each worker holds them as dicts per data version. Ids are
+# only valid in the file they were read from: data_version() follows the
+# request's pinned snapshot, the same file its queries run against.
+_CUSTOMER_DIMENSIONS = ("region", "salesman", "sold_to_group", "sold_to_name")
+_ASCII_UPPER = str.maketrans("abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_dims = {"entry": (object(), None)}  # (data version, maps), swapped as one
+
+def sql_upper_trim(v):
+    """UPPER(TRIM(v)) as SQLite computes it: spaces trimmed, ASCII upper-cased."""
+    return v.strip(" ").translate(_ASCII_UPPER)
+
+def customer_dimensions():
+    """{name: {key: id}} per data version; None without dim tables (MySQL / older snapshot)."""
+    version = data_version()
+    seen, maps = _dims["entry"]
+    if seen != version:
+        maps = None
+        if USE_SQLITE:
+            try:
+                with get_cursor(dictionary=False) as cur:
+                    # the wrapper answers a missing table with no rows, so ask sqlite_master first
+                    cur.execute(f"""
+                        SELECT COUNT(*) FROM sqlite_master
+                         WHERE type = 'table' AND name IN ({", ".join("%s" for _ in _CUSTOMER_DIMENSIONS)})
+                    """, tuple(f"dim_{name}" for name in _CUSTOMER_DIMENSIONS),
+                        label="customer_dimensions.tables_sql")
+                    if cur.fetchone()[0] == len(_CUSTOMER_DIMENSIONS):
+                        cur.execute("SELECT region_sk FROM customer LIMIT 1", label="customer_dimensions.columns_sql")  # _sk columns present too
+                        maps = {}
+                        for name in _CUSTOMER_DIMENSIONS:
+                            cur.execute(f"SELECT key, id FROM dim_{name}", label="customer_dimensions.dim_sql")
+                            maps[name] = dict(cur.fetchall())
+            except Exception:
+                maps = None
+        if snapshot_is_current():
+            _dims["entry"] = (version, maps)
+    return maps
+
+def route_fact(fact, f, *refs, top_limit=0):
+    """
+    Smallest source for `fact` that can answer a query with filters f that
+    also touches refs ("s.<col>" / "cus.<col>" it groups on); top_limit > 0
+    adds the s.sold_to IN (top N) restriction.
+    """
+    if not USE_ROLLUPS:
+        return listed_source(fact, f)
+    need = set()
+    if any(f[k] != "ALL" for k in _CUSTOMER_FILTER_KEYS):
+        need.add("ship_to")
+    need.update(_CATEGORY_COLUMNS.get((f["category"] or "ALL").upper(), ()))
+    if f["product_group"] != "ALL":
+        need.add("product_group")
+    if f["pattern"] != "ALL":
+        need.add("pattern")
+    if top_limit > 0:
+        need.add("sold_to")
+    for ref in refs:
+        alias, col = ref.split(".", 1)
+        need.add("ship_to" if alias == "cus" else col.lower())
+
+    best = None
+    for table, columns, n in rollup_catalog().get(fact, ()):
+        if need <= columns and (best is None or n < best[2]):
+            best = (table, columns, n)
+    if best is None:
+        return FactSource(fact, f)
+    return FactSource(fact, f, best[0], best[1])
+
+def sold_to_ranking(cur, f, value, extra_joins=(), extra_where=()):
+    """
+    Every s.sold_to over YTD sales_2501_11 under filters f, by SUM(<value>)
+    descending (ties by sold_to). Computed once per (filters, metric, extra
+    predicates) and data version -- any top_limit is a prefix of it.
+    cur may be None when the caller holds no cursor.
+    """
+    key = (tuple(sorted((k, v) for k, v in f.items() if k != "metric")), value,
+           tuple(extra_joins), tuple(extra_where))
+    version = data_version()
+    shared = snapshot_is_current()  # a request on a replaced snapshot neither reads nor fills it
+    ranking = None
+    if shared:
+        ranking_cache.check_version(version)
+        ranking = ranking_cache.get(key)
+        if ranking is not None:
+            return ranking
+
+    eng = get_engine() if not extra_joins else None
+    if eng is not None:
+        try:
+            ranking = eng.top_sold_to(f, value)
+        except columnar.Unsupported:
+            ranking = None
+
+    if ranking is None:
+        src = route_fact("sales_2501_11", f, "s.sold_to", *(["s.ship_to"] if extra_joins else []))
+        joins, wh, params = src.filters("s")
+        joins += extra_joins
+        wh    += extra_where
+        where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
+        rank_sql = f"""
+          SELECT s.sold_to AS sold_to
+            FROM {src.table} s
+            {' '.join(joins)}
+            {where_sql}
+           GROUP BY s.sold_to
+           ORDER BY {src.total("s", value)} DESC, s.sold_to
+        """
+        if cur is None:
+            with get_cursor() as cur:
+                cur.execute(rank_sql, tuple(params), label="sold_to_ranking.rank_sql")
+                ranking = [r["sold_to"] for r in cur.fetchall()]
+        else:
+            cur.execute(rank_sql, tuple(params), label="sold_to_ranking.rank_sql")
+            ranking = [r["sold_to"] for r in cur.fetchall()]
 
-@app.route("/map")
-def map_page():
-    return app.send_static_file("map.html")
+    if shared:
+        ranking_cache.put(key, ranking, size=64 + sum(len(str(v)) + 8 for v in ranking), version=version)
+    return ranking
 
+def fetch_top_sold_to(cur, f, value, top_limit, extra_joins=(), extra_where=()):
+    """
+    Top N s.sold_to by SUM(<value>) over YTD sales_2501_11 under filters f
+    (the ranking every top_limit chart restricts itself to).
+    """
+    return sold_to_ranking(cur, f, value, extra_joins, extra_where)[:top_limit]
 
+app = Flask(__name__, static_folder="static")
+CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# ----------------------------- Daily Sales ---------------------------------
-@app.get("/api/daily_sales")
-def daily_sales():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
+# ----------------------------- Connection pooling ---------------------------------
+DB_POOL_SIZE       = int(os.getenv("DB_POOL_SIZE", "8"))          # max MySQL connections per worker
+DB_POOL_TIMEOUT    = float(os.getenv("DB_POOL_TIMEOUT", "10"))    # secs to wait for a free connection
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30")) # idle secs before a health check
+SQLITE_STATEMENTS  = int(os.getenv("SQLITE_STATEMENTS", "256"))   # prepared statements cached per SQLite connection
+
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within DB_POOL_TIMEOUT."""
+
+
+class _PoolStats:
+    """Counters shared by both pool flavours (read via /api/_pool)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0      # physical connections opened
+        self.discarded = 0    # closed after failing a health check / error
+        self.acquired = 0     # successful checkouts
+        self.timeouts = 0
+        self.switched = 0     # reopened on a newly published snapshot
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.acquired += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def bump(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "created":      self.created,
+                "discarded":    self.discarded,
+                "acquired":     self.acquired,
+                "timeouts":     self.timeouts,
+                "switched":     self.switched,
+                "wait_avg_ms":  round(self.wait_total / self.acquired * 1000, 3) if self.acquired else 0.0,
+                "wait_max_ms":  round(self.wait_max * 1000, 3),
+            }
+
+
+class MySQLPool:
+    """
+    Bounded pool of mysql.connector connections.
+    - at most `size` connections are open at once; callers block up to `timeout`
+    - idle connections are reused LIFO (warm ones first)
+    - a connection idle for more than `ping_after` secs is pinged before reuse
+      and replaced if the ping fails
+    """
+    kind = "mysql"
+
+    def __init__(self, cfg, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self._cfg = cfg
+        self._size = size
+        self._timeout = timeout
+        self._ping_after = ping_after
+        self._idle = []   # [(conn, released_at)]
+        self._open = 0    # idle + checked out
+        self._cond = threading.Condition()
+        self.stats = _PoolStats()
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self._cfg)
+        self.stats.bump("created")
+        return conn
+
+    @staticmethod
+    def _healthy(conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
 
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
+    def _discard(self, conn):
+        self.stats.bump("discarded")
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
+    def acquire(self):
+        start = perf_counter()
+        deadline = start + self._timeout
+        with self._cond:
+            while not self._idle and self._open >= self._size:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    self.stats.bump("timeouts")
+                    raise PoolTimeout(f"no MySQL connection free after {self._timeout}s")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._open += 1   # reserve a slot, connect outside the lock
+        self.stats.record_wait(perf_counter() - start)
+
+        if conn is not None and time() - released_at > self._ping_after and not self._healthy(conn):
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._discard(conn)
+        with self._cond:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time()))
+            self._cond.notify()
 
-    # category
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
+    def status(self):
+        with self._cond:
+            out = {"kind": self.kind, "size": self._size, "open": self._open,
+                   "idle": len(self._idle), "in_use": self._open - len(self._idle)}
+        out.update(self.stats.as_dict())
+        return out
 
-    # direct fields (indexable)
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s")
-        params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s")
-        params.append(f["pattern"])
 
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
+class SQLitePool:
+    """
+    One reusable sqlite3 connection per thread, re-opened after fork so each
+    gunicorn worker gets its own. snapshot.db is read-only for the app, so
+    there is nothing to bound: checkout never waits.
+    `path` is a callable returning the current snapshot file; when it names a
+    new file the thread's connection is swapped at its next checkout. Queries
+    already running finish on the old file, which stays readable until closed.
+    """
+    kind = "sqlite"
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+        self.stats = _PoolStats()
+
+    def acquire(self):
+        start = perf_counter()
+        path = self._path()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid() and self._local.path != path:
+            self._close(conn)
+            conn = None
+            self.stats.bump("switched")
+        if conn is None or self._local.pid != os.getpid():
+            raw = sqlite3.connect(path, cached_statements=SQLITE_STATEMENTS)
+            raw.row_factory = sqlite3.Row  # rows behave like dicts
+            conn = SQLiteConnectionWrapper(raw)
+            self._local.conn, self._local.pid, self._local.path = conn, os.getpid(), path
+            self.stats.bump("created")
+            with self._lock:
+                self._open += 1
+        self.stats.record_wait(perf_counter() - start)
+        return conn
+
+    def _close(self, conn):
+        self._local.conn = None
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
+    def release(self, conn, broken=False):
+        if broken and getattr(self._local, "conn", None) is conn:
+            self._close(conn)
+            self.stats.bump("discarded")
+
+    def status(self):
+        with self._lock:
+            out = {"kind": self.kind, "path": self._path(), "open": self._open}
+        out.update(self.stats.as_dict())
+        return out
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # If USE_SQLITE=1 (on Render), use the local snapshot.db file
+                if USE_SQLITE:
+                    _pool = SQLitePool(snapshot_path)
+                else:
+                    # Otherwise use MySQL (your current local setup)
+                    _pool = MySQLPool({
+                        "host": os.getenv("DB_HOST", "127.0.0.1"),
+                        "port": int(os.getenv("DB_PORT", "3306")),
+                        "user": os.getenv("DB_USER", "root"),
+                        "password": os.getenv("DB_PASS", ""),
+                        "database": os.getenv("DB_NAME", "my_new_database"),  # change to your real db
+                        "autocommit": True,
+                    })
+    return _pool
+
+# errors after which a connection must not go back into the pool
+_BROKEN_CONN_ERRORS = (mysql.connector.errors.InterfaceError,
+                       mysql.connector.errors.OperationalError,
+                       sqlite3.ProgrammingError)
+
+@contextmanager
+def get_connection():
+    """
+    Check out a pooled connection for the duration of the block:
+        with get_connection() as conn: ...
+    The connection always goes back to the pool (or is dropped if it broke).
+    """
+    pool = get_pool()
+    t0 = perf_counter()
+    conn = pool.acquire()
+    CONNECTION_SECONDS.observe(perf_counter() - t0, pool.kind)
+    broken = False
     try:
-        top_sold_to = None
+        yield conn
+    except _BROKEN_CONN_ERRORS:
+        broken = True
+        raise
+    finally:
+        pool.release(conn, broken=broken)
 
-        # 1) If top_limit > 0, get top N sold_to first
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
+@contextmanager
+def get_cursor(dictionary=True):
+    """Pooled connection + cursor; dictionary=False gives tuple rows."""
+    with get_connection() as conn:
+        cur = conn.cursor(dictionary=dictionary, buffered=True)
+        try:
+            yield TimedCursor(cur, conn)
+        finally:
+            cur.close()
 
-            if not top_sold_to:
-                # no matching customers – all days = 0
-                return jsonify([{"day": d, "value": 0} for d in range(1, 31)])
+@app.get("/api/_pool")
+def pool_status():
+    return jsonify(get_pool().status())
+
+# ----------------------------- Metrics ---------------------------------
+# Request, query, connection and cache instrumentation, served in the
+# Prometheus text format by /api/_metrics and summed over all gunicorn
+# workers (see metrics.py). Cache hit ratio in PromQL:
+#   sum by (cache) (rate(salesdata_cache_lookups_total{result="hit"}[5m]))
+#     / sum by (cache) (rate(salesdata_cache_lookups_total[5m]))
+REQUESTS = metrics.Counter(
+    "salesdata_http_requests_total", "HTTP requests by endpoint, method and status.",
+    ("endpoint", "method", "status"))
+REQUEST_SECONDS = metrics.Histogram(
+    "salesdata_http_request_duration_seconds", "Time from request start to response, per endpoint.",
+    ("endpoint",))
+RESPONSE_BYTES = metrics.Histogram(
+    "salesdata_http_response_bytes", "Response body size as sent (after compression), per endpoint.",
+    ("endpoint",), buckets=metrics.BYTES_BUCKETS)
+QUERY_SECONDS = metrics.Histogram(
+    "salesdata_db_query_duration_seconds", "SQL time per statement, split into execute and fetch.",
+    ("query", "phase"))
+QUERY_ROWS = metrics.Counter(
+    "salesdata_db_query_rows_total", "Rows fetched per statement.", ("query",))
+QUERY_ERRORS = metrics.Counter(
+    "salesdata_db_query_errors_total", "Statements that raised.", ("query",))
+CONNECTION_SECONDS = metrics.Histogram(
+    "salesdata_db_connection_acquire_seconds", "Time to check a connection out of the pool.",
+    ("backend",))
+SLOW_QUERIES = metrics.Counter(
+    "salesdata_db_slow_queries_total", "Statements that took at least SLOW_QUERY_MS.", ("query",))
+CACHE_LOOKUPS = metrics.Counter(
+    "salesdata_cache_lookups_total", "In-process cache lookups by cache and result (hit / miss).",
+    ("cache", "result"))
+
+class TimedCursor:
+    """
+    Cursor proxy recording execute / fetch time and rows of each statement
+    under the label its caller passes (<function>.<statement>, e.g.
+    sales_map_rows.map_sql); statements slower than SLOW_QUERY_MS (execute +
+    first fetch) go to the slow-query log.
+    """
 
-        # 2) Daily totals, optionally restricted to top N sold_to
-        wh2 = list(wh)
-        params2 = list(params)
+    def __init__(self, cursor, conn=None):
+        self._cursor = cursor
+        self._conn = conn
+        self._query = "unknown"
+        self._pending = None  # (sql, params, execute secs) until the first fetch
 
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
+    def execute(self, sql, params=None, label="unlabeled"):
+        self._query = label
+        self._pending = None
+        t0 = perf_counter()
+        try:
+            result = self._cursor.execute(sql, params)
+        except Exception:
+            QUERY_ERRORS.inc(self._query)
+            raise
+        finally:
+            seconds = perf_counter() - t0
+            QUERY_SECONDS.observe(seconds, self._query, "execute")
+        self._pending = (sql, params, seconds)
+        return result
+
+    def _fetch(self, method, *args):
+        t0 = perf_counter()
+        rows = getattr(self._cursor, method)(*args)
+        seconds = perf_counter() - t0
+        QUERY_SECONDS.observe(seconds, self._query, "fetch")
+        n = len(rows) if isinstance(rows, list) else int(rows is not None)
+        QUERY_ROWS.inc(self._query, value=n)
+        if self._pending is not None:
+            sql, params, execute_secs = self._pending
+            self._pending = None
+            if slow_query_log is not None and (execute_secs + seconds) * 1000 >= SLOW_QUERY_MS:
+                log_slow_query(self._conn, self._query, sql, params, execute_secs, seconds, n)
+        return rows
 
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
+    def fetchall(self):
+        return self._fetch("fetchall")
 
-        daily_sql = f"""
-          SELECT s.day AS day_num, SUM(s.{value}) AS daily_total
-            FROM sales_2511 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.day
-           ORDER BY s.day
-        """
-        cur.execute(daily_sql, tuple(params2))
-        rows = cur.fetchall()
+    def fetchmany(self, *args):
+        return self._fetch("fetchmany", *args)
 
-    finally:
-        cur.close()
-        conn.close()
+    def fetchone(self):
+        return self._fetch("fetchone")
 
-    day_map = {int(r["day_num"]): float(r["daily_total"] or 0) for r in rows}
-    return jsonify([{"day": d, "value": day_map.get(d, 0)} for d in range(1, 31)])
+    def __iter__(self):
+        return iter(self.fetchall())
 
-#
-# -------------------- Daily breakdown (stacked by group) -------------------
-@app.get("/api/daily_breakdown")
-def daily_breakdown():
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
 
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
 
-    # Which dimension to group by?
-    group_by = (request.args.get("group_by") or "region").strip()
-    group_cols = {
-        "product_group": "s.product_group",
-        "region":        "cus.bde_state",
-        "salesman":      "cus.salesman_name",
-        "sold_to_group": "cus.sold_to_group",
-        "sold_to":       "cus.sold_to_name",
-        "pattern":       "s.pattern",
-    }
-    if group_by not in group_cols:
-        return jsonify({"error": "invalid group_by"}), 400
-    group_col = group_cols[group_by]
+# ----------------------------- Slow-query log ---------------------------------
+# Statements taking at least SLOW_QUERY_MS are appended to SLOW_QUERY_LOG as one
+# JSON object per line: endpoint, query args and parsed filters, the SQL with its
+# parameters (and inlined, ready to paste), timings, rows and the EXPLAIN /
+# EXPLAIN QUERY PLAN output. Every worker appends to the same file, which is
+# rotated at SLOW_QUERY_LOG_BYTES keeping SLOW_QUERY_LOG_BACKUPS old files.
+# replay_slow_queries.py re-runs logged statements for before/after timings.
+SLOW_QUERY_MS          = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_LOG_PATH    = os.getenv("SLOW_QUERY_LOG", os.path.join(BASE_DIR, "logs", "slow_queries.jsonl"))  # "" disables
+SLOW_QUERY_LOG_BYTES   = int(os.getenv("SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "5"))
+SLOW_QUERY_EXPLAIN     = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+
+
+class SlowQueryLog:
+    """JSON-lines file shared by all workers: path, path.1 (newest) .. path.<backups>."""
+
+    def __init__(self, path, max_bytes=SLOW_QUERY_LOG_BYTES, backups=SLOW_QUERY_LOG_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def files(self):
+        """Existing log files, oldest first."""
+        names = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        return [n for n in names if os.path.exists(n)]
+
+    def write(self, record):
+        line = json.dumps(record, default=str, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)  # one worker rotates at a time
+                try:
+                    size = os.path.getsize(self.path)
+                except OSError:
+                    size = 0
+                if size and size + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write(line)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
 
-    # ---- Build base JOINs / WHEREs (same as daily_sales) ----
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_PATH) if SLOW_QUERY_LOG_PATH else None
 
-    # Direct, index-friendly filters that live on sales202511
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s"); params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s");       params.append(f["pattern"])
 
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
+def _sql_literal(v):
+    if v is None:
+        return "NULL"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, (int, float)):
+        return repr(v)
+    return "'" + str(v).replace("'", "''") + "'"
+
+def expand_sql(sql, params):
+    """The statement with its %s placeholders replaced by SQL literals."""
+    params = list(params or ())
+    return re.sub(r"%s", lambda m: _sql_literal(params.pop(0)) if params else m.group(0), sql)
 
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
+def explain_query(conn, sql, params):
+    """EXPLAIN (MySQL) / EXPLAIN QUERY PLAN (SQLite) rows as dicts."""
+    cur = conn.cursor(dictionary=False, buffered=True)
     try:
-        top_sold_to = None
+        cur.execute(("EXPLAIN QUERY PLAN " if USE_SQLITE else "EXPLAIN ") + sql, params)
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+    except Exception as e:
+        return [{"error": str(e)}]
+    finally:
+        cur.close()
 
-        # 1) If top_limit > 0, get top N sold_to first (same as daily_sales)
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # no matching customers – nothing to show
-            if not top_sold_to:
-                return jsonify([])
+def log_slow_query(conn, query, sql, params, execute_secs, fetch_secs, rows):
+    SLOW_QUERIES.inc(query)
+    sql = "\n".join(line.rstrip() for line in textwrap.dedent(sql).strip().splitlines())
+    record = {
+        "ts":          datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "pid":         os.getpid(),
+        "backend":     "sqlite" if USE_SQLITE else "mysql",
+        "data_version": _data_versions.get(snapshot_path() if USE_SQLITE else None, (None,))[0],
+        "query":       query,
+        "endpoint":    None,
+        "duration_ms": round((execute_secs + fetch_secs) * 1000, 3),
+        "execute_ms":  round(execute_secs * 1000, 3),
+        "fetch_ms":    round(fetch_secs * 1000, 3),
+        "rows":        rows,
+        "sql":         sql,
+        "params":      list(params or ()),
+        "expanded_sql": expand_sql(sql, params),
+    }
+    if has_request_context():
+        record["endpoint"] = request.endpoint
+        record["args"] = request.args.to_dict(flat=False)
+        record["filters"] = parse_filters(request)
+    if SLOW_QUERY_EXPLAIN and conn is not None:
+        record["plan"] = explain_query(conn, sql, params)
+    try:
+        slow_query_log.write(record)
+    except OSError as e:
+        print("[WARN] slow-query log write failed:", e)
 
-        # 2) Daily breakdown, restricted to those top customers,
-        #    but stacked by group_col (region / salesman / etc.)
-        wh2 = list(wh)
-        params2 = list(params)
 
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
 
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
+@app.before_request
+def pin_request_snapshot():
+    # one pointer read per request: see pin_snapshot()
+    if USE_SQLITE:
+        g.snapshot_token = _pinned_snapshot.set(snapshot_path())
+
+@app.teardown_request
+def unpin_request_snapshot(exc=None):
+    token = g.pop("snapshot_token", None)
+    if token is not None:
+        _pinned_snapshot.reset(token)
+
+# registered before compress_response, so it runs after it and sees the sent body
+@app.after_request
+def record_request_metrics(resp):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_SECONDS.observe(perf_counter() - started, endpoint)
+        REQUESTS.inc(endpoint, request.method, str(resp.status_code))
+        if resp.content_length is not None:
+            RESPONSE_BYTES.observe(resp.content_length, endpoint)
+    metrics.registry.start_flusher()
+    return resp
+
+@app.get("/api/_metrics")
+def metrics_export():
+    return Response(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ----------------------------- Response cache ---------------------------------
+# Chart endpoints are pure functions of parse_filters() + a few extra args and
+# the data only changes on snapshot reload, so their JSON is cached in-process.
+RESPONSE_CACHE          = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_BYTES    = int(os.getenv("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL      = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+DATA_VERSION_CHECK_SECS = float(os.getenv("DATA_VERSION_CHECK_SECS", "5"))
+
+
+_ANY_VERSION = object()
+
+class ResponseCache:
+    """
+    LRU bounded by total bytes, entries expire after `ttl` secs. Holds
+    response bodies (size = len) or other values put with an explicit size.
+    """
 
-        sql = f"""
-          SELECT s.day AS day,
-                 {group_col} AS group_label,
-                 SUM(s.{value}) AS value
-            FROM sales_2511 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.day, {group_col}
-           ORDER BY s.day
+    def __init__(self, name, max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                CACHE_LOOKUPS.inc(self.name, "miss")
+                return None
+            if entry[0] < time():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                CACHE_LOOKUPS.inc(self.name, "miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(self.name, "hit")
+            return entry[1]
+
+    def put(self, key, value, size=None, version=_ANY_VERSION):
         """
-        cur.execute(sql, tuple(params2))
-        rows = cur.fetchall()
+        Store value; `version` is the data version it was computed from (the
+        one passed to check_version() before computing), and the put is dropped
+        if the cache has moved to another version meanwhile.
+        """
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if version is not _ANY_VERSION and version != self._version:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time() + self.ttl, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def check_version(self, version):
+        """Clear everything when the data source reports a new version."""
+        with self._lock:
+            if version == self._version:
+                return
+            if self._version is not None:
+                self.invalidations += 1
+            self._version = version
+            self._entries.clear()
+            self._bytes = 0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def status(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries":       len(self._entries),
+                "bytes":         self._bytes,
+                "max_bytes":     self.max_bytes,
+                "ttl":           self.ttl,
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_ratio":     round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions":     self.evictions,
+                "expirations":   self.expirations,
+                "invalidations": self.invalidations,
+                "data_version":  self._version,
+            }
+
+
+response_cache = ResponseCache("responses")
+# full sold_to rankings behind every top_limit filter (see sold_to_ranking)
+ranking_cache = ResponseCache("rankings", max_bytes=int(os.getenv("RANKING_CACHE_BYTES", str(16 * 1024 * 1024))))
+
+_data_versions = {}  # snapshot_path() (None on MySQL) -> (version, modified, checked)
+_data_version_lock = threading.Lock()
+
+def _data_version_entry():
+    now = time()
+    path = snapshot_path() if USE_SQLITE else None
+    # held across the check so concurrent callers wait for the fresh value
+    # instead of getting the previous one (None right after start)
+    with _data_version_lock:
+        entry = _data_versions.get(path)
+        if entry is not None and now - entry[2] < DATA_VERSION_CHECK_SECS:
+            return entry
+
+        if USE_SQLITE:
+            try:
+                st = os.stat(path)
+                version = f"{os.path.basename(path)}:{st.st_mtime_ns}:{st.st_size}"
+                modified = st.st_mtime
+            except OSError:
+                version = modified = None
+        else:
+            try:
+                with get_cursor(dictionary=False) as cur:
+                    cur.execute("""
+                        SELECT MAX(UPDATE_TIME), COUNT(*)
+                          FROM information_schema.tables
+                         WHERE table_schema = DATABASE()
+                    """, label="data_version.mysql_sql")
+                    row = cur.fetchone()
+                version = f"{row[0]}:{row[1]}" if row else None
+                modified = row[0].timestamp() if row and row[0] is not None else None
+            except Exception as e:
+                print("[WARN] data version check failed:", e)
+                version, modified = entry[:2] if entry is not None else (None, None)
+
+        _data_versions.pop(path, None)
+        _data_versions[path] = entry = (version, modified, now)
+        while len(_data_versions) > 4:  # the current file and the ones requests may still pin
+            del _data_versions[next(iter(_data_versions))]
+        return entry
+
+def data_version():
+    """
+    Cheap fingerprint of the underlying data, re-read at most every
+    DATA_VERSION_CHECK_SECS:
+      - SQLite: snapshot file name + mtime + size, of snapshot_path() -- the
+        request's pinned file, so it always names the one queries run on
+      - MySQL : newest information_schema UPDATE_TIME of the schema
+    """
+    return _data_version_entry()[0]
+
+def data_modified():
+    """Epoch seconds the data behind data_version() last changed, or None."""
+    return _data_version_entry()[1]
+
+# extra request args (beyond parse_filters) that change a chart's result
+_CACHE_ARG_NORMALIZERS = {
+    "top_limit": lambda v: int(v or 0),
+    "group_by":  lambda v: (v or "region").strip(),
+    "month":     lambda v: int(v or 11),
+    "zoom":      lambda v: int(v) if v not in (None, "") else None,
+    "bbox":      lambda v: parse_bbox(v),
+    "origin":    lambda v: (v or "").strip() or None,
+    "lat":       lambda v: float(v) if v not in (None, "") else None,
+    "lng":       lambda v: float(v) if v not in (None, "") else None,
+    "k":         lambda v: int(v) if v not in (None, "") else None,
+    "radius_km": lambda v: float(v) if v not in (None, "") else None,
+}
+
+def request_key(extra_args, args=None):
+    """
+    The normalized parameters of a chart request (request.args, or the given
+    args mapping): the parse_filters() items, the given extra args and the
+    response format. Raises ValueError on bad input.
+    """
+    args = request.args if args is None else args
+    extras = tuple(_CACHE_ARG_NORMALIZERS[a](args.get(a)) for a in extra_args)
+    return tuple(sorted(parse_filters(_ArgsRequest(args)).items())), extras, response_format(args)
+
+def response_cache_key(name, extra_args, args=None):
+    """(name, *request_key()) when chart `name` may use the response cache now, else None."""
+    if not RESPONSE_CACHE or not snapshot_is_current():
+        return None
+    try:
+        return (name, *request_key(extra_args, args))
+    except ValueError:
+        return None  # let the endpoint report bad input
 
+def cached_response(*extra_args):
+    """
+    Cache a chart endpoint's 200 JSON response, keyed on the endpoint, the
+    normalized parse_filters() tuple and the given extra args:
+        @app.get("/api/daily_breakdown")
+        @cached_response("top_limit", "group_by")
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = response_cache_key(fn.__name__, extra_args)
+            if key is None:
+                return fn(*args, **kwargs)
+
+            version = data_version()
+            response_cache.check_version(version)
+            body = response_cache.get(key)
+            if body is not None:
+                return Response(body, status=200, mimetype="application/json")
+
+            resp = app.make_response(fn(*args, **kwargs))
+            if resp.status_code == 200 and resp.mimetype == "application/json":
+                response_cache.put(key, resp.get_data(), version=version)
+            return resp
+        return wrapper
+    return decorator
+
+# Cache-Control sent with every conditional response; API_CACHE_CONTROL_<ENDPOINT>
+# (e.g. API_CACHE_CONTROL_SALES_MAP="private, max-age=60") overrides it per endpoint.
+# The default makes browsers revalidate each time, so a snapshot swap shows at once.
+API_CACHE_CONTROL = os.getenv("API_CACHE_CONTROL", "no-cache")
+
+def conditional_get(*extra_args, raw_args=False):
+    """
+    Strong ETag from the data version, the endpoint and its normalized request
+    parameters (request_key(), or the sorted raw query args with raw_args=True),
+    plus Last-Modified from the snapshot. A matching If-None-Match (or, without
+    one, a fresh If-Modified-Since) gets a 304 before the endpoint runs:
+        @app.get("/api/daily_breakdown")
+        @conditional_get("top_limit", "group_by")
+        @cached_response("top_limit", "group_by")
+    """
+    def decorator(fn):
+        cache_control = os.getenv(f"API_CACHE_CONTROL_{fn.__name__.upper()}", API_CACHE_CONTROL)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            version = data_version()
+            if version is None or request.method not in ("GET", "HEAD"):
+                return fn(*args, **kwargs)
+            try:
+                params = sorted(request.args.items(multi=True)) if raw_args else request_key(extra_args)
+            except ValueError:
+                return fn(*args, **kwargs)  # let the endpoint report bad input
+            tag = hashlib.sha1(repr((version, fn.__name__, params)).encode()).hexdigest()[:32]
+            modified = data_modified()
+
+            matched = None
+            if request.if_none_match:
+                # compress_response() suffixes the tag of an encoded body
+                matched = next((t for t in (tag, *(f"{tag}-{e}" for e in _ENCODINGS))
+                                if request.if_none_match.contains(t)), None)
+                fresh = matched is not None
+            else:
+                since = request.if_modified_since
+                fresh = since is not None and modified is not None and int(modified) <= since.timestamp()
+            if fresh:
+                resp = Response(status=304)
+                tag = matched or tag
+            else:
+                resp = app.make_response(fn(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(tag)
+            if modified is not None:
+                resp.last_modified = int(modified)
+            resp.headers["Cache-Control"] = cache_control
+            return resp
+        return wrapper
+    return decorator
+
+@app.get("/api/_cache")
+def cache_status():
+    return jsonify({"enabled": RESPONSE_CACHE,
+                    **response_cache.status(),
+                    "rankings": ranking_cache.status()})
+
+@app.post("/api/_cache/clear")
+def cache_clear():
+    response_cache.clear()
+    ranking_cache.clear()
+    return jsonify({"ok": True})
+
+# ----------------------------- Response encoding ---------------------------------
+# jsonify() goes through orjson when it is installed. ?format=columnar turns a
+# list of row dicts into column arrays, dictionary-encoding repetitive string
+# columns (static/app.js fromColumnar() decodes it), and /api JSON bodies of at
+# least COMPRESS_MIN_BYTES are brotli/gzip compressed per Accept-Encoding.
+try:
+    import orjson
+except ImportError:  # stdlib json via Flask's default provider
+    orjson = None
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))  # 0 disables compression
+COMPRESS_LEVEL     = int(os.getenv("COMPRESS_LEVEL", "6"))         # gzip level; brotli quality is level - 1
+_ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+
+class _PayloadStats:
+    """Per-endpoint payload sizes and encode times (read via /api/_payload)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, **values):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                "serialized": 0, "json_bytes": 0, "serialize_secs": 0.0, "serialize_max": 0.0,
+                "compressed": 0, "raw_bytes": 0, "sent_bytes": 0, "compress_secs": 0.0})
+            for name, value in values.items():
+                if name == "serialize_secs":
+                    entry["serialize_max"] = max(entry["serialize_max"], value)
+                entry[name] += value
+
+    def as_dict(self):
+        with self._lock:
+            out = {}
+            for endpoint, e in sorted(self._endpoints.items()):
+                out[endpoint] = {
+                    "serialized":        e["serialized"],
+                    "json_bytes_avg":    e["json_bytes"] // e["serialized"] if e["serialized"] else 0,
+                    "serialize_avg_ms":  round(e["serialize_secs"] / e["serialized"] * 1000, 3) if e["serialized"] else 0.0,
+                    "serialize_max_ms":  round(e["serialize_max"] * 1000, 3),
+                    "compressed":        e["compressed"],
+                    "compress_ratio":    round(e["sent_bytes"] / e["raw_bytes"], 4) if e["raw_bytes"] else 0.0,
+                    "compress_avg_ms":   round(e["compress_secs"] / e["compressed"] * 1000, 3) if e["compressed"] else 0.0,
+                }
+            return out
+
+payload_stats = _PayloadStats()
+
+
+def response_format(args=None):
+    args = request.args if args is None else args
+    return "columnar" if (args.get("format") or "").strip().lower() == "columnar" else "rows"
+
+def to_columnar(rows):
+    """
+    [{"day": 1, "group_label": "NSW", ...}, ...] ->
+        {"length": n, "columns": {"day": [1, ...], "group_label": {"dict": ["NSW", ...], "codes": [0, ...]}}}
+    String columns with at most half as many distinct values as rows are
+    dictionary-encoded; anything that is not a list of dicts is returned as is.
+    """
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return rows
+    columns = {}
+    for name in (rows[0] if rows else ()):
+        values = [r.get(name) for r in rows]
+        if all(v is None or isinstance(v, str) for v in values):
+            labels = {}
+            codes = [labels.setdefault(v, len(labels)) for v in values]
+            if len(labels) * 2 <= len(values):
+                columns[name] = {"dict": list(labels), "codes": codes}
+                continue
+        columns[name] = values
+    return {"length": len(rows), "columns": columns}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider on orjson (same values; sorted keys, UTF-8 instead of
+    \\u escapes, NaN as null). Also applies ?format=columnar and times jsonify().
+    """
+    _OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                if orjson is not None else 0)
+
+    def _dumps_bytes(self, obj):
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._OPTIONS)
+            except (TypeError, orjson.JSONEncodeError):
+                pass  # e.g. ints beyond 64 bits: let the stdlib encoder have it
+        return super().dumps(obj).encode()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs or orjson is None:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode()
+
+    def response(self, *args, **kwargs):
+        t0 = perf_counter()
+        obj = self._prepare_response_obj(args, kwargs)
+        if has_request_context() and response_format() == "columnar":
+            obj = to_columnar(obj)
+        body = self._dumps_bytes(obj)
+        if has_request_context():
+            seconds = perf_counter() - t0
+            g.serialize_secs = seconds
+            payload_stats.record(request.endpoint, serialized=1, json_bytes=len(body), serialize_secs=seconds)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = FastJSONProvider(app)
+
+
+@app.after_request
+def compress_response(resp):
+    """brotli / gzip for large /api JSON bodies, plus Server-Timing for the encode steps."""
+    if not request.path.startswith("/api/") or resp.mimetype != "application/json":
+        return resp
+    timing = []
+    if "serialize_secs" in g:
+        timing.append(f"serialize;dur={g.serialize_secs * 1000:.2f}")
+    if COMPRESS_MIN_BYTES > 0:
+        resp.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(_ENCODINGS)
+        if (encoding and resp.status_code == 200 and not resp.direct_passthrough
+                and "Content-Encoding" not in resp.headers):
+            raw = resp.get_data()
+            if len(raw) >= COMPRESS_MIN_BYTES:
+                t0 = perf_counter()
+                if encoding == "br":
+                    body = brotli.compress(raw, quality=max(COMPRESS_LEVEL - 1, 0))
+                else:
+                    body = gzip.compress(raw, compresslevel=COMPRESS_LEVEL, mtime=0)
+                seconds = perf_counter() - t0
+                resp.set_data(body)
+                resp.headers["Content-Encoding"] = encoding
+                tag, weak = resp.get_etag()
+                if tag:  # a different representation needs its own strong tag
+                    resp.set_etag(f"{tag}-{encoding}", weak)
+                timing.append(f"compress;dur={seconds * 1000:.2f}")
+                payload_stats.record(request.endpoint, compressed=1, raw_bytes=len(raw),
+                                     sent_bytes=len(body), compress_secs=seconds)
+    if timing:
+        resp.headers["Server-Timing"] = ", ".join(timing)
+    return resp
+
+@app.get("/api/_payload")
+def payload_status():
+    return jsonify({"orjson": orjson is not None, "encodings": _ENCODINGS,
+                    "compress_min_bytes": COMPRESS_MIN_BYTES,
+                    "endpoints": payload_stats.as_dict()})
+
+# ----------------------------- Columnar engine ---------------------------------
+# COLUMNAR_ENGINE=1 (SQLite snapshot only): answer the sales chart queries from
+# in-memory NumPy columns (columnar.py). Built in the background at startup and
+# rebuilt whenever data_version() changes; endpoints use SQL until it is ready.
+COLUMNAR_ENGINE = os.getenv("COLUMNAR_ENGINE") == "1" and USE_SQLITE
+try:
+    import columnar
+except ImportError:  # numpy not installed -> SQL only
+    columnar = None
+
+_engine = {"engine": None, "building": None}
+_engine_lock = threading.Lock()
+
+def _build_engine(version):
+    try:
+        eng = columnar.ColumnarEngine.load(get_cursor)
+        eng.version = version
+        _engine["engine"] = eng
+        print(f"[INFO] columnar engine ready in {eng.load_seconds:.2f}s: {eng.status()['facts']}")
+    except Exception as e:
+        print("[WARN] columnar engine build failed:", e)
     finally:
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
+        with _engine_lock:
+            _engine["building"] = None
 
-    return jsonify(rows)
+def get_engine(wait=False):
+    """The columnar engine for the current data version, or None (use SQL)."""
+    if not COLUMNAR_ENGINE or columnar is None:
+        return None
+    version = data_version()
+    eng = _engine["engine"]
+    if eng is not None and eng.version == version:
+        return eng
+    if not snapshot_is_current():
+        return None  # request still on a replaced snapshot: SQL, leave the engine alone
+    if eng is not None:
+        _engine["engine"] = None  # stale: SQL on the new snapshot until the rebuild lands
+    with _engine_lock:
+        if _engine["building"] is None:
+            # the build reads the snapshot this request is pinned to
+            _engine["building"] = threading.Thread(target=contextvars.copy_context().run,
+                                                   args=(_build_engine, version), daemon=True)
+            _engine["building"].start()
+        builder = _engine["building"]
+    if wait:
+        builder.join()
+        eng = _engine["engine"]
+        return eng if eng is not None and eng.version == version else None
+    return None
+
+def engine_group_sum(table, keys, total, value, f, top_limit):
+    """Columnar answer for a chart aggregate, or None when SQL has to run."""
+    eng = get_engine()
+    if eng is None:
+        return None
+    try:
+        top = None
+        if top_limit > 0:
+            top = fetch_top_sold_to(None, f, value, top_limit)
+            if not top:
+                return []
+        return eng.group_sum(table, keys, total, value, f, top_sold_to=top)
+    except columnar.Unsupported:
+        return None
 
-# ----------------------------- Daily Target (Oct) ---------------------------------
-import calendar
-@app.get("/api/daily_target")
-def daily_target():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
+@app.get("/api/_engine")
+def engine_status():
+    eng = get_engine()
+    return jsonify({"enabled": COLUMNAR_ENGINE, "ready": eng is not None,
+                    **(eng.status() if eng is not None else {})})
+
+# ----------------------------- Aggregation engine ---------------------------------
+# Every chart series is one Aggregate spec: SUM of a metric from a fact source,
+# by a time bucket (and optionally a group_by dimension), under the request
+# filters, optionally restricted to the top-N sold_to. run_aggregate() resolves
+# the source (rollup routing / flag columns), tries the columnar engine, and
+# otherwise runs SQL compiled once per statement shape: the same shape always
+# yields the same text, so the driver's prepared-statement cache is reused and
+# only the parameters change between requests.
+
+# group_by -> column for the *_breakdown series
+GROUP_DIMENSIONS = {
+    "product_group": "s.product_group",
+    "region":        "cus.bde_state",
+    "salesman":      "cus.salesman_name",
+    "sold_to_group": "cus.sold_to_group",
+    "sold_to":       "cus.sold_to_name",
+    "pattern":       "s.pattern",
+}
+AGGREGATE_SQL_CACHE = int(os.getenv("AGGREGATE_SQL_CACHE", "1024"))  # compiled statements kept per worker
+
+
+class TargetSource:
+    """target2025 in FactSource terms: categories via its `special` column, no rollups."""
+
+    def __init__(self, fact, f):
+        self.fact = self.table = fact
+        self.f = f
+
+    def filters(self, alias, customer=True, product=True):
+        f = self.f
+        joins, wh, params = build_customer_filters(alias, f, use_sold_to_name=False) if customer else ([], [], [])
+        cat_joins, cat_where = category_target_filters(alias, f["category"])
+        joins += cat_joins
+        wh    += cat_where
+        if product and f["product_group"] != "ALL":
+            wh.append(f"{alias}.product_group = %s")
+            params.append(f["product_group"])
+        if product and f["pattern"] != "ALL":
+            wh.append(f"{alias}.pattern = %s")
+            params.append(f["pattern"])
+        return joins, wh, params
 
-    # which month? default to October (10) if nothing is passed
-    month = int(request.args.get("month", 11))
+    def total(self, alias, value):
+        return f"SUM({alias}.{value})"
 
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
 
-    joins, wh, params = build_customer_filters("t", f, use_sold_to_name=False)
+class Aggregate:
+    """
+    Declarative chart query.
+      fact / alias  table the series reads and its alias in the SQL
+      bucket        (expression, output alias) of the time bucket
+      total         output alias of SUM(<request metric>); or measures=((alias, column), ...)
+      grouped       also group by GROUP_DIMENSIONS[group_by] AS group_label
+      source        "rollup" (route_fact), "listed" (the fact with its flag columns) or "target"
+      ranking       top-N from the YTD sales ranking ("sales") or from this fact itself ("own")
+      customer / product  apply the customer / product_group+pattern filters
+      where         extra predicates, bound from run_aggregate(params=...)
+      fill          (key, buckets) -> one {key: bucket, "value": total} per bucket, 0 when missing
+    """
 
-    # category filters for target table
-    cat_joins, cat_where = category_target_filters("t", f["category"])
-    joins += cat_joins
-    wh    += cat_where
+    def __init__(self, name, fact, alias, bucket, total="value", *, measures=None, grouped=False,
+                 source="rollup", ranking="sales", customer=True, product=True, where=(), fill=None):
+        self.name, self.fact, self.alias, self.bucket = name, fact, alias, bucket
+        self.measures = measures or ((total, None),)
+        self.grouped, self.source, self.ranking = grouped, source, ranking
+        self.customer, self.product, self.where, self.fill = customer, product, tuple(where), fill
+
+    def resolve(self, f, group_col, top_limit):
+        if self.source == "target":
+            return TargetSource(self.fact, f)
+        if self.source == "listed":
+            return listed_source(self.fact, f)
+        return route_fact(self.fact, f, *([group_col] if group_col else []), top_limit=top_limit)
+
+    def series(self, rows):
+        """Rows -> the filled series (or the rows themselves without `fill`)."""
+        if self.fill is None:
+            return rows
+        key, buckets = self.fill
+        total = self.measures[0][0]
+        values = {int(r[self.bucket[1]]): float(r[total] or 0) for r in rows}
+        return [{key: b, "value": values.get(b, 0)} for b in buckets]
+
+
+_aggregate_sql = OrderedDict()  # statement shape -> SQL text, least recently used first
+_aggregate_sql_lock = threading.Lock()  # dashboard threads compile concurrently
+
+def compile_aggregate(spec, src, value, group_col, joins, wh, n_top):
+    """(series SQL, own-ranking SQL) for one statement shape, LRU-cached."""
+    key = (spec.name, src.table, getattr(src, "columns", None), src.f["category"], value,
+           group_col, tuple(joins), tuple(wh), n_top)
+    with _aggregate_sql_lock:
+        compiled = _aggregate_sql.get(key)
+        if compiled is not None:
+            _aggregate_sql.move_to_end(key)
+    CACHE_LOOKUPS.inc("statements", "miss" if compiled is None else "hit")
+    if compiled is not None:
+        return compiled
+
+    a = spec.alias
+    bucket_expr, bucket_alias = spec.bucket
+    join_sql = " ".join(joins)
+    keys = [bucket_expr] + ([group_col] if group_col else [])
+    select = [f"{bucket_expr} AS {bucket_alias}"] + ([f"{group_col} AS group_label"] if group_col else [])
+    select += [f"{src.total(a, col or value)} AS {out}" for out, col in spec.measures]
+
+    rank_sql = None
+    if spec.ranking == "own":
+        rank_where = ("WHERE " + " AND ".join(wh)) if wh else ""
+        rank_sql = f"""
+          SELECT {a}.sold_to AS sold_to
+            FROM {src.table} {a}
+            {join_sql}
+            {rank_where}
+           GROUP BY {a}.sold_to
+           ORDER BY {src.total(a, value)} DESC
+           LIMIT %s
+        """
+    wh2 = list(wh)
+    if n_top:
+        wh2.append(f"{a}.sold_to IN ({','.join(['%s'] * n_top)})")
+    where_sql = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
+    sql = f"""
+      SELECT {', '.join(select)}
+        FROM {src.table} {a}
+        {join_sql}
+        {where_sql}
+       GROUP BY {', '.join(keys)}
+       ORDER BY {bucket_expr}
+    """
+    compiled = (sql, rank_sql)
+    with _aggregate_sql_lock:
+        _aggregate_sql[key] = compiled
+        while len(_aggregate_sql) > AGGREGATE_SQL_CACHE:
+            _aggregate_sql.popitem(last=False)
+    return compiled
+
+def run_aggregate(spec, f, top_limit=0, group_by=None, params=()):
+    """Rows of `spec` under filters f; params bind spec.where in order."""
+    value = "qty" if f["metric"] == "qty" else "amt"
+    group_col = GROUP_DIMENSIONS[group_by] if spec.grouped else None
+
+    # in-memory columnar engine when loaded, SQL below otherwise
+    if columnar is not None and spec.fact in columnar.FACT_TABLES and not spec.where \
+            and len(spec.measures) == 1 and spec.measures[0][1] is None:
+        keys = [spec.bucket] + ([(group_col, "group_label")] if group_col else [])
+        rows = engine_group_sum(spec.fact, keys, spec.measures[0][0], value, f, top_limit)
+        if rows is not None:
+            return rows
+
+    src = spec.resolve(f, group_col, top_limit)
+    joins, wh, base_params = src.filters(spec.alias, customer=spec.customer, product=spec.product)
+    wh += spec.where
+    base_params += params
+
+    with get_cursor() as cur:
+        top_sold_to = None
+        if top_limit > 0:
+            if spec.ranking == "sales":
+                top_sold_to = fetch_top_sold_to(cur, f, value, top_limit)
+            else:
+                rank_sql = compile_aggregate(spec, src, value, group_col, joins, wh, 0)[1]
+                cur.execute(rank_sql, tuple(base_params) + (top_limit,), label=f"{spec.name}.top_sql")
+                top_sold_to = [r["sold_to"] for r in cur.fetchall()]
+            if not top_sold_to:
+                return []  # no matching customers
+
+        sql = compile_aggregate(spec, src, value, group_col, joins, wh, len(top_sold_to or ()))[0]
+        cur.execute(sql, tuple(base_params) + tuple(top_sold_to or ()), label=f"{spec.name}.sql")
+        return cur.fetchall()
+
+
+AGGREGATES = {spec.name: spec for spec in (
+    Aggregate("daily_sales",       "sales_2511",    "s", ("s.day", "day_num"), "daily_total",
+              fill=("day", range(1, 31))),
+    Aggregate("daily_breakdown",   "sales_2511",    "s", ("s.day", "day"), grouped=True),
+    # one month of target2025, spread evenly over its days by the endpoint
+    Aggregate("daily_target",      "target2025",    "t", ("t.month", "month_num"), "monthly_total",
+              source="target", ranking="own", product=False, where=("t.month = %s",)),
+    Aggregate("monthly_sales",     "sales_2501_11", "s", ("s.month", "month_num"), "monthly_total",
+              fill=("month", range(1, 12))),
+    Aggregate("monthly_breakdown", "sales_2501_11", "s", ("s.month", "month"), grouped=True),
+    Aggregate("monthly_target",    "target2025",    "t", ("t.month", "month_num"), "monthly_total",
+              source="target", ranking="own", fill=("month", range(1, 13))),
+    Aggregate("yearly_sales",      "sales_21_2511", "s", ("s.year", "year_num"), "yearly_total",
+              fill=("year", range(2021, 2026))),
+    Aggregate("yearly_breakdown",  "sales_21_2511", "s", ("s.year", "year"), grouped=True),
+    # profit has no ship_to level: category and product filters only
+    Aggregate("profit_monthly",    "profit_2501_10", "p", ("CAST(p.month AS UNSIGNED)", "month"),
+              measures=(("gross", "gross"), ("sd", "sales_deduction"),
+                        ("cogs", "cogs"), ("op_cost", "operating_cost")),
+              source="listed", customer=False),
+)}
+
+@app.get("/api/_aggregates")
+def aggregate_status():
+    with _aggregate_sql_lock:
+        compiled = len(_aggregate_sql)
+    return jsonify({"compiled": compiled, "max": AGGREGATE_SQL_CACHE, "series": sorted(AGGREGATES)})
+
+
+# ----------------------------- Lookup index ---------------------------------
+# The cascade selects (sold_to_groups -> sold_to_names -> ship_to_names,
+# product_group -> patterns) answered from sorted in-memory lists built once per
+# data version (SQLite snapshot only: MySQL collations order and compare
+# differently, so it keeps the SQL). ?q= narrows any list to a typeahead prefix.
+LOOKUP_INDEX = os.getenv("LOOKUP_INDEX", "1") == "1" and USE_SQLITE
+
+class PrefixList:
+    """A lookup list in display order plus a casefolded sorted copy for prefix bisects."""
+    __slots__ = ("items", "_folded", "_pos")
+
+    def __init__(self, items):
+        self.items = items
+        pairs = sorted((v.casefold(), i) for i, v in enumerate(items) if v is not None)
+        self._folded = [k for k, _ in pairs]
+        self._pos = [i for _, i in pairs]
+
+    def prefix(self, q):
+        """Items starting with q (case-insensitive), in display order."""
+        if not q:
+            return self.items
+        q = q.casefold()
+        lo = bisect_left(self._folded, q)
+        hi = bisect_left(self._folded, q + "\U0010ffff", lo)
+        return [self.items[i] for i in sorted(self._pos[lo:hi])]
+
+def _trim(v):
+    """SQLite TRIM(): spaces only, NULL stays NULL."""
+    return None if v is None else str(v).strip(" ")
+
+def _nulls_first(v):
+    return (v is not None, v or "")
+
+def _sorted_lists(groups, key=None):
+    return {k: PrefixList(sorted(vs, key=key)) for k, vs in groups.items()}
+
+class LookupIndex:
+    """
+    Everything the lookup endpoints return, keyed the way their SQL filtered:
+        sold_to_names   by the raw sold_to_group (customer.sold_to_group = ?)
+        ship_to_names   by TRIM(sold_to_name), else TRIM(sold_to_group)
+        patterns        by the raw product_group
+    Lists keep the SQL ORDER BY (binary collation, NULL first).
+    """
+    def __init__(self, customers, products):
+        groups, names, ships = set(), set(), set()
+        names_by_group, ships_by_name, ships_by_group = {}, {}, {}
+        for group, name, ship in customers:
+            g, n, s = _trim(group), _trim(name), _trim(ship)
+            if g:
+                groups.add(g)
+            if n:
+                names.add(n)
+                names_by_group.setdefault(group, set()).add(n)
+            if s:
+                ships.add(s)
+                if n is not None:
+                    ships_by_name.setdefault(n, set()).add(s)
+                if g is not None:
+                    ships_by_group.setdefault(g, set()).add(s)
+
+        patterns, patterns_by_group = set(), {}
+        for pg, pattern in products:
+            p = _trim(pattern)
+            patterns.add(p)
+            patterns_by_group.setdefault(pg, set()).add(p)
+
+        self.sold_to_groups = PrefixList(sorted(groups))
+        self.sold_to_names = PrefixList(sorted(names))
+        self.names_by_group = _sorted_lists(names_by_group)
+        self.ship_to_names = PrefixList(sorted(ships))
+        self.ships_by_name = _sorted_lists(ships_by_name)
+        self.ships_by_group = _sorted_lists(ships_by_group)
+        self.product_groups = PrefixList(sorted({pg for pg, _ in products}))
+        self.patterns = PrefixList(sorted(patterns, key=_nulls_first))
+        self.patterns_by_group = _sorted_lists(patterns_by_group, key=_nulls_first)
+
+    @classmethod
+    def load(cls, cur):
+        t0 = perf_counter()
+        cur.execute("SELECT sold_to_group, sold_to_name, ship_to_name FROM customer", label="LookupIndex.customers_sql")
+        customers = cur.fetchall()
+        # (product_group, pattern) pairs from the smallest listed table that has both
+        tables = sorted((n, t) for t, cols, n in rollup_catalog().get("sales_2501_11", ())
+                        if {"product_group", "pattern"} <= cols)
+        table = tables[0][1] if tables else "sales_2501_11"
+        cur.execute(f"SELECT DISTINCT product_group, pattern FROM {table}", label="LookupIndex.products_sql")
+        products = cur.fetchall()
+        index = cls(customers, products)
+        index.load_seconds = perf_counter() - t0
+        return index
+
+_lookup = {"entry": (object(), None)}  # (data version, index), swapped as one
+_lookup_lock = threading.Lock()
+
+def lookup_index():
+    """The LookupIndex for the current data version, or None (use SQL)."""
+    if not LOOKUP_INDEX:
+        return None
+    version = data_version()
+    seen, index = _lookup["entry"]
+    if seen == version:
+        return index
+    if not snapshot_is_current():
+        return None  # request still on a replaced snapshot: SQL
+    with _lookup_lock:
+        seen, index = _lookup["entry"]
+        if seen != version:
+            try:
+                with get_cursor(dictionary=False) as cur:
+                    index = LookupIndex.load(cur)
+            except Exception as e:
+                print("[WARN] lookup index build failed:", e)
+                index = None
+            _lookup["entry"] = (version, index)
+    return index
+
+_NO_ITEMS = PrefixList([])
+
+def lookup_response(items):
+    """JSON list response for a lookup, narrowed by ?q= when given."""
+    if not isinstance(items, PrefixList):
+        items = PrefixList(items)
+    return jsonify(items.prefix((request.args.get("q") or "").strip()))
+
+@app.get("/api/_lookup")
+def lookup_status():
+    index = lookup_index()
+    if index is None:
+        return jsonify({"enabled": LOOKUP_INDEX, "ready": False})
+    return jsonify({"enabled": LOOKUP_INDEX, "ready": True,
+                    "load_seconds": round(index.load_seconds, 4),
+                    "sold_to_groups": len(index.sold_to_groups.items),
+                    "sold_to_names": len(index.sold_to_names.items),
+                    "ship_to_names": len(index.ship_to_names.items),
+                    "product_groups": len(index.product_groups.items),
+                    "patterns": len(index.patterns.items)})
 
-    # restrict to the chosen month only
-    wh.append("t.month = %s")
-    params.append(month)
+@app.get("/api/ping")
+def ping():
+    return {"ok": True}
 
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
+# ------------------------------------------------------------------------------
 
-    conn = get_connection()
-    cur  = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
+@app.route("/")
+def index():
+    return app.send_static_file("index.html")
 
-        # 1) If top_limit > 0, get top N sold_to from target2025
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT t.sold_to AS sold_to
-                FROM target2025 t
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY t.sold_to
-               ORDER BY SUM(t.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # nothing matched -> all days = 0
-            if not top_sold_to:
-                days_in_month = calendar.monthrange(2025, month)[1]
-                return jsonify([{"day": d, "value": 0} for d in range(1, days_in_month + 1)])
+@app.route("/map")
+def map_page():
+    return app.send_static_file("map.html")
 
-        # 2) Monthly target, optionally restricted to top N sold_to
-        wh2      = list(wh)
-        params2  = list(params)
 
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"t.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
 
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
+# ----------------------------- Chart series ---------------------------------
+# Each chart body is a plain function of the parsed filters and the request's
+# other args (a mapping), shared by its endpoint and /api/dashboard. Bad
+# arguments raise InvalidArgument (400).
+def _top_limit(args):
+    # 0 or missing = no top filter
+    return int(args.get("top_limit", 0) or 0)
 
-        sql = f"""
-          SELECT t.month AS month_num, SUM(t.{value}) AS monthly_total
-            FROM target2025 t
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY t.month
-           ORDER BY t.month
-        """
+def _group_by(args):
+    # Which dimension to group by?
+    group_by = (args.get("group_by") or "region").strip()
+    if group_by not in GROUP_DIMENSIONS:
+        raise InvalidArgument("invalid group_by")
+    return group_by
 
-        cur.execute(sql, tuple(params2))
-        row = cur.fetchone()
+def series_data(name, f, args):
+    """A filled time series: daily / monthly / yearly sales, monthly target."""
+    spec = AGGREGATES[name]
+    return spec.series(run_aggregate(spec, f, _top_limit(args)))
 
-    finally:
-        cur.close()
-        conn.close()
+def breakdown_data(name, f, args):
+    """A *_breakdown series, stacked by args group_by."""
+    return run_aggregate(AGGREGATES[name], f, _top_limit(args), _group_by(args))
 
-    monthly_total = float(row["monthly_total"] or 0) if row else 0
+import calendar
+def daily_target_data(f, args):
+    # which month? default to November (11) if nothing is passed
+    month = int(args.get("month", 11))
+    rows = run_aggregate(AGGREGATES["daily_target"], f, _top_limit(args), params=(month,))
+    monthly_total = float(rows[0]["monthly_total"] or 0) if rows else 0
 
     # how many days in that month? (2025 used as the year for target2025)
     days_in_month = calendar.monthrange(2025, month)[1]
     daily_value   = monthly_total / days_in_month if days_in_month else 0
 
     # return one entry per day: 1..N
-    return jsonify([
+    return [
         {"day": d, "value": daily_value}
         for d in range(1, days_in_month + 1)
-    ])
-
-# ----------------------------- Monthly Sales ---------------------------------
-@app.get("/api/monthly_sales")
-def monthly_sales():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
+    ]
 
-    # 0 or missing = no top filter, same behaviour as before
-    top_limit = int(request.args.get("top_limit", 0) or 0)
+def chart_response(body, *args):
+    """jsonify(body(...)), or 400 with the InvalidArgument message."""
+    try:
+        return jsonify(body(*args))
+    except InvalidArgument as e:
+        return jsonify({"error": str(e)}), 400
 
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
+# ----------------------------- Daily Sales ---------------------------------
+@app.get("/api/daily_sales")
+@conditional_get("top_limit")
+@cached_response("top_limit")
+def daily_sales():
+    return jsonify(series_data("daily_sales", parse_filters(request), request.args))
 
-    # category
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
+#
+# -------------------- Daily breakdown (stacked by group) -------------------
+@app.get("/api/daily_breakdown")
+@conditional_get("top_limit", "group_by")
+@cached_response("top_limit", "group_by")
+def daily_breakdown():
+    return chart_response(breakdown_data, "daily_breakdown", parse_filters(request), request.args)
 
-    # direct fields (indexable)
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s")
-        params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s")
-        params.append(f["pattern"])
+# ----------------------------- Daily Target (Oct) ---------------------------------
+@app.get("/api/daily_target")
+@conditional_get("top_limit", "month")
+@cached_response("top_limit", "month")
+def daily_target():
+    return jsonify(daily_target_data(parse_filters(request), request.args))
 
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
-
-        # 1) If top_limit > 0, get top N sold_to first
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # If nothing found, just return zeros for all 12 months
-            if not top_sold_to:
-                return jsonify([{"month": m, "value": 0} for m in range(1, 12)])
-
-        # 2) Monthly totals, optionally restricted to the top N sold_to
-        wh2 = list(wh)
-        params2 = list(params)
-
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
-
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
-
-        monthly_sql = f"""
-          SELECT s.month AS month_num, SUM(s.{value}) AS monthly_total
-            FROM sales_2501_11 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.month
-           ORDER BY s.month
-        """
-        cur.execute(monthly_sql, tuple(params2))
-        rows = cur.fetchall()
-
-    finally:
-        cur.close()
-        conn.close()
-
-    month_map = {int(r["month_num"]): float(r["monthly_total"] or 0) for r in rows}
-    return jsonify([{"month": m, "value": month_map.get(m, 0)} for m in range(1, 12)])
+# ----------------------------- Monthly Sales ---------------------------------
+@app.get("/api/monthly_sales")
+@conditional_get("top_limit")
+@cached_response("top_limit")
+def monthly_sales():
+    return jsonify(series_data("monthly_sales", parse_filters(request), request.args))
 
 # -------------------- Monthly breakdown (stacked by group) -------------------
 @app.get("/api/monthly_breakdown")
+@conditional_get("top_limit", "group_by")
+@cached_response("top_limit", "group_by")
 def monthly_breakdown():
-
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
-
-    # Which dimension to group by?
-    group_by = (request.args.get("group_by") or "region").strip()
-    group_cols = {
-        "product_group": "s.product_group",
-        "region":        "cus.bde_state",
-        "salesman":      "cus.salesman_name",
-        "sold_to_group": "cus.sold_to_group",
-        "sold_to":       "cus.sold_to_name",
-        "pattern":       "s.pattern",
-    }
-    if group_by not in group_cols:
-        return jsonify({"error": "invalid group_by"}), 400
-    group_col = group_cols[group_by]
-
-    # ---- Build base JOINs / WHEREs (same pattern as monthly_sales) ----
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
-
-    # Direct, index-friendly filters that live on sales2025
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s"); params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s");       params.append(f["pattern"])
-
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur  = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
-
-        # 1) If top_limit > 0, get top N sold_to first (same as monthly_sales)
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # no matching customers – nothing to show
-            if not top_sold_to:
-                return jsonify([])
-
-        # 2) Monthly breakdown, restricted to those top customers,
-        #    but stacked by group_col (region / salesman / etc.)
-        wh2     = list(wh)
-        params2 = list(params)
-
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
-
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
-
-        sql = f"""
-          SELECT s.Month AS month,
-                 {group_col} AS group_label,
-                 SUM(s.{value}) AS value
-            FROM sales_2501_11 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.Month, {group_col}
-           ORDER BY s.Month
-        """
-        cur.execute(sql, tuple(params2))
-        rows = cur.fetchall()
-
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
-
-    return jsonify(rows)
+    return chart_response(breakdown_data, "monthly_breakdown", parse_filters(request), request.args)
 
 
 # ----------------------------- Monthly Target ---------------------------------
 @app.get("/api/monthly_target")
+@conditional_get("top_limit")
+@cached_response("top_limit")
 def monthly_target():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
-
-    joins, wh, params = build_customer_filters("t", f, use_sold_to_name=False)
-
-    # category filters for target table
-    cat_joins, cat_where = category_target_filters("t", f["category"])
-    joins += cat_joins
-    wh    += cat_where
-
-    # if target table also has product_group / pattern, keep these:
-    if f.get("product_group") and f["product_group"] != "ALL":
-        wh.append("t.product_group = %s")
-        params.append(f["product_group"])
-    if f.get("pattern") and f["pattern"] != "ALL":
-        wh.append("t.pattern = %s")
-        params.append(f["pattern"])
-
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur  = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
-
-        # 1) If top_limit > 0, find top N sold_to in target2025
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT t.sold_to AS sold_to
-                FROM target2025 t
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY t.sold_to
-               ORDER BY SUM(t.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # no matches -> all months zero
-            if not top_sold_to:
-                return jsonify([{"month": m, "value": 0} for m in range(1, 13)])
-
-        # 2) Monthly target, optionally restricted to top N sold_to
-        wh2     = list(wh)
-        params2 = list(params)
-
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"t.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
-
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
-
-        monthly_sql = f"""
-          SELECT t.month AS month_num, SUM(t.{value}) AS monthly_total
-            FROM target2025 t
-            {' '.join(joins)}
-            {where_sql2}
-            GROUP BY t.month
-            ORDER BY t.month
-        """
-        cur.execute(monthly_sql, tuple(params2))
-        rows = cur.fetchall()
-
-    finally:
-        cur.close()
-        conn.close()
-
-    month_map = {int(r["month_num"]): float(r["monthly_total"] or 0) for r in rows}
-    return jsonify([{"month": m, "value": month_map.get(m, 0)} for m in range(1, 13)])
+    # top_limit ranks sold_to by their target2025 totals
+    return jsonify(series_data("monthly_target", parse_filters(request), request.args))
 
 # ----------------------------- Yearly Sales ---------------------------------
 @app.get("/api/yearly_sales")
+@conditional_get("top_limit")
+@cached_response("top_limit")
 def yearly_sales():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
-
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-
-    # category
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
-
-    # direct fields (indexable)
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s")
-        params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s")
-        params.append(f["pattern"])
-
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
-
-        # 1) If top_limit > 0, get top N sold_to first
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            if not top_sold_to:
-                # no data – return zeros for all years in range
-                return jsonify([{"year": y, "value": 0} for y in range(2021, 2026)])
-
-        # 2) Yearly totals, optionally restricted to those sold_to
-        wh2 = list(wh)
-        params2 = list(params)
-
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
-
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
-
-        yearly_sql = f"""
-          SELECT s.year AS year_num, SUM(s.{value}) AS yearly_total
-            FROM sales_21_2511 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.year
-           ORDER BY s.year
-        """
-        cur.execute(yearly_sql, tuple(params2))
-        rows = cur.fetchall()
-
-    finally:
-        cur.close()
-        conn.close()
-
-    year_map = {int(r["year_num"]): float(r["yearly_total"] or 0) for r in rows}
-    return jsonify([{"year": y, "value": year_map.get(y, 0)} for y in range(2021, 2026)])
+    return jsonify(series_data("yearly_sales", parse_filters(request), request.args))
 
 # -------------------- Yearly breakdown (stacked by group) -------------------
 @app.get("/api/yearly_breakdown")
+@conditional_get("top_limit", "group_by")
+@cached_response("top_limit", "group_by")
 def yearly_breakdown():
+    return chart_response(breakdown_data, "yearly_breakdown", parse_filters(request), request.args)
 
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
-
-    # Which dimension to group by?
-    group_by = (request.args.get("group_by") or "region").strip()
-    group_cols = {
-        "product_group": "s.product_group",
-        "region":        "cus.bde_state",
-        "salesman":      "cus.salesman_name",
-        "sold_to_group": "cus.sold_to_group",
-        "sold_to":       "cus.sold_to_name",
-        "pattern":       "s.pattern",
-    }
-    if group_by not in group_cols:
-        return jsonify({"error": "invalid group_by"}), 400
-    group_col = group_cols[group_by]
-
-    # ---- Build base JOINs / WHEREs (same pattern as yearly_sales) ----
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
-
-    # Direct, index-friendly filters that live on sales212510
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s"); params.append(f["product_group"])
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s");       params.append(f["pattern"])
-
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur  = conn.cursor(dictionary=True)
-    try:
-        top_sold_to = None
-
-        # 1) If top_limit > 0, get top N sold_to first (same as yearly_sales)
-        if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
-
-            # no data – nothing to show
-            if not top_sold_to:
-                return jsonify([])
-
-        # 2) Yearly breakdown, restricted to those top customers,
-        #    but stacked by group_col
-        wh2     = list(wh)
-        params2 = list(params)
-
-        if top_sold_to:
-            placeholders = ",".join(["%s"] * len(top_sold_to))
-            wh2.append(f"s.sold_to IN ({placeholders})")
-            params2.extend(top_sold_to)
-
-        where_sql2 = ("WHERE " + " AND ".join(wh2)) if wh2 else ""
-
-        sql = f"""
-          SELECT s.year AS year,
-                 {group_col} AS group_label,
-                 SUM(s.{value}) AS value
-            FROM sales_21_2511 s
-            {' '.join(joins)}
-            {where_sql2}
-           GROUP BY s.year, {group_col}
-           ORDER BY s.year
-        """
-        cur.execute(sql, tuple(params2))
-        rows = cur.fetchall()
-
-    finally:
-        try:
-            cur.close()
-            conn.close()
-        except:
-            pass
-
-    return jsonify(rows)
 
 # ---------------------- lookups used by the UI (optional) --------------------
 @app.get("/api/sold_to_groups")
+@conditional_get(raw_args=True)
 def sold_to_groups():
+    index = lookup_index()
+    if index is not None:
+        return lookup_response(index.sold_to_groups)
     try:
-        conn = get_connection(); cur = conn.cursor()
-        cur.execute("""
-            SELECT DISTINCT TRIM(sold_to_group)
-            FROM customer
-            WHERE sold_to_group IS NOT NULL AND TRIM(sold_to_group) <> ''
-            ORDER BY TRIM(sold_to_group)
-        """)
-        groups = [r[0] for r in cur.fetchall()]
-        cur.close(); conn.close()
-        return jsonify(groups)
+        with get_cursor(dictionary=False) as cur:
+            cur.execute("""
+                SELECT DISTINCT TRIM(sold_to_group)
+                FROM customer
+                WHERE sold_to_group IS NOT NULL AND TRIM(sold_to_group) <> ''
+                ORDER BY TRIM(sold_to_group)
+            """, label="sold_to_groups.sql")
+            groups = [r[0] for r in cur.fetchall()]
+        return lookup_response(groups)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.get("/api/sold_to_names")
+@conditional_get(raw_args=True)
 def sold_to_names():
     parent = request.args.get("sold_to_group", "ALL")
     top_limit = int(request.args.get("top_limit", 0) or 0)
 
     # ----------------- 1) No top_limit -> old behaviour -----------------
     if top_limit <= 0:
-        try:
-            conn = get_connection(); cur = conn.cursor()
+        index = lookup_index()
+        if index is not None:
             if parent != "ALL":
-                cur.execute("""
-                    SELECT DISTINCT TRIM(sold_to_name)
-                    FROM customer
-                    WHERE sold_to_group = %s
-                      AND sold_to_name IS NOT NULL
-                      AND TRIM(sold_to_name) <> ''
-                    ORDER BY TRIM(sold_to_name)
-                """, (parent,))
-            else:
-                cur.execute("""
-                    SELECT DISTINCT TRIM(sold_to_name)
-                    FROM customer
-                    WHERE sold_to_name IS NOT NULL
-                      AND TRIM(sold_to_name) <> ''
-                    ORDER BY TRIM(sold_to_name)
-                """)
-            names = [r[0] for r in cur.fetchall()]
-            cur.close(); conn.close()
-            return jsonify(names)
+                return lookup_response(index.names_by_group.get(parent, _NO_ITEMS))
+            return lookup_response(index.sold_to_names)
+        try:
+            with get_cursor(dictionary=False) as cur:
+                if parent != "ALL":
+                    cur.execute("""
+                        SELECT DISTINCT TRIM(sold_to_name)
+                        FROM customer
+                        WHERE sold_to_group = %s
+                          AND sold_to_name IS NOT NULL
+                          AND TRIM(sold_to_name) <> ''
+                        ORDER BY TRIM(sold_to_name)
+                    """, (parent,), label="sold_to_names.group_sql")
+                else:
+                    cur.execute("""
+                        SELECT DISTINCT TRIM(sold_to_name)
+                        FROM customer
+                        WHERE sold_to_name IS NOT NULL
+                          AND TRIM(sold_to_name) <> ''
+                        ORDER BY TRIM(sold_to_name)
+                    """, label="sold_to_names.all_sql")
+                names = [r[0] for r in cur.fetchall()]
+            return lookup_response(names)
         except Exception as e:
             import traceback; traceback.print_exc()
             return jsonify({"error": str(e)}), 500
@@ -1015,33 +2118,22 @@ def sold_to_names():
         f = parse_filters(request)
         value = "qty" if f["metric"] == "qty" else "amt"
 
-        joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-
-        # category filters
-        cat_joins, cat_where = category_filters("s", f["category"])
-        joins += cat_joins
-        wh    += cat_where
+        # customer / category / product filters on the smallest source with ship_to
+        src = route_fact("sales_2501_11", f, "cus.sold_to")
+        joins, wh, params = src.filters("s")
 
         # sold_to_group from parent – apply to *customer* table (cus)
         if parent != "ALL":
             wh.append("cus.sold_to_group = %s")
             params.append(parent)
 
-        # direct fields on sales table
-        if f["product_group"] != "ALL":
-            wh.append("s.product_group = %s")
-            params.append(f["product_group"])
-        if f["pattern"] != "ALL":
-            wh.append("s.pattern = %s")
-            params.append(f["pattern"])
-
         where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
 
         sql = f"""
           SELECT
               TRIM(cus.sold_to_name) AS name,
-              SUM(s.{value})         AS total_val
-          FROM sales_2501_11 s
+              {src.total("s", value)} AS total_val
+          FROM {src.table} s
           
           {' '.join(joins)}
           {where_sql}
@@ -1053,273 +2145,334 @@ def sold_to_names():
         params2 = params + [top_limit]
 
         # plain cursor (works for MySQL and SQLite wrapper)
-        conn = get_connection(); cur = conn.cursor()
-        cur.execute(sql, tuple(params2))
-        rows = cur.fetchall()
-        cur.close(); conn.close()
+        with get_cursor(dictionary=False) as cur:
+            cur.execute(sql, tuple(params2), label="sold_to_names.sql")
+            rows = cur.fetchall()
 
         # first column is name
         names = [r[0] for r in rows]
-        return jsonify(names)
+        return lookup_response(names)
 
     except Exception as e:
         import traceback; traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 @app.get("/api/ship_to_names")
+@conditional_get(raw_args=True)
 def ship_to_names():
     # parent (big group)
     stg3    = (request.args.get("sold_to_group") or "ALL").strip()
     # child (sold-to name that user picked)
     sold_to = (request.args.get("sold_to") or "ALL").strip()
 
-    try:
-        conn = get_connection(); cur = conn.cursor()
-
-        where = ["ship_to_name IS NOT NULL", "TRIM(ship_to_name) <> ''"]
-        params = []
-
-        # 1) if user picked a specific sold_to_name → use that
+    index = lookup_index()
+    if index is not None:
         if sold_to.upper() != "ALL":
-            where.append("TRIM(sold_to_name) = %s")
-            params.append(sold_to)
-        # 2) otherwise, if user picked a group → use that
-        elif stg3.upper() != "ALL":
-            where.append("TRIM(sold_to_group) = %s")
-            params.append(stg3)
-
-        where_sql = "WHERE " + " AND ".join(where)
-
-        cur.execute(f"""
-            SELECT DISTINCT TRIM(ship_to_name)
-            FROM customer
-            {where_sql}
-            ORDER BY TRIM(ship_to_name)
-        """, tuple(params))
+            return lookup_response(index.ships_by_name.get(sold_to, _NO_ITEMS))
+        if stg3.upper() != "ALL":
+            return lookup_response(index.ships_by_group.get(stg3, _NO_ITEMS))
+        return lookup_response(index.ship_to_names)
 
-        names = [r[0] for r in cur.fetchall()]
-        cur.close(); conn.close()
-        return jsonify(names)
+    try:
+        with get_cursor(dictionary=False) as cur:
+            where = ["ship_to_name IS NOT NULL", "TRIM(ship_to_name) <> ''"]
+            params = []
+
+            # 1) if user picked a specific sold_to_name → use that
+            if sold_to.upper() != "ALL":
+                where.append("TRIM(sold_to_name) = %s")
+                params.append(sold_to)
+            # 2) otherwise, if user picked a group → use that
+            elif stg3.upper() != "ALL":
+                where.append("TRIM(sold_to_group) = %s")
+                params.append(stg3)
+
+            where_sql = "WHERE " + " AND ".join(where)
+
+            cur.execute(f"""
+                SELECT DISTINCT TRIM(ship_to_name)
+                FROM customer
+                {where_sql}
+                ORDER BY TRIM(ship_to_name)
+            """, tuple(params), label="ship_to_names.sql")
+
+            names = [r[0] for r in cur.fetchall()]
+        return lookup_response(names)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.get("/api/product_group")
+@conditional_get(raw_args=True)
 def product_group():
+    index = lookup_index()
+    if index is not None:
+        return lookup_response(index.product_groups)
     try:
-        conn = get_connection(); cur = conn.cursor()
-        cur.execute("SELECT DISTINCT product_group FROM sales_2501_11")
-        groups = sorted(r[0] for r in cur.fetchall())
-        cur.close(); conn.close()
-        return jsonify(groups)
+        with get_cursor(dictionary=False) as cur:
+            cur.execute("SELECT DISTINCT product_group FROM sales_2501_11", label="product_group.sql")
+            groups = sorted(r[0] for r in cur.fetchall())
+        return lookup_response(groups)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
     
 @app.get("/api/patterns")
+@conditional_get(raw_args=True)
 def patterns():
     product_group = request.args.get("product_group", "ALL")
-    try:
-        conn = get_connection(); cur = conn.cursor()
+    index = lookup_index()
+    if index is not None:
         if product_group and product_group != "ALL":
-            cur.execute("""
-                SELECT DISTINCT TRIM(pattern)
-                FROM sales_2501_11
-                WHERE product_group = %s
-                ORDER BY TRIM(pattern)
-            """, (product_group,))
-        else:
-            cur.execute("""
-                SELECT DISTINCT TRIM(pattern)
-                FROM sales_2501_11
-                ORDER BY TRIM(pattern)
-            """)
-        names = [r[0] for r in cur.fetchall()]
-        cur.close(); conn.close()
-        return jsonify(names)
+            return lookup_response(index.patterns_by_group.get(product_group, _NO_ITEMS))
+        return lookup_response(index.patterns)
+    try:
+        with get_cursor(dictionary=False) as cur:
+            if product_group and product_group != "ALL":
+                cur.execute("""
+                    SELECT DISTINCT TRIM(pattern)
+                    FROM sales_2501_11
+                    WHERE product_group = %s
+                    ORDER BY TRIM(pattern)
+                """, (product_group,), label="patterns.group_sql")
+            else:
+                cur.execute("""
+                    SELECT DISTINCT TRIM(pattern)
+                    FROM sales_2501_11
+                    ORDER BY TRIM(pattern)
+                """, label="patterns.all_sql")
+            names = [r[0] for r in cur.fetchall()]
+        return lookup_response(names)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+def profit_monthly_data(f, args):
+    # optional: ?top_limit=10 -> top 10 sold_to by sales (from sales_2501_11)
+    rows = run_aggregate(AGGREGATES["profit_monthly"], f, _top_limit(args))
+
+    # Build output for months 1..12
+    out = [dict(month=m, gross=0, sd=0, cogs=0, op_cost=0) for m in range(1, 13)]
+    for r in rows:
+        m = int(r["month"] or 0)
+        if 1 <= m <= 12:
+            out[m - 1].update(
+                gross=float(r["gross"] or 0),
+                sd=float(r["sd"] or 0),
+                cogs=float(r["cogs"] or 0),
+                op_cost=float(r["op_cost"] or 0),
+            )
+    return out
+
 @app.get("/api/profit_monthly")
+@conditional_get("top_limit")
+@cached_response("top_limit")
 def profit_monthly():
     import traceback
 
     try:
-        f = parse_filters(request)
-
-        # same metric logic as daily_sales
-        value = "qty" if f.get("metric") == "qty" else "amt"
-
-        # optional: ?top_limit=10 -> top 10 sold_to by sales (from sales_2501_11)
-        top_limit = int(request.args.get("top_limit", 0) or 0)
-
-        conn = get_connection()
-        cur = conn.cursor(dictionary=True)
-        try:
-            top_sold_to = None
-
-            # 1) Get top N sold_to from YTD sales_2501_11
-            if top_limit > 0:
-                joins_s, wh_s, params_s = build_customer_filters("s", f, use_sold_to_name=False)
-
-                cat_joins_s, cat_where_s = category_filters("s", f.get("category", "ALL"))
-                joins_s += cat_joins_s
-                wh_s    += cat_where_s
-
-                if f.get("product_group", "ALL") != "ALL":
-                    wh_s.append("s.product_group = %s")
-                    params_s.append(f["product_group"])
-
-                if f.get("pattern", "ALL") != "ALL":
-                    wh_s.append("s.pattern = %s")
-                    params_s.append(f["pattern"])
-
-                where_top = ("WHERE " + " AND ".join(wh_s)) if wh_s else ""
-                top_sql = f"""
-                    SELECT s.sold_to,
-                           SUM(s.{value}) AS total_value
-                      FROM sales_2501_11 s
-                      {' '.join(joins_s)}
-                      {where_top}
-                     GROUP BY s.sold_to
-                     ORDER BY total_value DESC
-                     LIMIT %s
-                """
-                cur.execute(top_sql, tuple(params_s) + (top_limit,))
-                top_rows = cur.fetchall()
-                top_sold_to = [r["sold_to"] for r in top_rows]
-
-                if not top_sold_to:
-                    # nothing found -> all months = 0
-                    return jsonify([
-                        dict(month=m, gross=0, sd=0, cogs=0, op_cost=0)
-                        for m in range(1, 13)
-                    ])
-
-            # 2) Monthly profit totals from profit_2501_10,
-            #    restricted to those top sold_to (if any)
-            joins_p  = []
-            wh_p     = []
-            params_p = []
-
-            # category filters on profit table
-            cat_joins_p, cat_where_p = category_filters("p", f.get("category", "ALL"))
-            joins_p += cat_joins_p
-            wh_p    += cat_where_p
-
-            if f.get("product_group", "ALL") != "ALL":
-                wh_p.append("p.product_group = %s")
-                params_p.append(f["product_group"])
-
-            if f.get("pattern", "ALL") != "ALL":
-                wh_p.append("p.pattern = %s")
-                params_p.append(f["pattern"])
-
-            if top_sold_to:
-                placeholders = ",".join(["%s"] * len(top_sold_to))
-                wh_p.append(f"p.sold_to IN ({placeholders})")
-                params_p.extend(top_sold_to)
-
-            where_sql2 = ("WHERE " + " AND ".join(wh_p)) if wh_p else ""
-            monthly_sql = f"""
-                SELECT CAST(p.month AS UNSIGNED) AS month,
-                       SUM(p.gross)           AS gross,
-                       SUM(p.sales_deduction) AS sd,
-                       SUM(p.cogs)            AS cogs,
-                       SUM(p.operating_cost)  AS op_cost
-                  FROM profit_2501_10 p
-                  {' '.join(joins_p)}
-                  {where_sql2}
-                 GROUP BY CAST(p.month AS UNSIGNED)
-                 ORDER BY CAST(p.month AS UNSIGNED)
-            """
-            cur.execute(monthly_sql, tuple(params_p))
-            rows = cur.fetchall()
-
-        finally:
-            cur.close()
-            conn.close()
-
-        # Build output for months 1..12
-        out = [dict(month=m, gross=0, sd=0, cogs=0, op_cost=0) for m in range(1, 13)]
-        for r in rows:
-            m = int(r["month"] or 0)
-            if 1 <= m <= 12:
-                out[m - 1].update(
-                    gross=float(r["gross"] or 0),
-                    sd=float(r["sd"] or 0),
-                    cogs=float(r["cogs"] or 0),
-                    op_cost=float(r["op_cost"] or 0),
-                )
-
-        return jsonify(out)
-
+        return jsonify(profit_monthly_data(parse_filters(request), request.args))
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# ----------------------------- Map clustering ---------------------------------
+# /api/sales_map?zoom=<z>[&bbox=minLng,minLat,maxLng,maxLat] answers with the
+# ship_tos in the viewport, summed into screen-grid clusters below
+# MAP_POINTS_ZOOM and as individual points from there on. Cells are the
+# web-mercator quadtree at zoom + log2(256 / MAP_CLUSTER_PX), precomputed per
+# customer when the MapIndex is built for a data version.
+MAP_CLUSTER_PX   = int(os.getenv("MAP_CLUSTER_PX", "64"))     # cluster cell edge in screen pixels
+MAP_POINTS_ZOOM  = int(os.getenv("MAP_POINTS_ZOOM", "11"))    # from this zoom on: no clustering
+MAP_INDEX_LEVEL  = 10                                         # quadtree level of the bbox grid
+_CLUSTER_SHIFT   = max(8 - (MAP_CLUSTER_PX.bit_length() - 1), 0)  # zoom -> quadtree level offset
+
+def parse_bbox(v):
+    """"minLng,minLat,maxLng,maxLat" (Leaflet toBBoxString()) -> rounded 4-tuple, None when absent."""
+    if not v:
+        return None
+    box = tuple(round(float(x), 4) for x in v.split(","))
+    if len(box) != 4:
+        raise ValueError(f"bbox needs 4 numbers, got {v!r}")
+    return box
+
+def _mercator(lat, lng):
+    """(lat, lng) -> web-mercator (x, y) in [0, 1)."""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    s = math.sin(math.radians(lat))
+    x = (lng + 180.0) / 360.0
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+class MapIndex:
+    """
+    Geocoded customers of one data version: mercator position per ship_to,
+    their quadtree cell per cluster level, a MAP_INDEX_LEVEL grid of ship_tos
+    for viewport queries and a KD-tree for nearest / radius queries.
+    """
+    def __init__(self, customers):
+        self.latlng = {}     # ship_to -> (lat, lng)
+        self.position = {}   # ship_to -> (x, y)
+        self.grid = {}       # (cx, cy) at MAP_INDEX_LEVEL -> [ship_to]
+        n = 1 << MAP_INDEX_LEVEL
+        for ship_to, lat, lng in customers:
+            if ship_to in self.position or lat is None or lng is None:
+                continue
+            self.latlng[ship_to] = (float(lat), float(lng))
+            x, y = _mercator(float(lat), float(lng))
+            self.position[ship_to] = (x, y)
+            self.grid.setdefault((int(x * n), int(y * n)), []).append(ship_to)
+        self.tree = spatial.KDTree(self.latlng.values(), self.latlng.keys())
+        # cluster cell of every ship_to per zoom below MAP_POINTS_ZOOM
+        self.cells = []
+        for zoom in range(max(MAP_POINTS_ZOOM, 0)):
+            k = 1 << (zoom + _CLUSTER_SHIFT)
+            self.cells.append({s: (int(x * k), int(y * k)) for s, (x, y) in self.position.items()})
+
+    @classmethod
+    def load(cls, cur):
+        cur.execute("SELECT ship_to, latitude, longitude FROM customer "
+                    "WHERE latitude IS NOT NULL AND longitude IS NOT NULL", label="MapIndex.load_sql")
+        return cls(cur.fetchall())
+
+    def in_view(self, bbox):
+        """ship_tos inside bbox (minLng, minLat, maxLng, maxLat), None for the whole map."""
+        if bbox is None:
+            return None
+        min_lng, min_lat, max_lng, max_lat = bbox
+        x0, y1 = _mercator(min_lat, min_lng)
+        x1, y0 = _mercator(max_lat, max_lng)
+        n = 1 << MAP_INDEX_LEVEL
+        cx0, cx1, cy0, cy1 = int(x0 * n), int(x1 * n), int(y0 * n), int(y1 * n)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.grid):
+            cells = [c for c in self.grid if cx0 <= c[0] <= cx1 and cy0 <= c[1] <= cy1]
+        else:
+            cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        found = set()
+        for c in cells:
+            for s in self.grid.get(c, ()):
+                x, y = self.position[s]
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    found.add(s)
+        return found
+
+    def cluster(self, rows, zoom):
+        """
+        Sum map rows into the zoom's cells: {"count", "total_value", "latitude",
+        "longitude" (member mean), "bounds": [minLng, minLat, maxLng, maxLat]}.
+        Cells holding a single ship_to keep its row.
+        """
+        cells = self.cells[min(max(zoom, 0), len(self.cells) - 1)]
+        buckets = {}
+        for row in rows:
+            cell = cells.get(row["ship_to"])
+            if cell is not None:
+                buckets.setdefault(cell, []).append(row)
+        points, clusters = [], []
+        for members in buckets.values():
+            if len(members) == 1:
+                points.append(members[0])
+                continue
+            lats = [float(r["latitude"]) for r in members]
+            lngs = [float(r["longitude"]) for r in members]
+            clusters.append({
+                "count":       len(members),
+                "total_value": sum(r["total_value"] or 0 for r in members),
+                "latitude":    sum(lats) / len(lats),
+                "longitude":   sum(lngs) / len(lngs),
+                "bounds":      [min(lngs), min(lats), max(lngs), max(lats)],
+            })
+        clusters.sort(key=lambda c: c["total_value"], reverse=True)
+        return points, clusters
+
+_map_index = {"entry": (object(), None)}  # (data version, index), swapped as one
+_map_index_lock = threading.Lock()
+
+def map_index():
+    """The MapIndex for the current data version."""
+    version = data_version()
+    seen, index = _map_index["entry"]
+    if seen == version:
+        return index
+    if not snapshot_is_current():
+        with get_cursor(dictionary=False) as cur:  # request still on a replaced snapshot: not shared
+            return MapIndex.load(cur)
+    with _map_index_lock:
+        seen, index = _map_index["entry"]
+        if seen != version:
+            with get_cursor(dictionary=False) as cur:
+                index = MapIndex.load(cur)
+            _map_index["entry"] = (version, index)
+    return index
+
+def sales_map_data(f, args):
+    """Per-ship_to rows without zoom; points and clusters in the bbox with it."""
+    top_limit = _top_limit(args)
+    try:
+        zoom = _CACHE_ARG_NORMALIZERS["zoom"](args.get("zoom"))
+        bbox = parse_bbox(args.get("bbox"))
+    except ValueError as e:
+        raise InvalidArgument(f"bad zoom/bbox: {e}") from e
+    if zoom is None:
+        return sales_map_rows(f, top_limit)
+
+    rows = sales_map_rows(f, top_limit, memo=True)
+    index = map_index()
+    view = index.in_view(bbox)
+    if view is not None:
+        rows = [r for r in rows if r["ship_to"] in view]
+    if zoom >= MAP_POINTS_ZOOM:
+        points, clusters = rows, []
+    else:
+        points, clusters = index.cluster(rows, zoom)
+    return {"zoom": zoom, "points": points, "clusters": clusters}
+
 @app.get("/api/sales_map")
+@conditional_get("top_limit", "zoom", "bbox")
+@cached_response("top_limit", "zoom", "bbox")
 def sales_map():
-    f = parse_filters(request)
-    value = "qty" if f["metric"] == "qty" else "amt"
-
-    # 0 or missing = no top filter
-    top_limit = int(request.args.get("top_limit", 0) or 0)
-
-    # 1) Customer / region / salesman filters
-    joins, wh, params = build_customer_filters("s", f, use_sold_to_name=False)
-
-    # join to customer table for lat/lng + region + salesman
-    joins.append("""
-      JOIN customer c
-        ON c.ship_to = s.ship_to
-    """)
-
-    # 2) Category filters (PCLT / TBR / 18PLUS etc.)
-    cat_joins, cat_where = category_filters("s", f["category"])
-    joins += cat_joins
-    wh    += cat_where
+    return chart_response(sales_map_data, parse_filters(request), request.args)
 
-    # 3) Direct fields (indexable) – SAME STYLE AS daily_sales
-    if f["product_group"] != "ALL":
-        wh.append("s.product_group = %s")
-        params.append(f["product_group"])
-
-    if f["pattern"] != "ALL":
-        wh.append("s.pattern = %s")
-        params.append(f["pattern"])
-
-    # Only customers that have coordinates
-    wh.append("c.latitude IS NOT NULL")
-    wh.append("c.longitude IS NOT NULL")
-
-    base_where_sql = ("WHERE " + " AND ".join(wh)) if wh else ""
-
-    conn = get_connection()
-    cur  = conn.cursor(dictionary=True)
-    try:
+def sales_map_rows(f, top_limit, memo=False):
+    """
+    Per-ship_to totals (with coordinates, region and BDE) under filters f, the
+    unclustered /api/sales_map answer. memo=True keeps them in the response
+    cache so panning and zooming reuse one query.
+    """
+    value = "qty" if f["metric"] == "qty" else "amt"
+    key = ("sales_map_rows", tuple(sorted(f.items())), top_limit)
+    memo = memo and RESPONSE_CACHE and snapshot_is_current()
+    if memo:
+        version = data_version()
+        response_cache.check_version(version)
+        rows = response_cache.get(key)
+        if rows is not None:
+            return rows
+
+    # 1) Customer / category / product filters, on the smallest source that
+    #    still has ship_to (needed for the coordinates below)
+    src = route_fact("sales_2501_11", f, "s.ship_to", top_limit=top_limit)
+    joins, wh, params = src.filters("s")
+
+    # 2) join to customer table for lat/lng + region + salesman,
+    #    only customers that have coordinates
+    map_joins = ["JOIN customer c ON c.ship_to = s.ship_to"]
+    map_where = ["c.latitude IS NOT NULL", "c.longitude IS NOT NULL"]
+    joins += map_joins
+    wh    += map_where
+
+    with get_cursor() as cur:
         top_sold_to = None
 
-        # 4) If top_limit > 0, get top N sold_to first (same pattern as daily_sales)
+        # 3) If top_limit > 0, get top N sold_to first (same pattern as daily_sales)
         if top_limit > 0:
-            top_sql = f"""
-              SELECT s.sold_to AS sold_to
-                FROM sales_2501_11 s
-                {' '.join(joins)}
-                {base_where_sql}
-               GROUP BY s.sold_to
-               ORDER BY SUM(s.{value}) DESC
-               LIMIT %s
-            """
-            cur.execute(top_sql, tuple(params) + (top_limit,))
-            top_rows = cur.fetchall()
-            top_sold_to = [r["sold_to"] for r in top_rows]
+            top_sold_to = fetch_top_sold_to(cur, f, value, top_limit,
+                                            extra_joins=map_joins, extra_where=map_where)
 
             # no matching customers – nothing to plot
             if not top_sold_to:
-                return jsonify([])
+                return []
 
-        # 5) Map totals, optionally restricted to top N sold_to
+        # 4) Map totals, optionally restricted to top N sold_to
         wh2     = list(wh)
         params2 = list(params)
 
@@ -1338,8 +2491,8 @@ def sales_map():
               c.longitude     AS longitude,
               MAX(c.bde_state)      AS region,
               MAX(c.salesman_name)  AS bde,
-              SUM(s.{value})        AS total_value
-            FROM sales_2501_11 s
+              {src.total("s", value)} AS total_value
+            FROM {src.table} s
             {' '.join(joins)}
             {where_sql2}
            GROUP BY
@@ -1349,14 +2502,182 @@ def sales_map():
               c.longitude
            ORDER BY total_value DESC
         """
-        cur.execute(map_sql, tuple(params2))
+        cur.execute(map_sql, tuple(params2), label="sales_map_rows.map_sql")
         rows = cur.fetchall()
-    finally:
-        cur.close()
-        conn.close()
 
-    # For the map we just return rows directly
-    return jsonify(rows)
+    if memo:
+        response_cache.put(key, rows, size=200 * len(rows) + 64, version=version)
+    return rows
+
+# ----------------------------- Nearby customers ---------------------------------
+NEARBY_DEFAULT_K = 10
+NEARBY_MAX_K     = int(os.getenv("NEARBY_MAX_K", "500"))
+_NEARBY_ARGS     = ("top_limit", "origin", "lat", "lng", "k", "radius_km")
+
+@app.get("/api/nearby")
+@conditional_get(*_NEARBY_ARGS)
+@cached_response(*_NEARBY_ARGS)
+def nearby():
+    """
+    Ship_tos around a customer (origin=<ship_to>) or a point (lat=&lng=):
+    the k nearest (default 10), all within radius_km, or the k nearest within
+    radius_km. Only ship_tos with sales under the usual filters count; each
+    comes with its sales_map row (YTD total_value, region, BDE) and
+    distance_km, closest first.
+    """
+    f = parse_filters(request)
+    top_limit = int(request.args.get("top_limit", 0) or 0)
+    try:
+        origin, lat, lng, k, radius = (_CACHE_ARG_NORMALIZERS[a](request.args.get(a)) for a in _NEARBY_ARGS[1:])
+    except ValueError as e:
+        return jsonify({"error": f"bad nearby query: {e}"}), 400
+    if (k is not None and k <= 0) or (radius is not None and radius < 0):
+        return jsonify({"error": "k must be positive and radius_km non-negative"}), 400
+
+    index = map_index()
+    if origin is not None:
+        if origin not in index.latlng:
+            return jsonify({"error": f"ship_to {origin} not found or not geocoded"}), 404
+        lat, lng = index.latlng[origin]
+    elif lat is None or lng is None:
+        return jsonify({"error": "pass origin=<ship_to> or lat= and lng="}), 400
+
+    totals = {r["ship_to"]: r for r in sales_map_rows(f, top_limit, memo=True)}
+    accept = lambda s: s in totals and s != origin
+    if radius is not None and k is None:
+        hits = index.tree.within(lat, lng, radius, accept=accept)[:NEARBY_MAX_K]
+    else:
+        hits = index.tree.nearest(lat, lng, min(k or NEARBY_DEFAULT_K, NEARBY_MAX_K),
+                                  max_km=radius, accept=accept)
+    return jsonify([{**totals[s], "distance_km": round(km, 3)} for km, s in hits])
+
+# ----------------------------- Batched dashboard ---------------------------------
+# One request for several chart series under one filter set: filters are parsed
+# once, the shared top-N ranking is computed once up front, and the series run
+# concurrently on a small thread pool (each thread reuses its pooled connection).
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "4"))
+_dashboard_pool = ThreadPoolExecutor(max_workers=max(DASHBOARD_WORKERS, 1), thread_name_prefix="dashboard")
+
+# series -> (body function (f, args), the args besides the filters it reads:
+# the same as its endpoint's @cached_response, so the two share entries)
+DASHBOARD_SERIES = {
+    "daily_sales":       (partial(series_data, "daily_sales"),          ("top_limit",)),
+    "daily_breakdown":   (partial(breakdown_data, "daily_breakdown"),   ("top_limit", "group_by")),
+    "daily_target":      (daily_target_data,                            ("top_limit", "month")),
+    "monthly_sales":     (partial(series_data, "monthly_sales"),        ("top_limit",)),
+    "monthly_breakdown": (partial(breakdown_data, "monthly_breakdown"), ("top_limit", "group_by")),
+    "monthly_target":    (partial(series_data, "monthly_target"),       ("top_limit",)),
+    "yearly_sales":      (partial(series_data, "yearly_sales"),         ("top_limit",)),
+    "yearly_breakdown":  (partial(breakdown_data, "yearly_breakdown"),  ("top_limit", "group_by")),
+    "profit_monthly":    (profit_monthly_data,                          ("top_limit",)),
+    "sales_map":         (sales_map_data,                               ("top_limit", "zoom", "bbox")),
+}
+# series restricted by the shared sales_2501_11 sold_to ranking when top_limit > 0
+_RANKED_SERIES = {name for name, spec in AGGREGATES.items() if spec.ranking == "sales"}
+
+
+def _run_series(name, args):
+    """One series under its args (filters included); returns (status, JSON body bytes)."""
+    body, extra_args = DASHBOARD_SERIES[name]
+    key = response_cache_key(name, extra_args, args)
+    if key is not None:
+        version = data_version()
+        response_cache.check_version(version)
+        data = response_cache.get(key)
+        if data is not None:
+            return 200, data
+    try:
+        value = body(parse_filters(_ArgsRequest(args)), args)
+    except InvalidArgument as e:
+        return 400, json.dumps({"error": str(e)}).encode()
+    except Exception as e:
+        app.logger.exception("dashboard series %s failed", name)
+        return 500, json.dumps({"error": str(e)}).encode()
+    # what the endpoint's jsonify() sends
+    data = app.json.dumps(to_columnar(value) if response_format(args) == "columnar" else value).encode()
+    if key is not None:
+        response_cache.put(key, data, version=version)
+    return 200, data
+
+@app.route("/api/dashboard", methods=["GET", "POST"])
+@conditional_get(raw_args=True)
+def dashboard():
+    """
+    GET  /api/dashboard?series=monthly_sales,monthly_target,daily_sales&region=NSW&top_limit=10
+    POST /api/dashboard  {"filters": {...},
+                          "series": ["monthly_sales",
+                                     {"name": "daily_breakdown", "key": "by_pattern", "group_by": "pattern"}]}
+    -> {"monthly_sales": [...], "by_pattern": [...]}
+    Each value is exactly what the single endpoint returns; a failing series
+    becomes {"error": ..., "status": ...} without failing the others.
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            return jsonify({"error": "body must be a JSON object"}), 400
+        filters = body.get("filters") or {}
+        specs = body.get("series") or []
+        if not isinstance(filters, dict):
+            return jsonify({"error": "filters must be an object"}), 400
+        if not isinstance(specs, list):
+            return jsonify({"error": "series must be a list"}), 400
+        base = {k: str(v) for k, v in filters.items()}
+    else:
+        base = {k: v for k, v in request.args.items() if k != "series"}
+        specs = [s.strip() for s in (request.args.get("series") or "").split(",") if s.strip()]
+
+    jobs = []  # (key, name, args)
+    for spec in specs:
+        if isinstance(spec, str):
+            spec = {"name": spec}
+        if not isinstance(spec, dict):
+            return jsonify({"error": "each series must be a name or an object"}), 400
+        name = spec.get("name")
+        if not isinstance(name, str) or name not in DASHBOARD_SERIES:
+            return jsonify({"error": f"unknown series: {name}"}), 400
+        key = spec.get("key") or name
+        if not isinstance(key, str):
+            return jsonify({"error": "series key must be a string"}), 400
+        if any(key == k for k, _, _ in jobs):
+            return jsonify({"error": f"duplicate series key: {key}"}), 400
+        args = dict(base)
+        args.update({k: str(v) for k, v in spec.items() if k not in ("name", "key")})
+        jobs.append((key, name, args))
+    if not jobs:
+        return jsonify({"error": "no series requested"}), 400
+
+    # one sales_2501_11 top-N ranking for the series that share it under the
+    # base filters (sales_map ranks with its map joins and keeps its own)
+    f = parse_filters(_ArgsRequest(base))
+    try:
+        top_limit = int(base.get("top_limit", 0) or 0)
+    except ValueError:
+        top_limit = 0
+    if top_limit > 0 and any(name in _RANKED_SERIES for _, name, _ in jobs):
+        sold_to_ranking(None, f, "qty" if f["metric"] == "qty" else "amt")
+
+    if len(jobs) == 1 or DASHBOARD_WORKERS <= 1:
+        results = [_run_series(name, args) for _, name, args in jobs]
+    else:
+        # each series runs in a copy of this context: same pinned snapshot
+        futures = [_dashboard_pool.submit(contextvars.copy_context().run, _run_series, name, args)
+                   for _, name, args in jobs]
+        results = [fut.result() for fut in futures]
+
+    # splice the already-serialized bodies instead of parsing them back
+    parts = []
+    for (key, _, _), (status, data) in zip(jobs, results):
+        if status != 200:
+            try:
+                err = json.loads(data)
+            except ValueError:
+                err = {"error": data.decode("utf-8", "replace")}
+            if not isinstance(err, dict):
+                err = {"error": err}
+            err["status"] = status
+            data = json.dumps(err).encode()
+        parts.append(json.dumps(key).encode() + b":" + data.strip())
+    return Response(b"{" + b",".join(parts) + b"}", status=200, mimetype="application/json")
 
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
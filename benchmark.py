@@ -0,0 +1,423 @@
+"""
+Endpoint latency / throughput / memory at several data scales.
+
+For each scale: generate synthetic CSVs (synth_data.py), build and publish a
+snapshot from them (make_sqlite_snapshot.py --raw/--pointer), then drive every
+/api endpoint over a matrix of categories, top_limit, group_by, regions and
+metrics:
+  client    the Flask test client, sequentially, in a fresh process per scale
+  gunicorn  a real `gunicorn app:app` with --workers, hit by --concurrency
+            HTTP clients
+and report p50/p95/p99 latency, throughput and RSS (peak, summed over the
+gunicorn master and workers). Everything lives under --work (default bench/);
+data and snapshots are reused between runs unless --rebuild.
+
+    python benchmark.py --scales 1e5,1e6
+    python benchmark.py --scales 1e7 --modes gunicorn --workers 4 --concurrency 16
+    python benchmark.py --scales 1e5 --limit 200 --out bench/quick.json
+
+The response cache is off by default so every request does the work
+(--response-cache to measure with it); COLUMNAR_ENGINE, USE_ROLLUPS etc. are
+passed through from the environment.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import perf_counter, sleep
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+try:
+    import resource  # peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join(BASE_DIR, "bench")
+
+CATEGORIES = ["ALL", "PCLT", "TBR", "18PLUS", "ISEG", "SUV", "LOWPROFILE", "HM"]
+TOP_LIMITS = [0, 10, 50]
+GROUP_BYS  = ["region", "salesman", "sold_to_group", "sold_to", "product_group", "pattern"]
+METRICS    = ["qty", "amt"]
+
+CHART_ENDPOINTS = [
+    "daily_sales", "daily_target", "monthly_sales", "monthly_target",
+    "yearly_sales", "profit_monthly", "sales_map",
+]
+BREAKDOWN_ENDPOINTS = ["daily_breakdown", "monthly_breakdown", "yearly_breakdown"]
+DASHBOARD_SERIES = "monthly_sales,monthly_target,daily_sales,yearly_sales,profit_monthly,sales_map"
+
+
+# ----------------------------- Scales -----------------------------------------
+def parse_scale(v):
+    rows = int(float(v))
+    if rows <= 0:
+        raise argparse.ArgumentTypeError(f"bad scale: {v}")
+    return rows
+
+def scale_name(rows):
+    exp = len(str(rows)) - 1
+    return f"1e{exp}" if rows == 10 ** exp else str(rows)
+
+def prepare(rows, work, customers=None, seed=1, rebuild=False):
+    """Generate and build one scale (reusing earlier output); returns its info dict."""
+    import synth_data
+
+    root = os.path.join(work, scale_name(rows))
+    raw = os.path.join(root, "raw")
+    pointer = os.path.join(root, "snapshot.current")
+    marker = os.path.join(raw, "generated.json")
+    params = {"rows": rows, "customers": customers, "seed": seed}
+    info = {"rows": rows, "root": root}
+
+    stale = rebuild or _read_json(marker) != params
+    if stale:
+        print(f"[{scale_name(rows)}] generating {rows:,} rows...")
+        t0 = perf_counter()
+        synth_data.generate(raw, rows, customers, seed)
+        info["generate_secs"] = round(perf_counter() - t0, 2)
+        with open(marker, "w", encoding="utf-8") as fh:
+            json.dump(params, fh)
+
+    if stale or not os.path.exists(pointer):
+        print(f"[{scale_name(rows)}] building snapshot...")
+        t0 = perf_counter()
+        out = subprocess.run([sys.executable, os.path.join(BASE_DIR, "make_sqlite_snapshot.py"),
+                              "--raw", raw, "--pointer", pointer, "--no-legacy-db"],
+                             cwd=BASE_DIR, capture_output=True, text=True,
+                             # synthetic addresses stay out of the real geocode store
+                             env=dict(os.environ, GEOCODE_CACHE_DB=os.path.join(root, "geocode_cache.db")))
+        if out.returncode != 0:
+            sys.stderr.write(out.stdout + out.stderr)
+            raise SystemExit(f"snapshot build failed for {scale_name(rows)}")
+        info["build_secs"] = round(perf_counter() - t0, 2)
+        peak = [line for line in out.stdout.splitlines() if line.startswith("Peak memory:")]
+        if peak:
+            info["build_peak_rss_mb"] = float(peak[-1].split()[2])
+
+    with open(pointer, encoding="utf-8") as fh:
+        db = os.path.join(root, fh.read().strip())
+    info["snapshot_mb"] = round(os.path.getsize(db) / 2 ** 20, 1)
+    info["pointer"] = pointer
+    info["db"] = db
+    return info
+
+
+# ----------------------------- Request matrix -----------------------------------
+def request_matrix(db, limit=0, seed=1):
+    """[(endpoint, path, params)] covering every /api endpoint."""
+    conn = sqlite3.connect(db)
+    region = conn.execute("SELECT bde_state FROM customer WHERE bde_state <> '' "
+                          "GROUP BY bde_state ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    group = conn.execute("SELECT sold_to_group FROM customer WHERE sold_to_group <> '' "
+                         "GROUP BY sold_to_group ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    ship_tos = [r[0] for r in conn.execute(
+        "SELECT ship_to FROM customer WHERE latitude IS NOT NULL ORDER BY ship_to LIMIT 5")]
+    product_group = conn.execute("SELECT product_group FROM sales_2511 "
+                                 "GROUP BY product_group ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+    conn.close()
+
+    out, i = [], 0
+    for category in CATEGORIES:
+        for top_limit in TOP_LIMITS:
+            for reg in ("ALL", region):
+                base = {"category": category, "region": reg, "metric": METRICS[i % 2]}
+                if top_limit:
+                    base["top_limit"] = top_limit
+                i += 1
+                for name in CHART_ENDPOINTS:
+                    out.append((name, f"/api/{name}", base))
+                for name in BREAKDOWN_ENDPOINTS:
+                    for group_by in GROUP_BYS:
+                        out.append((name, f"/api/{name}", dict(base, group_by=group_by)))
+                out.append(("dashboard", "/api/dashboard", dict(base, series=DASHBOARD_SERIES)))
+    for params in ({}, {"top_limit": 10}):
+        out.append(("sold_to_groups", "/api/sold_to_groups", params))
+    for params in ({}, {"sold_to_group": group}, {"sold_to_group": group, "top_limit": 10}, {"q": "CUSTOMER 00"}):
+        out.append(("sold_to_names", "/api/sold_to_names", params))
+    for params in ({}, {"sold_to_group": group}, {"q": "CUSTOMER 01"}):
+        out.append(("ship_to_names", "/api/ship_to_names", params))
+    out.append(("product_group", "/api/product_group", {}))
+    for params in ({}, {"product_group": product_group}):
+        out.append(("patterns", "/api/patterns", params))
+    for ship_to in ship_tos:
+        out.append(("nearby", "/api/nearby", {"origin": ship_to, "k": 10}))
+        out.append(("nearby", "/api/nearby", {"origin": ship_to, "radius_km": 25, "category": "ISEG"}))
+        out.append(("sales_map", "/api/sales_map", {"zoom": 6}))
+
+    if limit and len(out) > limit:
+        out = random.Random(seed).sample(out, limit)
+    return out
+
+
+def warmup_requests(matrix):
+    """One request per endpoint: builds per-version indexes and opens connections."""
+    seen = {}
+    for name, path, params in matrix:
+        seen.setdefault(name, (name, path, params))
+    return list(seen.values())
+
+
+# ----------------------------- Stats -----------------------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(samples, wall_secs):
+    """samples: [(endpoint, status, seconds)] -> overall and per-endpoint latency stats (ms)."""
+    def stats(secs, errors):
+        secs = sorted(secs)
+        return {"requests": len(secs), "errors": errors,
+                **{f"p{p}_ms": round(percentile(secs, p) * 1000, 2) for p in (50, 95, 99)},
+                "max_ms": round(secs[-1] * 1000, 2)}
+    by_endpoint = {}
+    for name, status, secs in samples:
+        entry = by_endpoint.setdefault(name, ([], [0]))
+        entry[0].append(secs)
+        entry[1][0] += status >= 500 or status == 0
+    out = stats([s for _, _, s in samples], sum(e[1][0] for e in by_endpoint.values()))
+    out["wall_secs"] = round(wall_secs, 2)
+    out["throughput_rps"] = round(len(samples) / wall_secs, 1) if wall_secs else None
+    out["endpoints"] = {name: stats(secs, err[0]) for name, (secs, err) in sorted(by_endpoint.items())}
+    return out
+
+
+def rss_mb(pids):
+    """Current RSS summed over pids, from /proc (None elsewhere)."""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status", encoding="ascii") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            if not os.path.exists("/proc"):
+                return None
+    return round(total / 1024, 1)
+
+def process_tree(pid):
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        try:
+            with open(f"/proc/{p}/task/{p}/children", encoding="ascii") as fh:
+                todo.extend(int(c) for c in fh.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+# ----------------------------- Drivers -----------------------------------------
+def app_env(info, args):
+    env = dict(os.environ, USE_SQLITE="1", SNAPSHOT_POINTER=info["pointer"],
+               RESPONSE_CACHE="1" if args.response_cache else "0",
+               METRICS_DIR="", SLOW_QUERY_LOG="")
+    env.setdefault("PYTHONUNBUFFERED", "1")
+    return env
+
+def run_client(info, args):
+    """Test-client run in a child process (fresh imports and RSS per scale)."""
+    cmd = [sys.executable, os.path.abspath(__file__), "--client-run", info["db"],
+           "--rounds", str(args.rounds), "--limit", str(args.limit), "--seed", str(args.seed)]
+    out = subprocess.run(cmd, cwd=BASE_DIR, env=app_env(info, args), capture_output=True, text=True)
+    if out.returncode != 0:
+        sys.stderr.write(out.stderr[-4000:])
+        return {"error": f"client run failed ({out.returncode})"}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def client_main(db, rounds, limit, seed):
+    """--client-run: drive the matrix through the Flask test client, print JSON."""
+    sys.path.insert(0, BASE_DIR)
+    import app as dashboard_app
+
+    client = dashboard_app.app.test_client()
+    matrix = request_matrix(db, limit, seed)
+    for name, path, params in warmup_requests(matrix):
+        client.get(path, query_string=params)
+    dashboard_app.get_engine(wait=True)  # None unless COLUMNAR_ENGINE=1
+    rss_before = rss_mb([os.getpid()])
+
+    samples = []
+    started = perf_counter()
+    for _ in range(rounds):
+        for name, path, params in matrix:
+            t0 = perf_counter()
+            status = client.get(path, query_string=params).status_code
+            samples.append((name, status, perf_counter() - t0))
+    out = summarize(samples, perf_counter() - started)
+    out["rss_mb"] = rss_mb([os.getpid()]) or rss_before
+    if resource is not None:
+        out["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(out))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def fetch(url, timeout):
+    try:
+        with urlopen(url, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+def run_gunicorn(info, args):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    cmd = [sys.executable, "-m", "gunicorn", "app:app", "--workers", str(args.workers),
+           "--bind", f"127.0.0.1:{port}", "--timeout", "600", "--log-level", "warning"]
+    server = subprocess.Popen(cmd, cwd=BASE_DIR, env=app_env(info, args),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = perf_counter() + 60
+        while fetch(base + "/api/ping", 2) != 200:
+            if server.poll() is not None or perf_counter() > deadline:
+                return {"error": "gunicorn did not start: " + (server.stderr.read() if server.poll() is not None else "timeout")[-2000:]}
+            sleep(0.2)
+
+        matrix = request_matrix(info["db"], args.limit, args.seed)
+        urls = [(name, f"{base}{path}?{urlencode(params)}") for name, path, params in matrix]
+        with ThreadPoolExecutor(max_workers=max(args.workers, 1) * 2) as pool:
+            # every worker sees every endpoint at least once (requests land randomly)
+            warm = [f"{base}{path}?{urlencode(params)}" for _, path, params in warmup_requests(matrix)]
+            list(pool.map(lambda u: fetch(u, args.timeout), warm * max(args.workers, 1) * 2))
+
+        pids = process_tree(server.pid)
+        peak = [rss_mb(pids) or 0.0]
+        stop = threading.Event()
+
+        def sample_rss():
+            while not stop.wait(0.5):
+                peak[0] = max(peak[0], rss_mb(pids) or 0.0)
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+
+        def one(item):
+            name, url = item
+            t0 = perf_counter()
+            status = fetch(url, args.timeout)
+            return name, status, perf_counter() - t0
+
+        started = perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            samples = list(pool.map(one, urls * args.rounds))
+        wall = perf_counter() - started
+        stop.set()
+        sampler.join()
+        out = summarize(samples, wall)
+        out["rss_mb"] = rss_mb(pids)
+        out["peak_rss_mb"] = round(max(peak[0], out["rss_mb"] or 0.0), 1)
+        out["workers"], out["concurrency"] = args.workers, args.concurrency
+        return out
+    finally:
+        server.terminate()
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+# ----------------------------- Report -----------------------------------------
+def print_report(results):
+    print()
+    print(f"{'scale':>6} {'mode':9} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'rss MB':>8} {'peak MB':>8} {'db MB':>7}")
+    for r in results:
+        for mode in ("client", "gunicorn"):
+            m = r.get(mode)
+            if m is None:
+                continue
+            if "error" in m:
+                print(f"{scale_name(r['rows']):>6} {mode:9} {m['error']}")
+                continue
+            print(f"{scale_name(r['rows']):>6} {mode:9} {m['requests']:6} {m['errors']:4} {m['throughput_rps']:8} "
+                  f"{m['p50_ms']:8} {m['p95_ms']:8} {m['p99_ms']:8} {m['rss_mb'] or '-':>8} "
+                  f"{m.get('peak_rss_mb', '-'):>8} {r['snapshot_mb']:7}")
+    for r in results:
+        for mode in ("client", "gunicorn"):
+            m = r.get(mode)
+            if not m or "error" in m:
+                continue
+            print(f"\n{scale_name(r['rows'])} {mode}")
+            print(f"  {'endpoint':18} {'reqs':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+            for name, e in m["endpoints"].items():
+                print(f"  {name:18} {e['requests']:5} {e['errors']:4} {e['p50_ms']:8} {e['p95_ms']:8} "
+                      f"{e['p99_ms']:8} {e['max_ms']:8}")
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", default="1e5,1e6", help="comma-separated fact row counts (1e5 .. 1e8)")
+    ap.add_argument("--modes", default="client,gunicorn", help="client, gunicorn or both")
+    ap.add_argument("--work", default=WORK_DIR, help="data, snapshots and results (default: bench/)")
+    ap.add_argument("--customers", type=int, help="ship_to count (default grows with the scale)")
+    ap.add_argument("--rebuild", action="store_true", help="regenerate data and snapshots")
+    ap.add_argument("--rounds", type=int, default=1, help="passes over the request matrix")
+    ap.add_argument("--limit", type=int, default=0, help="random sample of this many matrix requests")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    ap.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP clients")
+    ap.add_argument("--timeout", type=float, default=120, help="per-request timeout, secs")
+    ap.add_argument("--response-cache", action="store_true", help="leave RESPONSE_CACHE on")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="results JSON (default: <work>/results-<stamp>.json)")
+    ap.add_argument("--client-run", metavar="DB", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.client_run:
+        client_main(args.client_run, args.rounds, args.limit, args.seed)
+        return
+
+    modes = {m.strip() for m in args.modes.split(",") if m.strip()}
+    results = []
+    for rows in (parse_scale(v) for v in args.scales.split(",")):
+        info = prepare(rows, args.work, args.customers, args.seed, args.rebuild)
+        if "client" in modes:
+            print(f"[{scale_name(rows)}] test client...")
+            info["client"] = run_client(info, args)
+        if "gunicorn" in modes:
+            print(f"[{scale_name(rows)}] gunicorn, {args.workers} workers, {args.concurrency} clients...")
+            info["gunicorn"] = run_gunicorn(info, args)
+        results.append(info)
+
+    print_report(results)
+    out = args.out or os.path.join(args.work, f"results-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump({"argv": sys.argv[1:], "env": {k: os.environ[k] for k in
+                   ("COLUMNAR_ENGINE", "USE_ROLLUPS", "LOOKUP_INDEX") if k in os.environ},
+                   "results": results}, fh, indent=1)
+    print(f"\nresults: {out}")
+
+
+if __name__ == "__main__":
+    main()
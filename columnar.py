@@ -0,0 +1,485 @@
+"""
+In-memory columnar engine for the read-only sales fact tables.
+
+sales_2501_11 (month), sales_2511 (day) and sales_21_2511 (year) are loaded
+once per snapshot into dictionary-encoded NumPy arrays, with the customer
+attributes used by build_customer_filters() denormalized onto every row.
+The SUM / GROUP BY queries the chart endpoints run are then answered with
+boolean/weight masks and np.bincount instead of SQL.
+
+Results follow SQLite semantics row for row so the JSON matches the SQL
+path: same aliases, int sums for integer columns, NULL groups, LEFT/INNER
+join multiplicities, ORDER BY with NULL < numbers < text. Anything the
+engine cannot express raises Unsupported and the caller falls back to SQL.
+"""
+import re
+import string
+from time import perf_counter
+
+import numpy as np
+
+# fact table -> its time bucket column
+FACT_TABLES = {
+    "sales_2501_11": "month",
+    "sales_2511":    "day",
+    "sales_21_2511": "year",
+}
+FACT_COLUMNS   = ("sold_to", "ship_to", "line", "product_group", "pattern", "material", "inch")
+MEASURES       = ("qty", "amt")
+CUSTOMER_ATTRS = ("bde_state", "salesman_name", "sold_to_group", "sold_to_name")
+
+_LOAD_CHUNK = 200_000
+
+
+class Unsupported(Exception):
+    """The engine cannot answer this query; use SQL instead."""
+
+
+# ---------------------------- SQLite value semantics ---------------------------
+_NUM_PREFIX = re.compile(r"\s*[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?")
+_UPPER = str.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+
+
+def _is_num(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _strict_num(v):
+    """Numeric value of a well-formed number string (what numeric affinity converts), else None."""
+    m = _NUM_PREFIX.fullmatch(v.strip(" ")) if isinstance(v, str) else None
+    if m is None:
+        return None
+    f = float(m.group(0))
+    return int(f) if f.is_integer() and m.group(2) is None and m.group(3) is None else f
+
+
+def _cast_num(v):
+    """CAST(v AS NUMERIC/DECIMAL/UNSIGNED): longest numeric prefix, 0 if none, NULL stays NULL."""
+    if v is None or _is_num(v):
+        return v
+    m = _NUM_PREFIX.match(str(v))
+    if m is None:
+        return 0
+    f = float(m.group(0))
+    return int(f) if f.is_integer() else f
+
+
+def _sql_equal(a, b):
+    """a = b between a column value and a bound parameter / other column."""
+    if a is None or b is None:
+        return False
+    if isinstance(a, str) and isinstance(b, str):
+        return a == b
+    if _is_num(a) and _is_num(b):
+        return a == b
+    # text vs numeric: numeric affinity converts well-formed text
+    return (_strict_num(a) if isinstance(a, str) else a) == (_strict_num(b) if isinstance(b, str) else b)
+
+
+def _sql_text(v):
+    return v if isinstance(v, str) else repr(v) if isinstance(v, float) else str(v)
+
+
+def _upper_trim(v):
+    """UPPER(TRIM(v)) -- SQLite trims spaces only and upper-cases ASCII only."""
+    return _sql_text(v).strip(" ").translate(_UPPER)
+
+
+def _order_key(v):
+    """SQLite sort order: NULL < numbers < text."""
+    if v is None:
+        return (0, 0)
+    if _is_num(v):
+        return (1, v)
+    return (2, v)
+
+
+class _JoinIndex:
+    """Multiset of join-key values answering `count of x with x = v` in O(1)."""
+
+    def __init__(self, values):
+        self.text, self.num = {}, {}
+        for i, v in enumerate(values):
+            if v is None:
+                continue
+            if isinstance(v, str):
+                self.text.setdefault(v, []).append(i)
+                n = _strict_num(v)
+                if n is not None:
+                    self.num.setdefault(("t", n), []).append(i)
+            else:
+                self.num.setdefault(("n", v), []).append(i)
+
+    def rows(self, v):
+        if v is None:
+            return []
+        if isinstance(v, str):
+            out = list(self.text.get(v, ()))
+            n = _strict_num(v)
+            if n is not None:
+                out += self.num.get(("n", n), ())
+            return out
+        return list(self.num.get(("n", v), ())) + list(self.num.get(("t", v), ()))
+
+    def count(self, v):
+        return len(self.rows(v))
+
+
+# ---------------------------------- columns -----------------------------------
+class DictColumn:
+    """Dictionary-encoded column: codes[i] indexes into values (None is a value too)."""
+
+    __slots__ = ("codes", "values", "_luts")
+
+    _MAX_LUTS = 256
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+        self._luts = {}
+
+    def lut(self, key, pred, dtype=bool):
+        """
+        Evaluate pred once per distinct value -> lookup table indexed by code,
+        memoized under `key` (predicates repeat across dashboard requests).
+        """
+        table = self._luts.get(key)
+        if table is None:
+            if len(self._luts) >= self._MAX_LUTS:
+                self._luts.clear()
+            table = self._luts[key] = np.array([pred(v) for v in self.values], dtype=dtype)
+        return table
+
+    def mask(self, key, pred):
+        return self.lut(key, pred)[self.codes]
+
+
+class _Encoder:
+    def __init__(self):
+        self.index = {}
+        self.values = []
+        self.chunks = []
+
+    def add(self, values):
+        index, vals = self.index, self.values
+        codes = np.empty(len(values), dtype=np.intp)
+        for i, v in enumerate(values):
+            c = index.get(v)
+            if c is None:
+                c = index[v] = len(vals)
+                vals.append(v)
+            codes[i] = c
+        self.chunks.append(codes)
+
+    def finish(self):
+        codes = np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=np.intp)
+        return DictColumn(codes, self.values)
+
+
+class Measure:
+    """Numeric column as float64 plus a not-NULL mask; is_int => SUM returns int."""
+
+    __slots__ = ("data", "notnull", "is_int")
+
+    def __init__(self, data, notnull, is_int):
+        self.data = data
+        self.notnull = notnull
+        self.is_int = is_int
+
+
+class _MeasureBuilder:
+    def __init__(self):
+        self.chunks = []
+        self.is_int = True
+
+    def add(self, values):
+        if self.is_int and any(v is not None and not isinstance(v, int) for v in values):
+            self.is_int = False
+        self.chunks.append(np.array(values, dtype=np.float64))  # None -> nan
+
+    def finish(self):
+        data = np.concatenate(self.chunks) if self.chunks else np.empty(0)
+        notnull = ~np.isnan(data)
+        return Measure(np.where(notnull, data, 0.0), notnull, self.is_int)
+
+
+class FactTable:
+    def __init__(self, name, n, columns, measures):
+        self.name = name
+        self.n = n
+        self.columns = columns     # "s.<col>" / "cus.<attr>" -> DictColumn
+        self.measures = measures   # "qty"/"amt" -> Measure
+
+    def column(self, ref):
+        col = self.columns.get(ref.lower())
+        if col is None:
+            raise Unsupported(f"{self.name} has no column {ref}")
+        return col
+
+
+def _read_columns(cursor, sql, n_text, n_measure, label):
+    """Stream a query into encoders; first n_text columns dictionary-encoded, rest measures."""
+    cursor.execute(sql, label=label)
+    encs = [_Encoder() for _ in range(n_text)]
+    meas = [_MeasureBuilder() for _ in range(n_measure)]
+    n = 0
+    while True:
+        rows = cursor.fetchmany(_LOAD_CHUNK)
+        if not rows:
+            break
+        n += len(rows)
+        cols = list(zip(*rows))
+        for i, e in enumerate(encs):
+            e.add(cols[i])
+        for j, m in enumerate(meas):
+            m.add(cols[n_text + j])
+    return n, [e.finish() for e in encs], [m.finish() for m in meas]
+
+
+# ---------------------------------- engine ------------------------------------
+class ColumnarEngine:
+    def __init__(self):
+        self.facts = {}
+        self.categories = {}   # category table -> list of join-key values
+        self.load_seconds = 0.0
+        self.version = None
+
+    @classmethod
+    def load(cls, get_cursor):
+        """Build from the current database; get_cursor is app.get_cursor."""
+        eng = cls()
+        start = perf_counter()
+        with get_cursor(dictionary=False) as cur:
+            n, cus_cols, _ = _read_columns(
+                cur, f"SELECT ship_to, {', '.join(CUSTOMER_ATTRS)} FROM customer",
+                1 + len(CUSTOMER_ATTRS), 0, "columnar.customer_sql")
+            cus_ship = cus_cols[0]
+            cus_rows = [cus_ship.values[c] for c in cus_ship.codes]
+            cus_index = _JoinIndex(cus_rows)
+
+            for table, time_col in FACT_TABLES.items():
+                try:
+                    eng.facts[table] = eng._load_fact(cur, table, time_col, n, cus_cols, cus_index)
+                except Exception as e:
+                    print(f"[WARN] columnar: {table} not loaded ({e})")
+
+            for table, sql in (
+                ("iseg",       "SELECT Material FROM iseg"),
+                ("lowprofile", "SELECT Material FROM lowprofile"),
+                ("suv",        "SELECT Pattern FROM suv"),
+                ("hm",         "SELECT Sold_To FROM HM"),
+            ):
+                try:
+                    cur.execute(sql, label=f"columnar.{table}_sql")
+                    eng.categories[table] = [r[0] for r in cur.fetchall()]
+                except Exception as e:
+                    print(f"[WARN] columnar: {table} not loaded ({e})")
+        eng.load_seconds = perf_counter() - start
+        return eng
+
+    @staticmethod
+    def _load_fact(cur, table, time_col, n_cus, cus_cols, cus_index):
+        text_cols = (time_col,) + FACT_COLUMNS
+        n, cols, meas = _read_columns(
+            cur, f"SELECT {', '.join(text_cols + MEASURES)} FROM {table}",
+            len(text_cols), len(MEASURES), f"columnar.{table}_sql")
+
+        # LEFT JOIN customer cus ON cus.ship_to = s.ship_to, with its fan-out:
+        # each fact row repeats once per matching customer row (sentinel n_cus = no match)
+        ship = cols[text_cols.index("ship_to")]
+        matches = [cus_index.rows(v) or [n_cus] for v in ship.values]
+        fanout = np.array([len(m) for m in matches], dtype=np.int64)[ship.codes]
+        if (fanout == 1).all():
+            rows = None
+            cus_row = np.array([m[0] for m in matches], dtype=np.int64)[ship.codes]
+        else:
+            rows = np.repeat(np.arange(n), fanout)
+            starts = np.cumsum(fanout) - fanout
+            offset = np.arange(len(rows)) - np.repeat(starts, fanout)
+            flat = np.array([r for m in matches for r in m], dtype=np.int64)
+            first = np.cumsum([0] + [len(m) for m in matches])[:-1]
+            cus_row = flat[first[ship.codes[rows]] + offset]
+            n = len(rows)
+
+        columns = {}
+        for name, col in zip(text_cols, cols):
+            codes = col.codes if rows is None else col.codes[rows]
+            columns[f"s.{name}"] = DictColumn(codes, col.values)
+        for attr, col in zip(CUSTOMER_ATTRS, cus_cols[1:]):
+            # the "no customer" sentinel row reads NULL
+            values = list(col.values)
+            if None not in values:
+                values.append(None)
+            per_row = np.append(col.codes, values.index(None))
+            columns[f"cus.{attr}"] = DictColumn(per_row[cus_row].astype(np.intp), values)
+        measures = {}
+        for name, m in zip(MEASURES, meas):
+            if rows is not None:
+                m = Measure(m.data[rows], m.notnull[rows], m.is_int)
+            measures[name] = m
+        return FactTable(table, n, columns, measures)
+
+    # ------------------------------------------------------------------ filters
+    def _weights(self, fact, f):
+        """
+        build_customer_filters + category_filters + product_group/pattern as
+        (mask, weights): mask is None when nothing is filtered, weights is the
+        per-row inner-join fan-out (None when every row counts once).
+        """
+        state = {"mask": None, "w": None}
+
+        def keep(ref, key, pred):
+            m = fact.column(ref).mask(key, pred)
+            state["mask"] = m if state["mask"] is None else state["mask"] & m
+
+        def keep_eq(ref, param):
+            keep(ref, ("eq", param), lambda v: _sql_equal(v, param))
+
+        if f["region"] != "ALL":
+            keep_eq("cus.bde_state", f["region"])
+        if f["salesman"] != "ALL":
+            target = _upper_trim(f["salesman"])
+            keep("cus.salesman_name", ("upper_trim", target),
+                 lambda v: v is not None and _upper_trim(v) == target)
+        if f["sold_to_group"] != "ALL":
+            keep_eq("cus.sold_to_group", f["sold_to_group"])
+        if f["sold_to"] != "ALL":
+            sv = f["sold_to"]
+            if sv.isdigit() or sv.upper().startswith("A"):
+                keep_eq("s.ship_to", sv)
+            else:
+                keep_eq("cus.sold_to_name", sv)
+        if f["ship_to"] != "ALL":
+            keep_eq("s.ship_to", f["ship_to"])
+
+        cat = (f["category"] or "ALL").upper()
+        if cat in ("PCLT", "TBR"):
+            keep_eq("s.line", cat)
+        elif cat == "18PLUS":
+            keep_eq("s.line", "PCLT")
+            keep("s.inch", ("ge_num", 18.0), lambda v: v is not None and _cast_num(v) >= 18.0)
+        elif cat in ("ISEG", "LOWPROFILE", "SUV", "HM"):
+            table, ref, cast = {
+                "ISEG":       ("iseg",       "s.material", True),
+                "LOWPROFILE": ("lowprofile", "s.material", True),
+                "SUV":        ("suv",        "s.pattern",  False),
+                "HM":         ("hm",         "s.sold_to",  False),
+            }[cat]
+            if table not in self.categories:
+                raise Unsupported(f"category table {table} not loaded")
+            col = fact.column(ref)
+            lut = col.lut(("join", table), self._join_counter(table, cast), dtype=np.int64)
+            state["w"] = lut[col.codes]
+            joined = state["w"] > 0
+            state["mask"] = joined if state["mask"] is None else state["mask"] & joined
+
+        if f["product_group"] != "ALL":
+            keep_eq("s.product_group", f["product_group"])
+        if f["pattern"] != "ALL":
+            keep_eq("s.pattern", f["pattern"])
+        return state["mask"], state["w"]
+
+    def _join_counter(self, table, cast):
+        """v -> number of <table> rows joining to v (the inner join's fan-out)."""
+        keys = self.categories[table]
+        if cast:  # cast(trim(Material) as unsigned)
+            keys = [_cast_num(k.strip(" ") if isinstance(k, str) else k) for k in keys]
+        return _JoinIndex(keys).count
+
+    def _fact(self, table):
+        fact = self.facts.get(table)
+        if fact is None:
+            raise Unsupported(f"{table} not loaded")
+        return fact
+
+    @staticmethod
+    def _sum(measure, value):
+        if value is None:
+            return None
+        return int(round(value)) if measure.is_int else float(value)
+
+    # ------------------------------------------------------------------ queries
+    @staticmethod
+    def _grouped(codes, size, measure, mask, w):
+        """Per-group (matched rows, SUM, non-NULL count) via np.bincount."""
+        data, notnull = measure.data, measure.notnull
+        if mask is not None:
+            idx = np.flatnonzero(mask)
+            codes, data, notnull = codes[idx], data[idx], notnull[idx]
+            if w is not None:
+                w = w[idx]
+        if w is None:
+            rows = np.bincount(codes, minlength=size)
+            sums = np.bincount(codes, weights=data, minlength=size)
+            nn = np.bincount(codes, weights=notnull, minlength=size)
+        else:
+            rows = np.bincount(codes, weights=w, minlength=size)
+            sums = np.bincount(codes, weights=data * w, minlength=size)
+            nn = np.bincount(codes, weights=notnull * w, minlength=size)
+        return rows, sums, nn
+
+    def top_sold_to(self, f, value, limit=None, table="sales_2501_11"):
+        """
+        SELECT s.sold_to FROM <table> s ... GROUP BY s.sold_to
+         ORDER BY SUM(s.<value>) DESC, s.sold_to [LIMIT <limit>]
+        """
+        fact = self._fact(table)
+        mask, w = self._weights(fact, f)
+        col = fact.column("s.sold_to")
+        rows, sums, nn = self._grouped(col.codes, len(col.values), fact.measures[value], mask, w)
+        present = [int(c) for c in np.flatnonzero(rows)]
+        # GROUP BY order first (stable), then SUM DESC with NULL sums last
+        present.sort(key=lambda c: _order_key(col.values[c]))
+        present.sort(key=lambda c: (0, -sums[c]) if nn[c] else (1, 0))
+        return [col.values[c] for c in present[:limit]]
+
+    def group_sum(self, table, keys, total, value, f, top_sold_to=None):
+        """
+        Equivalent of the chart endpoints' aggregate:
+            SELECT <key> AS <alias>, ..., SUM(s.<value>) AS <total>
+              FROM <table> s <customer/category joins>
+             WHERE <filters> [AND s.sold_to IN (<top_sold_to>)]
+             GROUP BY <keys> ORDER BY <keys>
+        keys: [(column, alias)] with column "s.<col>" or "cus.<attr>".
+        Returns a list of dict rows.
+        """
+        fact = self._fact(table)
+        mask, w = self._weights(fact, f)
+
+        if top_sold_to is not None:
+            index = _JoinIndex(top_sold_to)
+            in_top = fact.column("s.sold_to").mask(("in", tuple(top_sold_to)), lambda v: index.count(v) > 0)
+            mask = in_top if mask is None else mask & in_top
+
+        cols = [fact.column(ref) for ref, _ in keys]
+        if len(cols) == 1:
+            group, size = cols[0].codes, len(cols[0].values)
+        else:
+            group, size = np.zeros(fact.n, dtype=np.int64), 1
+            for col in cols:
+                group = group * len(col.values) + col.codes
+                size *= len(col.values)
+
+        m = fact.measures[value]
+        rows, sums, nn = self._grouped(group, size, m, mask, w)
+
+        out = []
+        for g in np.flatnonzero(rows):
+            labels, rest = [], int(g)
+            for col in reversed(cols):
+                rest, code = divmod(rest, len(col.values))
+                labels.append(col.values[code])
+            labels.reverse()
+            row = {alias: v for (_, alias), v in zip(keys, labels)}
+            row[total] = self._sum(m, sums[g] if nn[g] else None)
+            out.append(row)
+        out.sort(key=lambda r: [_order_key(r[alias]) for _, alias in keys])
+        return out
+
+    def status(self):
+        return {
+            "version":      self.version,
+            "load_seconds": round(self.load_seconds, 3),
+            "facts":        {name: t.n for name, t in self.facts.items()},
+            "categories":   {name: len(v) for name, v in self.categories.items()},
+        }
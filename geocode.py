@@ -1,11 +1,62 @@
+"""
+Geocode the customer address export into lat/lon columns.
+
+Rows are geocoded on GEOCODE_WORKERS threads behind a shared token bucket
+(GEOCODE_RATE requests/sec, bursts of GEOCODE_BURST), transient failures are
+retried with exponential backoff, and results are written to a SQLite cache
+(geocode_cache.db) in batches so an interrupted run resumes where it stopped.
+The cache is keyed on a normalized address fingerprint, so identical sites
+are geocoded once and re-ordering the export keeps every result; the old
+per-line CSV caches are imported into it on first use. Addresses the API
+cannot place fall back to a postcode/locality centroid of the cached ones
+(--fallback first skips the API for any address that has one), and every
+result is tagged with its precision.
+
+    python geocode.py                                   # Google, key from GOOGLE_MAPS_API_KEY
+    python geocode.py --workers 8 --rate 20
+    python geocode.py --stub-server 8765 &              # local stand-in for the API
+    python geocode.py --url http://127.0.0.1:8765/geocode/json --rate 200
+    python geocode.py --fallback first                  # bulk run: centroids where possible
+    python geocode.py --refine                          # re-ask the API for centroid results
+"""
 import csv
+import re
 import time
 import os
+import sys
+import random
+import sqlite3
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 
 INPUT_FILE = "addresses_1.csv"             # your exported CSV from Excel
 OUTPUT_FILE = "addresses_1_geocoded.csv"   # final output
-CACHE_FILE = "geocode_1_cache.csv"         # progress cache
+CACHE_FILE = "geocode_cache.db"            # progress cache, shared by every export
+LEGACY_CACHE_FILES = ("geocode_cache.csv", "geocode_1_cache.csv")  # line_index-keyed, imported once
+
+GEOCODE_URL     = os.getenv("GEOCODE_URL", "https://maps.googleapis.com/maps/api/geocode/json")
+GEOCODE_KEY     = os.getenv("GOOGLE_MAPS_API_KEY", "")
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "8"))
+GEOCODE_RATE    = float(os.getenv("GEOCODE_RATE", "10"))    # requests per second, all workers together
+GEOCODE_BURST   = int(os.getenv("GEOCODE_BURST", "10"))
+GEOCODE_RETRIES = int(os.getenv("GEOCODE_RETRIES", "4"))    # extra attempts after a transient failure
+GEOCODE_BACKOFF = float(os.getenv("GEOCODE_BACKOFF", "1"))  # first retry delay, doubled per attempt
+CACHE_BATCH     = int(os.getenv("GEOCODE_CACHE_BATCH", "50"))
+CACHE_FLUSH_SECS = 5.0
+PROGRESS_SECS   = 5.0
+
+# HTTP / API statuses worth another attempt; anything else is final
+RETRY_HTTP   = {429, 500, 502, 503, 504}
+RETRY_STATUS = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+# result precision, best first; centroids are computed from "address" results only
+PRECISION_ADDRESS  = "address"   # the API (or customer.csv) placed the address itself
+PRECISION_LOCALITY = "locality"  # median of cached addresses with the same postcode + locality
+PRECISION_POSTCODE = "postcode"  # median of cached addresses with the same postcode
+CENTROID_MIN_POINTS = int(os.getenv("GEOCODE_CENTROID_MIN_POINTS", "2"))  # for postcode-only centroids
 
 # Column names (as they appear in your CSV header)
 ADDRESS1_COL = "Address 1"
@@ -65,21 +116,99 @@ def build_address(row):
     return ", ".join(parts)
 
 
-def geocode(address, session):
+def export_localities(paths):
     """
-    Geocode using Google Maps Geocoding API.
+    {(street fingerprint, REGION): build_address() string} from address exports,
+    for streets that appear with a single locality in their region (the same
+    street in two suburbs is left out: it cannot tell which one is meant).
+    """
+    found = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="", encoding="utf-8", errors="replace") as f:
+            for row in csv.DictReader(f):
+                street = pick_col(row, ADDRESS1_COL)
+                if street and (pick_col(row, CITY_COL) or pick_col(row, POSTCODE_COLS)):
+                    key = (address_fingerprint(street), pick_col(row, REGION_COLS).upper())
+                    found.setdefault(key, {}).setdefault(address_fingerprint(build_address(row)), build_address(row))
+    return {key: next(iter(full.values())) for key, full in found.items() if len(full) == 1}
+
+
+def customer_address(address, state, localities=None):
+    """
+    Query string for a customer.csv ship-to, which only has street and state:
+    the export's full address (with locality) when `localities` (see
+    export_localities) knows the street, else "street, STATE, Australia".
+    Blank streets give "" -- a state alone is not a site.
+    """
+    address, state = (address or "").strip(), (state or "").strip()
+    if not address:
+        return ""
+    if localities:
+        full = localities.get((address_fingerprint(address), state.upper()))
+        if full:
+            return full
+    parts = [address] + ([state] if state and state.upper() != "OTHERS" else [])  # OTHERS: bde_state bucket
+    return ", ".join(parts + ["Australia"])
+
+
+class TransientError(Exception):
+    """A failure worth retrying; retry_after is the server's hint in seconds, if any."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `burst` banked."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def geocode(address, session, url=GEOCODE_URL, key=GEOCODE_KEY):
+    """
+    Geocode using Google Maps Geocoding API (or anything answering like it).
     Returns (lat, lon) as strings, or (None, None) if not found.
+    Raises TransientError for rate limiting, server errors and timeouts.
     """
     if not address:
         return None, None
 
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {
         "address": address,
-        "key": "",  # <-- put your key here
+        "key": key,
     }
 
-    resp = session.get(url, params=params, timeout=10)
+    try:
+        resp = session.get(url, params=params, timeout=10)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise TransientError(f"{type(e).__name__}: {e}")
+    if resp.status_code in RETRY_HTTP:
+        retry_after = resp.headers.get("Retry-After")
+        raise TransientError(f"HTTP {resp.status_code}",
+                             float(retry_after) if retry_after and retry_after.isdigit() else None)
     try:
         resp.raise_for_status()
     except Exception as e:
@@ -88,6 +217,8 @@ def geocode(address, session):
 
     data = resp.json()
     status = data.get("status")
+    if status in RETRY_STATUS:
+        raise TransientError(status)
     if status != "OK" or not data.get("results"):
         print(f"No result ({status}) for '{address}'")
         return None, None
@@ -98,54 +229,248 @@ def geocode(address, session):
     return str(lat), str(lng)
 
 
-def load_cache():
+_sessions = threading.local()
+
+def geocode_with_retry(address, bucket, url=GEOCODE_URL, key=GEOCODE_KEY,
+                       retries=GEOCODE_RETRIES, backoff=GEOCODE_BACKOFF):
+    """
+    geocode() on this thread's session, one bucket token per attempt, retrying
+    TransientError with jittered exponential backoff (or the server's Retry-After).
+    Returns (lat, lon, attempts); re-raises the last TransientError when out of retries.
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            lat, lon = geocode(address, session, url, key)
+            return lat, lon, attempt + 1
+        except TransientError as e:
+            if attempt == retries:
+                raise
+            delay = e.retry_after if e.retry_after is not None else backoff * 2 ** attempt
+            delay *= random.uniform(0.8, 1.2)
+            print(f"  {e} for '{address}', retry {attempt + 1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+# spelled-out street types -> the abbreviation most of the export already uses
+ADDRESS_ABBREVIATIONS = {
+    "ROAD": "RD", "STREET": "ST", "AVENUE": "AVE", "AV": "AVE", "DRIVE": "DR",
+    "HIGHWAY": "HWY", "PLACE": "PL", "COURT": "CT", "PARADE": "PDE", "CRESCENT": "CRES",
+    "TERRACE": "TCE", "LANE": "LN", "BOULEVARD": "BLVD", "CLOSE": "CL", "CIRCUIT": "CCT",
+    "ESPLANADE": "ESP", "SQUARE": "SQ", "HWAY": "HWY", "STR": "ST",
+}
+_PO_BOX = re.compile(r"\b(?:P O|POST OFFICE|P/O) BOX\b")
+
+
+def address_fingerprint(address):
     """
-    Load geocode_cache.csv into a dict keyed by line_index:
-        cache[line_index] = (lat, lon)
+    Cache key for a build_address() string: upper case, dots dropped, commas
+    and runs of whitespace collapsed, street types abbreviated, PO boxes unified.
+        "14 Lafitte Road, WINGFIELD,  SA 5013" -> "14 LAFITTE RD WINGFIELD SA 5013"
     """
-    cache = {}
-    if not os.path.exists(CACHE_FILE):
-        return cache
+    text = address.upper().replace(".", "").replace(",", " ")
+    words = [ADDRESS_ABBREVIATIONS.get(w, w) for w in text.split()]
+    return _PO_BOX.sub("PO BOX", " ".join(words))
 
-    with open(CACHE_FILE, newline="", encoding="utf-8", errors="replace") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                line_index = int(row.get("line_index", "").strip())
-            except (ValueError, TypeError):
-                continue
-            lat = row.get("lat") or None
-            lon = row.get("lon") or None
-            cache[line_index] = (lat, lon)
-    return cache
 
+class GeocodeCache:
+    """
+    geocode results in SQLite, one row per address fingerprint (primary key):
+    lat/lon NULL means the API had no result. Written from the main thread only.
+    """
 
-def append_to_cache(line_index, built_address, lat, lon):
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS geocode (
+                fingerprint  TEXT PRIMARY KEY,
+                full_address TEXT NOT NULL,
+                lat          TEXT,
+                lon          TEXT,
+                updated_at   TEXT NOT NULL DEFAULT (datetime('now')),
+                precision    TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS migrated (
+                path TEXT PRIMARY KEY,
+                rows INTEGER NOT NULL,
+                at   TEXT NOT NULL DEFAULT (datetime('now'))
+            );
+        """)
+        if "precision" not in {r[1] for r in self.conn.execute("PRAGMA table_info(geocode)")}:
+            self.conn.execute("ALTER TABLE geocode ADD COLUMN precision TEXT")  # caches from before centroids
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def get(self, fingerprint):
+        """(lat, lon, precision) for a cached fingerprint, else None."""
+        row = self.conn.execute("SELECT lat, lon, precision FROM geocode WHERE fingerprint = ?",
+                                (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        lat, lon, precision = row
+        return lat, lon, (precision or PRECISION_ADDRESS) if lat is not None else None
+
+    def addresses(self):
+        """(full_address, lat, lon) of every address-precision result with coordinates."""
+        return self.conn.execute("""
+            SELECT full_address, lat, lon FROM geocode
+             WHERE lat IS NOT NULL AND COALESCE(precision, ?) = ?
+        """, (PRECISION_ADDRESS, PRECISION_ADDRESS)).fetchall()
+
+    def put_many(self, entries, replace=True):
+        """
+        Store [(full_address, lat, lon[, precision])] in one transaction; newer
+        results win, or with replace=False only addresses not cached yet are added.
+        """
+        if not entries:
+            return
+        conflict = ("DO UPDATE SET full_address = excluded.full_address, lat = excluded.lat,"
+                    " lon = excluded.lon, precision = excluded.precision,"
+                    " updated_at = excluded.updated_at" if replace else "DO NOTHING")
+        rows = []
+        for a, lat, lon, *precision in entries:
+            precision = precision[0] if precision else (PRECISION_ADDRESS if lat is not None else None)
+            rows.append((address_fingerprint(a), a, lat, lon, precision))
+        with self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO geocode (fingerprint, full_address, lat, lon, precision) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (fingerprint) {conflict}
+            """, rows)
+
+    def migrate_csv(self, path):
+        """
+        Import a line_index-keyed cache CSV once (recorded in `migrated`). A
+        fingerprint keeps the first coordinates found for it. Returns rows read.
+        """
+        if not os.path.exists(path):
+            return 0
+        key = os.path.abspath(path)
+        if self.conn.execute("SELECT 1 FROM migrated WHERE path = ?", (key,)).fetchone():
+            return 0
+        entries = []
+        with open(path, newline="", encoding="utf-8", errors="replace") as f:
+            for row in csv.DictReader(f):
+                address = (row.get("full_address") or "").strip()
+                if address:
+                    entries.append((address_fingerprint(address), address,
+                                    (row.get("lat") or "").strip() or None, (row.get("lon") or "").strip() or None))
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO geocode (fingerprint, full_address, lat, lon) VALUES (?, ?, ?, ?)
+                ON CONFLICT (fingerprint) DO UPDATE SET lat = excluded.lat, lon = excluded.lon
+                 WHERE geocode.lat IS NULL AND excluded.lat IS NOT NULL
+            """, entries)
+            self.conn.execute("INSERT INTO migrated (path, rows) VALUES (?, ?)", (key, len(entries)))
+        return len(entries)
+
+    def close(self):
+        self.conn.close()
+
+
+_REGION_POSTCODE = re.compile(r"^(?:[A-Z]{2,3} )?(\d{4})$")
+
+def address_locality(full_address):
     """
-    Append one result (by line index) to geocode_cache.csv.
-    Creates the file with header if it does not exist yet.
+    (postcode, locality) of a build_address() string, else (None, None):
+        "14 LAFITTE ROAD, WINGFIELD, SA 5013, Australia" -> ("5013", "WINGFIELD")
     """
-    file_exists = os.path.exists(CACHE_FILE)
-    write_header = not file_exists or os.path.getsize(CACHE_FILE) == 0
+    parts = [" ".join(p.upper().split()) for p in (full_address or "").split(",")]
+    for i, part in enumerate(parts):
+        m = _REGION_POSTCODE.match(part)
+        if m:
+            return m.group(1), parts[i - 1] if i > 0 else None
+    return None, None
+
 
-    # IMPORTANT: mode="a" for append, and keep errors="replace" if you added it
-    with open(CACHE_FILE, "a", newline="", encoding="utf-8", errors="replace") as f:
-        fieldnames = ["line_index", "full_address", "lat", "lon"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
+class CentroidIndex:
+    """
+    Offline fallback geocoder: the median coordinates of the cached
+    address-precision results per (postcode, locality) and per postcode.
+    """
 
-        if write_header:
-            writer.writeheader()
+    def __init__(self, entries):
+        by_locality, by_postcode = {}, {}
+        for full_address, lat, lon in entries:
+            postcode, locality = address_locality(full_address)
+            if postcode is None:
+                continue
+            try:
+                point = (float(lat), float(lon))
+            except (TypeError, ValueError):
+                continue
+            by_postcode.setdefault(postcode, []).append(point)
+            if locality:
+                by_locality.setdefault((postcode, locality), []).append(point)
+        self.localities = {k: self._median(v) for k, v in by_locality.items()}
+        self.postcodes = {k: self._median(v) for k, v in by_postcode.items() if len(v) >= CENTROID_MIN_POINTS}
+
+    @staticmethod
+    def _median(points):
+        return (str(round(statistics.median(p[0] for p in points), 7)),
+                str(round(statistics.median(p[1] for p in points), 7)))
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(store.addresses())
+
+    def resolve(self, full_address):
+        """(lat, lon, precision) for an address from its postcode/locality, else None."""
+        postcode, locality = address_locality(full_address)
+        if postcode is None:
+            return None
+        point = self.localities.get((postcode, locality))
+        if point is not None:
+            return (*point, PRECISION_LOCALITY)
+        point = self.postcodes.get(postcode)
+        return (*point, PRECISION_POSTCODE) if point is not None else None
+
+    def resolve_many(self, todo, store, results):
+        """Fill results[fingerprint] for the {fingerprint: address} it can place; saves them to `store`."""
+        resolved = []
+        for fp, address in todo.items():
+            hit = self.resolve(address)
+            if hit is not None:
+                results[fp] = hit
+                resolved.append((address, *hit))
+        store.put_many(resolved)
+        return len(resolved)
+
+
+class Progress:
+    """Done / failed counts with throughput and ETA, printed every PROGRESS_SECS."""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = self.found = self.failed = self.attempts = 0
+        self._start = self._printed = time.monotonic()
+
+    def add(self, found, failed=False, attempts=1):
+        self.done += 1
+        self.found += bool(found)
+        self.failed += failed
+        self.attempts += attempts
+        now = time.monotonic()
+        if now - self._printed >= PROGRESS_SECS:
+            self._printed = now
+            print(self.line(now))
+
+    def line(self, now=None):
+        elapsed = (now or time.monotonic()) - self._start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        left = self.total - self.done
+        eta = f"{left / rate:.0f}s" if rate > 0 else ("0s" if not left else "?")
+        return (f"[{self.done}/{self.total}] found {self.found}, failed {self.failed}, "
+                f"{self.attempts} requests, {rate:.1f} rows/s, elapsed {elapsed:.0f}s, eta {eta}")
 
-        writer.writerow({
-            "line_index": line_index,
-            "full_address": built_address,
-            "lat": lat,
-            "lon": lon
-        })
 
 def write_output(rows, cache):
     """
-    Write addresses_geocoded.csv using cache keyed by line index.
+    Write addresses_geocoded.csv using results keyed by line index.
     Keeps all original columns and adds lat/lon at the end.
     """
     fieldnames = list(rows[0].keys())
@@ -153,20 +478,86 @@ def write_output(rows, cache):
         fieldnames.append("lat")
     if "lon" not in fieldnames:
         fieldnames.append("lon")
+    if "precision" not in fieldnames:
+        fieldnames.append("precision")
 
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f_out:
-        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
+        writer = csv.DictWriter(f_out, fieldnames=fieldnames, extrasaction="ignore")  # rows with stray trailing fields
         writer.writeheader()
 
         for i, r in enumerate(rows, start=1):
-            lat, lon = cache.get(i, (None, None))
+            lat, lon, precision = cache.get(i, (None, None, None))
             r = dict(r)  # copy
             r["lat"] = lat
             r["lon"] = lon
+            r["precision"] = precision
             writer.writerow(r)
 
 
-def main():
+def geocode_many(todo, store, results, url=GEOCODE_URL, key=GEOCODE_KEY, workers=GEOCODE_WORKERS,
+                 rate=GEOCODE_RATE, burst=GEOCODE_BURST, retries=GEOCODE_RETRIES):
+    """
+    Geocode {fingerprint: address} on `workers` threads behind one TokenBucket,
+    filling results[fingerprint] = (lat, lon, precision) and saving to `store` in batches
+    (also when interrupted). Addresses still failing after `retries` are left
+    out of both, so the next run tries them again.
+    """
+    print(f"To geocode: {len(todo)} unique addresses on {workers} workers at {rate:g} req/s")
+    bucket = TokenBucket(rate, burst)
+    progress = Progress(len(todo))
+    pending, last_flush = [], time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="geocode")
+    try:
+        futures = {pool.submit(geocode_with_retry, address, bucket, url, key, retries): (fp, address)
+                   for fp, address in todo.items()}
+
+        for fut in as_completed(futures):
+            fp, address = futures[fut]
+            try:
+                lat, lon, attempts = fut.result()
+            except Exception as e:
+                print(f"  Error geocoding '{address}': {e}")
+                progress.add(False, failed=True, attempts=retries + 1)
+                continue
+            precision = PRECISION_ADDRESS if lat is not None else None
+            results[fp] = (lat, lon, precision)
+            pending.append((address, lat, lon, precision))
+            progress.add(lat is not None, attempts=attempts)
+
+            if len(pending) >= CACHE_BATCH or time.monotonic() - last_flush >= CACHE_FLUSH_SECS:
+                store.put_many(pending)
+                pending, last_flush = [], time.monotonic()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        store.put_many(pending)
+        if todo:
+            print(progress.line())
+    return results
+
+
+def main(argv=None):
+    global INPUT_FILE, OUTPUT_FILE, CACHE_FILE
+    ap = argparse.ArgumentParser(description="Geocode the address export (resumable).")
+    ap.add_argument("--input", default=INPUT_FILE)
+    ap.add_argument("--output", default=OUTPUT_FILE)
+    ap.add_argument("--cache", default=CACHE_FILE)
+    ap.add_argument("--url", default=GEOCODE_URL, help="geocoding endpoint (Google-compatible JSON)")
+    ap.add_argument("--workers", type=int, default=GEOCODE_WORKERS)
+    ap.add_argument("--rate", type=float, default=GEOCODE_RATE, help="requests/sec over all workers (0 = unlimited)")
+    ap.add_argument("--burst", type=int, default=GEOCODE_BURST)
+    ap.add_argument("--retries", type=int, default=GEOCODE_RETRIES)
+    ap.add_argument("--fallback", choices=("failed", "first", "none"), default="failed",
+                    help="postcode/locality centroids for addresses the API cannot place (failed), "
+                         "instead of the API wherever one exists (first), or never (none)")
+    ap.add_argument("--refine", action="store_true",
+                    help="send cached centroid results to the API again")
+    ap.add_argument("--stub-server", type=int, metavar="PORT",
+                    help="serve a fake geocoding API on PORT instead of geocoding")
+    args = ap.parse_args(argv)
+    if args.stub_server:
+        return stub_server(args.stub_server)
+    INPUT_FILE, OUTPUT_FILE, CACHE_FILE = args.input, args.output, args.cache
+
     # 1. Load input rows (DictReader so we can use column names)
     with open(INPUT_FILE, newline="", encoding="utf-8", errors="replace") as f_in:
         reader = csv.DictReader(f_in)
@@ -176,49 +567,113 @@ def main():
         print("No rows found in input file.")
         return
 
-    # 2. Load existing cache (if any), keyed by line index
-    cache = load_cache()
-    print(f"Loaded {len(cache)} cached rows from {CACHE_FILE}.")
+    # 2. Open the cache (importing the old CSV caches the first time)
+    store = GeocodeCache(CACHE_FILE)
+    cache_dir = os.path.dirname(os.path.abspath(CACHE_FILE))
+    for legacy in LEGACY_CACHE_FILES:
+        n = store.migrate_csv(os.path.join(cache_dir, legacy))
+        if n:
+            print(f"Imported {n} rows from {legacy}.")
+    print(f"Loaded cache {CACHE_FILE} ({len(store)} addresses).")
 
     total_rows = len(rows)
     print(f"Total data rows in input (excluding header): {total_rows}")
 
-    session = requests.Session()
-
+    # rows sharing a fingerprint (same site, different spelling) share one lookup
+    keys = [address_fingerprint(build_address(row)) for row in rows]
+    results, todo = {}, {}
+    for i, (row, key) in enumerate(zip(rows, keys), start=1):
+        if not key:
+            continue
+        hit = results.get(key) or store.get(key)
+        if hit is not None and not (args.refine and hit[2] in (PRECISION_LOCALITY, PRECISION_POSTCODE)):
+            results[key] = hit
+        else:
+            todo.setdefault(key, build_address(row))
+
+    centroids = CentroidIndex.from_store(store) if args.fallback != "none" else None
     try:
-        # 3. Process rows strictly in line order
-        for i, row in enumerate(rows, start=1):
-            if i in cache:
-                # already processed in a previous run
-                continue
+        if centroids is not None and args.fallback == "first":
+            n = centroids.resolve_many(todo, store, results)
+            todo = {k: a for k, a in todo.items() if k not in results}
+            print(f"Placed {n} addresses from postcode/locality centroids.")
+        # 3. Geocode concurrently; results land in any order, keyed by fingerprint
+        geocode_many(todo, store, results, url=args.url, workers=args.workers,
+                     rate=args.rate, burst=args.burst, retries=args.retries)
+        if centroids is not None and args.fallback == "failed":
+            unplaced = {k: a for k, a in todo.items() if results.get(k, (None,))[0] is None}
+            n = centroids.resolve_many(unplaced, store, results)
+            if n:
+                print(f"Placed {n} of {len(unplaced)} unresolved addresses from postcode/locality centroids.")
+    except KeyboardInterrupt:
+        print("\nInterrupted by user (Ctrl+C).")
+        print(f"Progress so far is saved in {CACHE_FILE}.")
+    finally:
+        store.close()
+        # 4. Always regenerate output with whatever we have so far
+        write_output(rows, {i: results[key] for i, key in enumerate(keys, start=1) if key in results})
+        print(f"Done (partial or full). Wrote {OUTPUT_FILE} from cache.")
 
-            built_address = build_address(row)
-            print(f"[{i}/{total_rows}] {built_address}")
 
-            if not built_address:
-                lat, lon = None, None
+def make_stub_server(port=0, latency=0.05, error_rate=0.05, retry_after=1):
+    """
+    A local stand-in for the geocoding API (not started; port 0 = any free
+    port, see .server_port): answers /geocode/json after `latency` secs with a
+    location derived from the address, ZERO_RESULTS for addresses containing
+    "NOWHERE", and HTTP 503 (with Retry-After: `retry_after` unless None) for
+    `error_rate` of requests and for the first request of each address
+    containing "FLAKY". .requests records (monotonic time, address, status).
+    """
+    import json
+    import hashlib
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            address = parse_qs(urlparse(self.path).query).get("address", [""])[0]
+            with server.lock:
+                flaky = "FLAKY" in address.upper() and address not in server.seen
+                server.seen.add(address)
+            if flaky or random.random() < error_rate:
+                server.requests.append((time.monotonic(), address, 503))
+                self.send_response(503)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            server.requests.append((time.monotonic(), address, 200))
+            if "NOWHERE" in address.upper():
+                body = {"status": "ZERO_RESULTS", "results": []}
             else:
-                try:
-                    lat, lon = geocode(built_address, session)
-                except Exception as e:
-                    print(f"  Error geocoding line {i}: {e}")
-                    lat, lon = None, None
+                h = int(hashlib.md5(address.encode()).hexdigest()[:8], 16)
+                body = {"status": "OK", "results": [{"geometry": {"location": {
+                    "lat": round(-44 + (h % 3300) / 100, 6), "lng": round(113 + (h // 3300 % 4000) / 100, 6)}}}]}
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
 
-            cache[i] = (lat, lon)
-            append_to_cache(i, built_address, lat, lon)
-            print(f"  -> lat={lat}, lon={lon}")
+        def log_message(self, *args):
+            pass
 
-            # Be polite to Nominatim
-            time.sleep(1)
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.seen, server.requests = set(), []
+    return server
 
-    except KeyboardInterrupt:
-        print("\nInterrupted by user (Ctrl+C).")
-        print("Progress so far is saved in geocode_cache.csv.")
-    finally:
-        # 4. Always regenerate output with whatever we have so far
-        write_output(rows, cache)
-        print(f"Done (partial or full). Wrote {OUTPUT_FILE} from cache.")
+
+def stub_server(port, latency=0.05, error_rate=0.05):
+    """Serve make_stub_server() on `port` until interrupted."""
+    server = make_stub_server(port, latency, error_rate)
+    print(f"stub geocoder on http://127.0.0.1:{server.server_port}/geocode/json")
+    server.serve_forever()
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
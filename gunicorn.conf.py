@@ -0,0 +1,13 @@
+"""
+gunicorn settings, read from the working directory by `gunicorn app:app`.
+
+Gives each server start its own metrics directory (see metrics.py), keyed on
+the master's pid and start time: every worker it forks inherits it, and a
+restart -- or a later server that reuses the pid -- starts from zero.
+"""
+import os
+import tempfile
+import time
+
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(),
+                                                  f"salesdata-metrics-{os.getpid()}-{int(time.time())}"))
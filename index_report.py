@@ -0,0 +1,92 @@
+"""
+Index usage per endpoint against snapshot.db.
+
+Calls every /api endpoint (caches and the columnar engine off) over a few
+representative filter sets, runs EXPLAIN QUERY PLAN on each statement it
+issues and prints which indexes were used and which tables were still
+scanned in full.
+
+    python index_report.py              # all endpoints
+    python index_report.py sales_map    # just these
+"""
+import os
+import sys
+from collections import defaultdict
+
+os.environ["USE_SQLITE"] = "1"
+os.environ["RESPONSE_CACHE"] = "0"
+os.environ["COLUMNAR_ENGINE"] = "0"
+
+import app as dashboard_app
+
+ENDPOINTS = [
+    "daily_sales", "daily_breakdown", "daily_target",
+    "monthly_sales", "monthly_breakdown", "monthly_target",
+    "yearly_sales", "yearly_breakdown", "profit_monthly", "sales_map",
+    "sold_to_groups", "sold_to_names", "ship_to_names", "product_group", "patterns",
+]
+
+FILTER_SETS = [
+    {},
+    {"region": "NSW"},
+    {"sold_to_group": "ATD", "category": "ISEG"},
+    {"category": "SUV", "top_limit": "10"},
+    {"category": "HM", "pattern": "AM09"},
+]
+
+plans = defaultdict(lambda: {"index": set(), "scan": set(), "statements": 0})
+_current = [None]
+_execute = dashboard_app.SQLiteCursorWrapper.execute
+
+
+def _explaining_execute(self, sql, params=None):
+    if _current[0] is not None and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        entry = plans[_current[0]]
+        entry["statements"] += 1
+        try:
+            rows = self._cursor.execute("EXPLAIN QUERY PLAN " + sql.replace("%s", "?"), params or ()).fetchall()
+        except Exception:
+            rows = []
+        for row in rows:
+            detail = row[-1]
+            if " USING " in detail and "INDEX" in detail:
+                entry["index"].add(detail.split(" USING ", 1)[1].split(" (")[0].split()[-1])
+            elif detail.startswith("SCAN "):
+                table = detail.split()[1]
+                if not table.startswith(("(", "SUBQUERY", "CONSTANT")):
+                    entry["scan"].add(detail[len("SCAN "):])
+    return _execute(self, sql, params)
+
+
+def main(names):
+    dashboard_app.SQLiteCursorWrapper.execute = _explaining_execute
+    client = dashboard_app.app.test_client()
+    for name in names:
+        _current[0] = name
+        for f in FILTER_SETS:
+            dashboard_app.ranking_cache.clear()
+            client.get(f"/api/{name}", query_string=f)
+    _current[0] = None
+
+    used = set()
+    for name in names:
+        entry = plans[name]
+        used |= entry["index"]
+        print(f"{name}  ({entry['statements']} statements)")
+        for ix in sorted(entry["index"]):
+            print(f"    uses  {ix}")
+        for scan in sorted(entry["scan"]):
+            print(f"    scan  {scan}")  # table alias as written in the query
+
+    with dashboard_app.get_cursor(dictionary=False) as cur:
+        cur.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%' ORDER BY name",
+                    label="index_report.indexes_sql")
+        unused = [(n, t) for n, t in cur.fetchall() if n not in used]
+    if unused:
+        print("indexes unused by these endpoints:")
+        for n, t in unused:
+            print(f"    {n} on {t}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ENDPOINTS)
@@ -1,11 +1,27 @@
 import os
+import sys
+import codecs
+import hashlib
+import argparse
+import queue
 import sqlite3
+import threading
+from datetime import datetime
+from time import perf_counter
 import pandas as pd
 
+try:
+    import resource  # peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "snapshot.db")
 RAW_BASE = os.path.join(BASE_DIR, "rawdata", "unlock")
 
+CHUNK_ROWS   = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "50000"))
+LOAD_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "4"))
+
 CSV_TABLES = {
     "customer":              "customer.csv",
     "hm":                    "hm.csv",
@@ -20,32 +36,912 @@ CSV_TABLES = {
     "profit_2501_10" :              "profit_2501_10.csv"
 }
 
-def load_csv_to_table(conn, table_name, csv_filename):
-    csv_path = os.path.join(RAW_BASE, csv_filename)
-    if not os.path.exists(csv_path):
-        print(f"[WARN] CSV not found for {table_name}: {csv_path}")
+# ----------------------------- Schema ------------------------------------------
+# Declared affinities for the columns app.py reads; any other CSV column falls
+# back to its pandas dtype. Codes (sold_to, ship_to, pattern, ...) are TEXT on
+# every table so join keys compare, and use indexes, with the same affinity.
+FACT_SCHEMA = {
+    "sold_to":       "TEXT",
+    "ship_to":       "TEXT",
+    "line":          "TEXT",
+    "product_group": "TEXT",
+    "pattern":       "TEXT",
+    "material":      "INTEGER",
+    "inch":          "REAL",
+    "qty":           "INTEGER",
+    "amt":           "INTEGER",
+}
+
+TABLE_SCHEMAS = {
+    "customer": {
+        "sold_to_group": "TEXT", "sold_to": "TEXT", "sold_to_name": "TEXT",
+        "ship_to_state": "TEXT", "ship_to": "TEXT", "ship_to_name": "TEXT",
+        "address": "TEXT", "bde_state": "TEXT",
+        "salesman_id": "INTEGER", "salesman_name": "TEXT",
+        "longitude": "REAL", "latitude": "REAL",
+    },
+    "hm":                   {"sold_to": "TEXT"},
+    "strategic_commercial": {"sold_to": "TEXT"},
+    "iseg":                 {"material": "INTEGER"},
+    "lowprofile":           {"material": "INTEGER"},
+    "suv":                  {"pattern": "TEXT", "suv": "TEXT"},
+    "sales_2501_11":        {"month": "INTEGER", **FACT_SCHEMA},
+    "sales_2511":           {"day": "INTEGER", **FACT_SCHEMA},
+    "sales_21_2511":        {"year": "INTEGER", **FACT_SCHEMA},
+    "target2025":           {"month": "INTEGER", "special": "TEXT", **FACT_SCHEMA},
+    "profit_2501_10": {
+        "month": "INTEGER", **FACT_SCHEMA,
+        "gross": "INTEGER", "sales_deduction": "INTEGER", "cogs": "INTEGER", "operating_cost": "INTEGER",
+    },
+}
+
+# lookup tables keyed by one column; the key becomes the PRIMARY KEY when the
+# CSV has it unique and non-null, otherwise it just gets a plain index
+PRIMARY_KEYS = {
+    "customer":             "ship_to",
+    "hm":                   "Sold_To",
+    "strategic_commercial": "Sold_To",
+    "iseg":                 "Material",
+    "lowprofile":           "Material",
+    "suv":                  "Pattern",
+}
+
+def column_affinity(table_name, column, dtype):
+    declared = TABLE_SCHEMAS.get(table_name, {}).get(column.lower())
+    if declared:
+        return declared
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+# ----------------------------- Loading -----------------------------------------
+# CSVs are parsed in chunks on LOAD_WORKERS reader threads; one writer (the
+# sqlite connection's thread) inserts every chunk with executemany inside a
+# single transaction. The bounded queue keeps at most a few chunks in memory.
+CATEGORY_COLUMNS = {"pattern", "product_group", "line"}  # few distinct values
+
+def csv_dtypes(table_name, header):
+    """
+    (read_csv dtypes, declared numeric columns). Numeric columns are read as
+    str too and converted per chunk by coerce_numeric(), so one stray value
+    cannot abort the build.
+    """
+    schema = TABLE_SCHEMAS.get(table_name, {})
+    dtypes, numeric = {}, []
+    for col in header:
+        affinity = schema.get(col.lower())
+        if affinity is None:
+            continue  # undeclared: pandas infers it
+        if col.lower() in CATEGORY_COLUMNS:
+            dtypes[col] = "category"
+        else:
+            # codes stay str so they keep leading zeros and never become "100142.0"
+            dtypes[col] = str
+            if affinity != "TEXT":
+                numeric.append(col)
+    return dtypes, numeric
+
+def coerce_numeric(df, columns, rejected):
+    """
+    Convert the numeric columns of a chunk to float64 (INTEGER affinity stores
+    5.0 back as 5). Blanks become NULL; so do values that are not numbers,
+    counted per column into `rejected`.
+    """
+    for col in columns:
+        text = df[col].str.strip()
+        num = pd.to_numeric(text, errors="coerce")
+        bad = int((num.isna() & text.notna() & (text != "")).sum())
+        if bad:
+            rejected[col] = rejected.get(col, 0) + bad
+        df[col] = num
+
+def detect_encoding(csv_path):
+    """utf-8-sig if the whole file decodes as UTF-8, else cp949. Streams the bytes once."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(csv_path, "rb") as fh:
+        try:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return "cp949"
+    return "utf-8-sig"
+
+def chunk_rows(df):
+    """DataFrame chunk -> list of tuples with None for missing values."""
+    cols = []
+    for name in df.columns:
+        col = df[name].astype(object)
+        cols.append(col.where(col.notna(), None).tolist())
+    return list(zip(*cols))
+
+def read_csv_chunks(table_name, csv_path, out, offset=0):
+    """
+    Reader thread: put (table, columns, dtypes, rows) per chunk, then
+    (table, None, seconds, None). offset > 0 parses only the bytes after it
+    (rows appended since the last build) under the file's header.
+    """
+    started = perf_counter()
+    try:
+        encoding = detect_encoding(csv_path)
+        if encoding != "utf-8-sig":
+            print(f"  {table_name}: not UTF-8, reading as {encoding}")
+        header = list(pd.read_csv(csv_path, encoding=encoding, nrows=0).columns)
+        with open(csv_path, "rb") as fh:
+            extra = {}
+            if offset:
+                fh.seek(offset)
+                extra = {"header": None, "names": header}
+            dtypes, numeric = csv_dtypes(table_name, header)
+            rejected = {}
+            try:
+                for df in pd.read_csv(fh, encoding=encoding, dtype=dtypes, chunksize=CHUNK_ROWS, **extra):
+                    coerce_numeric(df, numeric, rejected)
+                    out.put((table_name, list(df.columns), df.dtypes.to_dict(), chunk_rows(df)))
+            except pd.errors.EmptyDataError:
+                pass  # nothing after the offset
+            for col, n in rejected.items():
+                print(f"  [WARN] {table_name}.{col}: {n} non-numeric values loaded as NULL")
+        out.put((table_name, None, perf_counter() - started, None))
+    except Exception as e:
+        out.put((table_name, e, None, None))
+
+def create_table(conn, table_name, columns, dtypes):
+    cols = [f'"{col}" {column_affinity(table_name, col, dtypes[col])}' for col in columns]
+    cols += [f'"{col}" {decl}' for col, decl in derived_columns(table_name)]
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(f'CREATE TABLE "{table_name}" (\n  ' + ",\n  ".join(cols) + "\n)")
+
+def apply_primary_key(conn, table_name):
+    """
+    Rebuild a lookup table with PRIMARY KEY on its key column when the loaded
+    key is unique and non-null; otherwise leave it for a plain index.
+    """
+    key = PRIMARY_KEYS.get(table_name)
+    info = conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    match = [r[1] for r in info if key and r[1].lower() == key.lower()]
+    if not match:
+        return
+    col = match[0]
+    total, distinct, nulls = conn.execute(
+        f'SELECT COUNT(*), COUNT(DISTINCT TRIM("{col}")), SUM("{col}" IS NULL) FROM "{table_name}"'
+    ).fetchone()
+    if nulls or distinct != total:
+        print(f"  [WARN] {table_name}.{col} is not unique, indexing instead of PRIMARY KEY")
+        return
+    cols = [f'"{r[1]}" {r[2]}' for r in info] + [f'PRIMARY KEY ("{col}")']
+    conn.execute(f'CREATE TABLE "{table_name}__pk" (\n  ' + ",\n  ".join(cols) + "\n)")
+    conn.execute(f'INSERT INTO "{table_name}__pk" SELECT * FROM "{table_name}"')
+    conn.execute(f'DROP TABLE "{table_name}"')
+    conn.execute(f'ALTER TABLE "{table_name}__pk" RENAME TO "{table_name}"')
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+def load_csv_tables(conn, tables, offsets=None):
+    """
+    Stream every CSV in `tables` ({table: filename}) into conn and return
+    {table: (rows, seconds)}. Tables are recreated, except those in
+    `offsets` ({table: byte offset}), which get the file's tail appended.
+    The caller owns the transaction.
+    """
+    offsets = offsets or {}
+    pending = {}
+    for table_name, csv_filename in tables.items():
+        csv_path = os.path.join(RAW_BASE, csv_filename)
+        if not os.path.exists(csv_path):
+            print(f"[WARN] CSV not found for {table_name}: {csv_path}")
+            continue
+        print(f"{'Appending to' if offsets.get(table_name) else 'Loading'} {table_name} from {csv_path}...")
+        pending[table_name] = csv_path
+
+    chunks = queue.Queue(maxsize=max(LOAD_WORKERS, 1))
+    todo = queue.Queue()
+    for item in pending.items():
+        todo.put(item)
+
+    def worker():
+        while True:
+            try:
+                table_name, csv_path = todo.get_nowait()
+            except queue.Empty:
+                return
+            read_csv_chunks(table_name, csv_path, chunks, offsets.get(table_name, 0))
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(min(max(LOAD_WORKERS, 1), len(pending)))]
+    for t in workers:
+        t.start()
+
+    stats = {name: [0, 0.0] for name in pending}
+    created, failed, remaining = set(offsets), None, len(pending)
+    while remaining:
+        table_name, columns, dtypes, rows = chunks.get()
+        if columns is None or isinstance(columns, Exception):
+            remaining -= 1
+            if columns is None:
+                stats[table_name][1] = dtypes  # reader's parse + hand-off time
+            if isinstance(columns, Exception) and failed is None:
+                failed = (table_name, columns)
+            continue
+        if failed is not None:
+            continue  # drain so readers don't block, then raise below
+        if table_name not in created:
+            create_table(conn, table_name, columns, dtypes)
+            created.add(table_name)
+        names = ", ".join(f'"{c}"' for c in columns)
+        conn.executemany(f'INSERT INTO "{table_name}" ({names}) VALUES ({", ".join("?" * len(columns))})', rows)
+        stats[table_name][0] += len(rows)
+    for t in workers:
+        t.join()
+    if failed is not None:
+        raise RuntimeError(f"loading {failed[0]} failed: {failed[1]}") from failed[1]
+
+    for table_name in created - set(offsets):
+        apply_primary_key(conn, table_name)
+    return {name: tuple(v) for name, v in stats.items()}
+
+def derived_columns(table_name):
+    """[(column, declaration)] the builder adds to a loaded table and fills itself."""
+    if table_name in FLAGGED_TABLES:
+        return [(col, "INTEGER NOT NULL DEFAULT 0") for col in FLAG_COLUMNS]
+    if table_name == "customer":
+        return [(col, "INTEGER") for col in CUSTOMER_KEY_COLUMNS]
+    return []
+
+# ----------------------------- Rollups -----------------------------------------
+# Pre-aggregated copies of the sales facts, coarsest last. app.py reads the
+# _rollups catalog and sends each query to the smallest table that still has
+# every column the query filters or groups on.
+FACT_TIME_COLUMNS = {
+    "sales_2501_11": "month",
+    "sales_2511":    "day",
+    "sales_21_2511": "year",
+}
+
+ROLLUP_LEVELS = {
+    # suffix     -> grouping columns besides the time bucket and category flags
+    "by_ship":    ["sold_to", "ship_to", "product_group", "pattern", "line"],
+    "by_product": ["product_group", "pattern", "line"],
+    "by_time":    ["line"],
+}
+
+# category flag column -> (source table, fact key column, expression matching one fact key)
+# expressions are the ones category_filters() joins on, so multiplicities match.
+CATEGORY_FLAGS = {
+    "iseg_n":       ("iseg",       "material", "SELECT COUNT(*) FROM iseg i WHERE cast(trim(i.Material) as unsigned) = k.key"),
+    "lowprofile_n": ("lowprofile", "material", "SELECT COUNT(*) FROM lowprofile lp WHERE cast(trim(lp.Material) as unsigned) = k.key"),
+    "suv_n":        ("suv",        "pattern",  "SELECT COUNT(*) FROM suv suv WHERE suv.Pattern = k.key"),
+    "hm_n":         ("hm",         "sold_to",  "SELECT COUNT(*) FROM HM hm WHERE hm.Sold_To = k.key"),
+}
+
+def table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE", (name,)
+    ).fetchone() is not None
+
+# ----------------------------- Category flags ----------------------------------
+# Category membership is resolved once at load time into columns on the fact
+# rows, so app.py filters with `s.iseg_n > 0` instead of CAST(TRIM()) joins:
+#   plus18      CAST(inch AS DECIMAL) >= 18 (the 18PLUS rule)
+#   <cat>_n     rows the category table joins to the fact row (0 = not in category)
+# Keeping the count, not just a bit, lets SUM(x * <cat>_n) reproduce the JOIN's
+# fan-out exactly when a category list has duplicates.
+FLAGGED_TABLES = list(FACT_TIME_COLUMNS) + ["profit_2501_10"]
+FLAG_COLUMNS = ["plus18"] + list(CATEGORY_FLAGS)
+
+def available_flags(conn):
+    """Flag columns whose category table is in the snapshot (the rest stay 0 and unlisted)."""
+    return ["plus18"] + [col for col, spec in CATEGORY_FLAGS.items() if table_exists(conn, spec[0])]
+
+def fill_category_flags(conn, table, since_rowid=0):
+    """Compute the flag columns for `table` rows past since_rowid, one lookup per distinct key."""
+    sets = ["plus18 = CASE WHEN CAST(inch AS DECIMAL(10,2)) >= 18.0 THEN 1 ELSE 0 END"]
+    for col, (source, key, count_sql) in CATEGORY_FLAGS.items():
+        if not table_exists(conn, source):
+            continue
+        conn.execute(f"DROP TABLE IF EXISTS temp.k_{col}")
+        conn.execute(f"CREATE TEMP TABLE k_{col} (key PRIMARY KEY, n INTEGER)")
+        conn.execute(f"""
+            INSERT INTO temp.k_{col}
+            SELECT k.key, ({count_sql})
+              FROM (SELECT DISTINCT {key} AS key FROM "{table}" WHERE rowid > ? AND {key} IS NOT NULL) k
+        """, (since_rowid,))
+        sets.append(f'{col} = COALESCE((SELECT n FROM temp.k_{col} WHERE key = "{table}".{key}), 0)')
+    conn.execute(f'UPDATE "{table}" SET {", ".join(sets)} WHERE rowid > ?', (since_rowid,))
+
+def register_flagged_tables(conn):
+    """
+    List each flagged table in _rollups under its own name with every column
+    it carries, so app.py routes to it (and its flag columns) like a rollup.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS _rollups (name TEXT PRIMARY KEY, fact TEXT, columns TEXT, row_count INTEGER)")
+    unavailable = set(FLAG_COLUMNS) - set(available_flags(conn))
+    for table in FLAGGED_TABLES:
+        if not table_exists(conn, table):
+            conn.execute("DELETE FROM _rollups WHERE name = ?", (table,))
+            continue
+        columns = [r[1].lower() for r in conn.execute(f'PRAGMA table_info("{table}")') if r[1] not in unavailable]
+        n = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO _rollups VALUES (?, ?, ?, ?)", (table, table, ",".join(columns), n))
+
+def build_rollups(conn, facts=None, buckets=None):
+    """
+    For every sales fact emit <fact>__by_ship / __by_product / __by_time with
+    SUM(qty), SUM(amt) grouped by the level's columns plus the fact's category
+    flag columns and
+      cus_n       customer rows the LEFT JOIN on ship_to yields (levels without ship_to)
+    and record them in _rollups(name, fact, columns, row_count).
+
+    facts limits the rebuild to those facts (default all). buckets maps a fact
+    to time-bucket values whose rollup rows are re-aggregated in place instead
+    of rebuilding the fact's rollups (rows appended to a fact).
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS _rollups (name TEXT PRIMARY KEY, fact TEXT, columns TEXT, row_count INTEGER)")
+    if not table_exists(conn, "customer"):
+        print("[WARN] customer table missing, skipping rollups")
+        return
+
+    flags = available_flags(conn)
+    buckets = buckets or {}
+    facts = set(FACT_TIME_COLUMNS if facts is None else facts) | set(buckets)
+    built = {name for name, in conn.execute("SELECT name FROM _rollups")}
+
+    for fact, time_col in FACT_TIME_COLUMNS.items():
+        if fact not in facts:
+            continue
+        if not table_exists(conn, fact):
+            conn.execute("DELETE FROM _rollups WHERE fact = ? AND name <> fact", (fact,))
+            continue
+        # only the appended time buckets, and only if every rollup is already there
+        refresh = buckets.get(fact) if all(f"{fact}__{lvl}" in built for lvl in ROLLUP_LEVELS) else None
+        where, params = "", ()
+        if refresh is not None:
+            if not refresh:
+                continue
+            params = tuple(refresh)
+            where = f"WHERE s.{time_col} IN ({', '.join('?' * len(params))})"
+
+        conn.execute("DROP TABLE IF EXISTS temp.k_cus")
+        conn.execute(f"""
+            CREATE TEMP TABLE k_cus AS
+            SELECT k.key AS key, MAX((SELECT COUNT(*) FROM customer c WHERE c.ship_to = k.key), 1) AS n
+              FROM (SELECT DISTINCT s.ship_to AS key FROM {fact} s {where}) k
+        """, params)
+
+        for level, cols in ROLLUP_LEVELS.items():
+            name = f"{fact}__{level}"
+            dims = [f"s.{c} AS {c}" for c in [time_col] + cols + flags]
+            level_joins = []
+            if "ship_to" not in cols:
+                dims.append("COALESCE(cus_n.n, 1) AS cus_n")
+                level_joins.append("LEFT JOIN temp.k_cus cus_n ON cus_n.key = s.ship_to")
+
+            select = f"""
+                SELECT {', '.join(dims)},
+                       SUM(s.qty) AS qty,
+                       SUM(s.amt) AS amt
+                  FROM {fact} s
+                  {' '.join(level_joins)}
+                  {where}
+                 GROUP BY {', '.join(str(i + 1) for i in range(len(dims)))}
+            """
+            if refresh is not None:
+                conn.execute(f"DELETE FROM {name} WHERE {time_col} IN ({', '.join('?' * len(params))})", params)
+                conn.execute(f"INSERT INTO {name} {select}", params)
+            else:
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                conn.execute(f"CREATE TABLE {name} AS {select}")
+            columns = [time_col] + cols + flags + (["cus_n"] if "ship_to" not in cols else [])
+            n = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+            conn.execute("INSERT OR REPLACE INTO _rollups VALUES (?, ?, ?, ?)", (name, fact, ",".join(columns), n))
+            print(f"  rollup {name}: {n} rows" + (f" ({len(params)} {time_col} buckets refreshed)" if refresh is not None else ""))
+
+# ----------------------------- Customer dimension ------------------------------
+# One dim_<name>(id, key, label) table per customer filter, keyed exactly the
+# way app.build_customer_filters() compares (salesman case-folded and trimmed),
+# and the matching integer <name>_sk column on customer. The app resolves a
+# filter value to its id in memory and filters on `cus.<name>_sk = ?`.
+CUSTOMER_DIMENSIONS = {
+    # name          -> (customer column, key expression)
+    "region":        ("bde_state",     "bde_state"),
+    "salesman":      ("salesman_name", "UPPER(TRIM(salesman_name))"),
+    "sold_to_group": ("sold_to_group", "sold_to_group"),
+    "sold_to_name":  ("sold_to_name",  "sold_to_name"),
+}
+CUSTOMER_KEY_COLUMNS = [f"{name}_sk" for name in CUSTOMER_DIMENSIONS]
+
+def build_customer_dimensions(conn):
+    if not table_exists(conn, "customer"):
         return
+    for name, (col, key_expr) in CUSTOMER_DIMENSIONS.items():
+        conn.execute(f"DROP TABLE IF EXISTS dim_{name}")
+        conn.execute(f"CREATE TABLE dim_{name} (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, label TEXT)")
+        conn.execute(f"""
+            INSERT INTO dim_{name} (key, label)
+            SELECT {key_expr}, MIN(TRIM({col}))
+              FROM customer
+             WHERE {col} IS NOT NULL
+             GROUP BY {key_expr}
+             ORDER BY {key_expr}
+        """)
+        conn.execute(f"UPDATE customer SET {name}_sk = (SELECT d.id FROM dim_{name} d WHERE d.key = {key_expr})")
+        n = conn.execute(f"SELECT COUNT(*) FROM dim_{name}").fetchone()[0]
+        print(f"  dim_{name}: {n} keys")
 
-    print(f"Loading {table_name} from {csv_path}...")
+# ----------------------------- Customer geocoding ------------------------------
+# customer rows without latitude/longitude are filled from the geocode.py store
+# (keyed on the address fingerprint, see GeocodeCache); with --geocode the
+# addresses it has never seen are looked up first, so a refresh that adds a few
+# ship_tos costs a few API calls. Coordinates already in customer.csv win and
+# are added to the store.
+# customer.csv has street and state only: streets the address exports place in
+# a single locality use the export's full address (and so reuse its geocode
+# results). A fingerprint whose CSV rows disagree on the site (same street in
+# two towns) is neither stored nor filled from the store.
+GEOCODE_CACHE_DB = os.getenv("GEOCODE_CACHE_DB", os.path.join(BASE_DIR, "geocode_cache.db"))
+ADDRESS_EXPORTS  = [os.path.join(BASE_DIR, p) for p in
+                    os.getenv("ADDRESS_EXPORTS", "addresses.csv,addresses_1.csv").split(",") if p]
+GEO_CONFLICT_DEG = 0.01  # CSV coordinates of one fingerprint further apart than this (~1 km) conflict
+
+def enrich_customer_geo(conn, lookup=False):
+    if not table_exists(conn, "customer"):
+        return
+    try:
+        import geocode
+    except ImportError as e:  # requests missing: keep the CSV coordinates
+        print(f"[WARN] geocode.py unavailable ({e}), customer coordinates left as loaded")
+        return
+
+    localities = geocode.export_localities(ADDRESS_EXPORTS)
+    known, missing = {}, {}  # fingerprint -> (query, [(lat, lon)]) / (query, [rowid])
+    rows = conn.execute("SELECT rowid, address, ship_to_state, latitude, longitude FROM customer").fetchall()
+    for rowid, address, state, lat, lon in rows:
+        query = geocode.customer_address(address, state, localities)
+        fp = geocode.address_fingerprint(query)
+        if not fp:
+            continue  # blank address
+        if lat is not None and lon is not None:
+            known.setdefault(fp, (query, []))[1].append((float(lat), float(lon)))
+        else:
+            missing.setdefault(fp, (query, []))[1].append(rowid)
+
+    conflicting = {fp for fp, (_, points) in known.items()
+                   if max(p[0] for p in points) - min(p[0] for p in points) > GEO_CONFLICT_DEG
+                   or max(p[1] for p in points) - min(p[1] for p in points) > GEO_CONFLICT_DEG}
+    ambiguous = {fp: entry for fp, entry in missing.items() if fp in conflicting}
+    for fp in ambiguous:
+        del missing[fp]
+
+    store = geocode.GeocodeCache(GEOCODE_CACHE_DB)
+    try:
+        store.put_many([(query, str(points[0][0]), str(points[0][1]))
+                        for fp, (query, points) in known.items() if fp not in conflicting], replace=False)
+        results = {}
+        for fp in missing:
+            hit = store.get(fp)
+            if hit is not None:
+                results[fp] = hit
+        cached = len(results)
+        todo = {fp: query for fp, (query, _) in missing.items() if fp not in results}
+        if todo and lookup:
+            geocode.geocode_many(todo, store, results)
+    finally:
+        store.close()
+
+    updates = [(float(lat), float(lon), rowid)
+               for fp, (_, rowids) in missing.items() if fp in results
+               for lat, lon, _ in [results[fp]] if lat is not None and lon is not None
+               for rowid in rowids]
+    conn.executemany("UPDATE customer SET latitude = ?, longitude = ? WHERE rowid = ?", updates)
+    left = sum(len(rowids) for _, rowids in missing.values()) - len(updates)
+    print(f"  customer geo: {sum(len(p) for _, p in known.values())} rows from the CSV, "
+          f"{cached} addresses from the cache, {len(results) - cached} looked up, "
+          f"{left} rows still without coordinates"
+          + (f" ({sum(len(r) for _, r in ambiguous.values())} on streets with conflicting sites)" if ambiguous else "")
+          + (f" ({len(todo)} addresses not in the cache, pass --geocode)" if todo and not lookup else ""))
+
+# ----------------------------- Indexes -----------------------------------------
+# Shaped after the queries in app.py:
+#   LEFT JOIN customer cus ON cus.ship_to = s.ship_to  + cus.<dimension>_sk = ? filters
+#   JOIN iseg / lowprofile ON cast(trim(Material) as unsigned) = s.material
+#   JOIN suv ON suv.Pattern = s.pattern, JOIN HM ON hm.Sold_To = s.sold_to
+#   s.ship_to = ?, s.pattern = ?, s.product_group = ?, GROUP BY <time> / sold_to
+CUSTOMER_INDEXES = [
+    # covers the filter join without touching the table
+    ("ship_to",) + tuple(CUSTOMER_KEY_COLUMNS),
+    # drive from the customers matching a filter to their fact rows
+    *[(col, "ship_to") for col in CUSTOMER_KEY_COLUMNS],
+]
+
+def fact_indexes(time_col):
+    return [
+        (time_col,),
+        ("ship_to", time_col),
+        ("sold_to", time_col),
+        ("material",),
+        ("pattern",),
+        ("product_group", "pattern"),
+    ]
+
+def flag_indexes(time_col):
+    # partial: only the rows in the category, so `s.iseg_n > 0` reads just those
+    return [(("ship_to", time_col), f"{flag} > 0") for flag in FLAG_COLUMNS]
+
+# entries are column tuples, or (columns, where) for a partial index
+INDEXES = {
+    "customer":             CUSTOMER_INDEXES,
+    "iseg":                 [("cast(trim(Material) as unsigned)",)],
+    "lowprofile":           [("cast(trim(Material) as unsigned)",)],
+    "suv":                  [("Pattern",)],
+    "hm":                   [("Sold_To",)],
+    "strategic_commercial": [("Sold_To",)],
+    "target2025":           fact_indexes("month") + [("special", "month")],
+    "profit_2501_10":       fact_indexes("month") + flag_indexes("month"),
+    **{fact: fact_indexes(time_col) + flag_indexes(time_col) for fact, time_col in FACT_TIME_COLUMNS.items()},
+}
+
+def has_primary_key(conn, table, column):
+    return any(r[1].lower() == column.lower() and r[5]
+               for r in conn.execute(f'PRAGMA table_info("{table}")'))
+
+def create_indexes(conn, tables=None):
+    """
+    Create INDEXES (plus sold_to/ship_to on the rollups) and ANALYZE for the
+    planner. tables limits both to those tables (default all).
+    """
+    specs = dict(INDEXES)
+    rollups = conn.execute("SELECT name FROM _rollups WHERE name <> fact").fetchall() if table_exists(conn, "_rollups") else []
+    for name, in rollups:
+        cols = {r[1] for r in conn.execute(f'PRAGMA table_info("{name}")')}
+        specs[name] = [(c,) for c in ("ship_to", "sold_to") if c in cols]
+    if tables is not None:
+        specs = {t: specs[t] for t in tables if t in specs}
+
+    for table, indexes in specs.items():
+        if not table_exists(conn, table):
+            continue
+        present = {r[1].lower() for r in conn.execute(f'PRAGMA table_info("{table}")')}
+        for i, spec in enumerate(indexes):
+            cols, where = (spec, None) if isinstance(spec[0], str) else spec
+            # plain column names must exist (target2025 has no material); expressions are taken as is
+            if any(c.isidentifier() and c.lower() not in present for c in cols):
+                continue
+            if len(cols) == 1 and has_primary_key(conn, table, cols[0]):
+                continue
+            name = f"ix_{table}_{i}"
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.execute(f"CREATE INDEX {name} ON {table} ({', '.join(cols)})" + (f" WHERE {where}" if where else ""))
+            print(f"  index {name} ({', '.join(cols)})" + (f" WHERE {where}" if where else ""))
+    if tables is None:
+        conn.execute("ANALYZE")
+    else:
+        for table in tables:
+            if table_exists(conn, table):
+                conn.execute(f'ANALYZE "{table}"')
+
+# ----------------------------- Incremental refresh -----------------------------
+# _sources remembers each CSV's size/mtime/sha1 as of its last load. With
+# --incremental only changed CSVs are reloaded; a CSV that only grew (same
+# bytes up to the old size, e.g. the current-month export gaining a day) has
+# just its tail appended, and only the rollup buckets it touches are redone.
+ROLLUP_INPUTS = {"customer"} | {spec[0] for spec in CATEGORY_FLAGS.values()}
+
+def file_sha1(csv_path, prefix_size=None):
+    """(sha1 of the whole file, sha1 of its first prefix_size bytes) in one pass."""
+    whole, prefix, seen = hashlib.sha1(), None, 0
+    with open(csv_path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            if prefix is None and prefix_size is not None and seen + len(block) >= prefix_size:
+                whole.update(block[:prefix_size - seen])
+                prefix = whole.hexdigest()
+                whole.update(block[prefix_size - seen:])
+            else:
+                whole.update(block)
+            seen += len(block)
+    return whole.hexdigest(), prefix
+
+def ends_with_newline(csv_path, size):
+    with open(csv_path, "rb") as fh:
+        fh.seek(size - 1)
+        return fh.read(1) == b"\n"
+
+def record_sources(conn, fingerprints):
+    """fingerprints: {table: (csv_path, sha1)}"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS _sources (
+        name TEXT PRIMARY KEY, file TEXT, size INTEGER, mtime_ns INTEGER,
+        sha1 TEXT, row_count INTEGER, loaded_at TEXT)""")
+    for table_name, (csv_path, sha1) in fingerprints.items():
+        st = os.stat(csv_path)
+        rows = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0] if table_exists(conn, table_name) else 0
+        conn.execute("INSERT OR REPLACE INTO _sources VALUES (?, ?, ?, ?, ?, ?, datetime('now'))",
+                     (table_name, os.path.basename(csv_path), st.st_size, st.st_mtime_ns, sha1, rows))
+
+def plan_refresh(conn):
+    """
+    Compare every CSV with _sources. Returns (reload, append, touched):
+      reload   {table: filename}       changed, or never loaded
+      append   {table: byte offset}    only grew; load the bytes after offset
+      touched  {table: (path, sha1)}   every CSV whose fingerprint must be (re)recorded
+    """
+    known = {r[0]: r[1:] for r in conn.execute("SELECT name, size, mtime_ns, sha1 FROM _sources")}
+    reload, append, touched = {}, {}, {}
+    for table_name, csv_filename in CSV_TABLES.items():
+        csv_path = os.path.join(RAW_BASE, csv_filename)
+        if not os.path.exists(csv_path):
+            continue
+        st = os.stat(csv_path)
+        prev = known.get(table_name)
+        if prev is not None and table_exists(conn, table_name) and (st.st_size, st.st_mtime_ns) == tuple(prev[:2]):
+            continue  # untouched since the last load
+        old_size, _, old_sha1 = prev if prev is not None else (0, None, None)
+        grew = prev is not None and table_name not in PRIMARY_KEYS and 0 < old_size < st.st_size \
+            and ends_with_newline(csv_path, old_size)
+        sha1, prefix = file_sha1(csv_path, old_size if grew else None)
+        touched[table_name] = (csv_path, sha1)
+        if prev is None or not table_exists(conn, table_name):
+            reload[table_name] = csv_filename
+        elif sha1 == old_sha1:
+            continue  # rewritten with the same bytes, just re-stamp it
+        elif grew and prefix == old_sha1 and same_header(conn, table_name, csv_path):
+            append[table_name] = old_size
+        else:
+            reload[table_name] = csv_filename
+    return reload, append, touched
+
+def same_header(conn, table_name, csv_path):
+    header = pd.read_csv(csv_path, encoding=detect_encoding(csv_path), nrows=0).columns
+    derived = {col for col, _ in derived_columns(table_name)}
+    return [c.lower() for c in header] == [r[1].lower() for r in conn.execute(f'PRAGMA table_info("{table_name}")')
+                                           if r[1] not in derived]
+
+def refresh(current, geocode=False):
+    """
+    Bring the published snapshot up to date with the CSVs. Changes are
+    applied to a private copy, whose path is returned for publishing;
+    returns `current` when nothing changed and None when the snapshot
+    predates _sources and needs a full build.
+    """
+    conn = sqlite3.connect(current, isolation_level=None, timeout=60)
     try:
-        df = pd.read_csv(csv_path, encoding="utf-8-sig")
-    except UnicodeDecodeError:
-        print("  UTF-8 decode failed, trying cp949...")
-        df = pd.read_csv(csv_path, encoding="cp949")
+        if not table_exists(conn, "_sources"):
+            return None
+        started = perf_counter()
+        reload, append, touched = plan_refresh(conn)
+        if not reload and not append:
+            if touched:
+                # same bytes, new mtimes: re-stamp in place rather than publish a copy
+                conn.execute("BEGIN IMMEDIATE")
+                record_sources(conn, touched)
+                conn.execute("COMMIT")
+            print("Snapshot is up to date.")
+            return current
 
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
+        target = new_snapshot_path()
+        print(f"Copying {os.path.basename(current)} to {os.path.basename(target)}...")
+        copy = sqlite3.connect(target, isolation_level=None)
+        conn.backup(copy)
+    finally:
+        conn.close()
 
-def main():
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+    copy.execute("PRAGMA journal_mode = OFF")  # unpublished copy: a failure just deletes it
+    copy.execute("PRAGMA synchronous = OFF")
+    try:
+        conn = copy
+        conn.execute("BEGIN")
+        # rows past these rowids are the appended ones
+        last_rowid = {t: conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{t}"').fetchone()[0] for t in append}
+        loaded = load_csv_tables(conn, {**reload, **{t: CSV_TABLES[t] for t in append}}, offsets=append)
+        for table_name, (rows, secs) in loaded.items():
+            print(f"  {table_name}: {rows} rows in {secs:.2f}s")
+
+        if "customer" in reload:
+            build_customer_dimensions(conn)
+        if "customer" in reload or "customer" in append:
+            enrich_customer_geo(conn, lookup=geocode)
+
+        flag_sources = {spec[0] for spec in CATEGORY_FLAGS.values()}
+        for table_name in FLAGGED_TABLES:
+            if not table_exists(conn, table_name):
+                continue
+            if table_name in reload or flag_sources & set(reload):
+                fill_category_flags(conn, table_name)
+            elif table_name in append:
+                fill_category_flags(conn, table_name, since_rowid=last_rowid[table_name])
+
+        if ROLLUP_INPUTS & set(reload):
+            rollup_facts, buckets = None, {}  # category/customer changes touch every rollup
+        else:
+            rollup_facts = [t for t in reload if t in FACT_TIME_COLUMNS]
+            buckets = {
+                t: [r[0] for r in conn.execute(
+                    f'SELECT DISTINCT "{FACT_TIME_COLUMNS[t]}" FROM "{t}" WHERE rowid > ?', (last_rowid[t],))]
+                for t in append if t in FACT_TIME_COLUMNS
+            }
+        if rollup_facts is None or rollup_facts or buckets:
+            print("Refreshing rollups...")
+            build_rollups(conn, facts=rollup_facts, buckets=buckets)
+
+        register_flagged_tables(conn)
+        rollups = conn.execute("SELECT name, fact FROM _rollups WHERE name <> fact").fetchall()
+        rebuilt = [name for name, fact in rollups if rollup_facts is None or fact in rollup_facts]
+        bucketed = [name for name, fact in rollups if fact in buckets]
+        print("Indexing...")
+        conn.execute("PRAGMA analysis_limit = 1000")  # approximate stats are plenty here
+        create_indexes(conn, tables=list(reload) + rebuilt)
+        for table_name in list(append) + bucketed:
+            conn.execute(f'ANALYZE "{table_name}"')
+
+        record_sources(conn, touched)
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA journal_mode = DELETE")
+    except Exception:
+        conn.close()
+        os.remove(target)
+        raise
+    conn.close()
+    print(f"Refreshed {', '.join(sorted(set(reload) | set(append)))} in {perf_counter() - started:.2f}s")
+    return target
+
+# ----------------------------- Publishing --------------------------------------
+# Builds never touch the snapshot the app is serving. Each one is written to
+# its own snapshots/snapshot-<stamp>.db and then published by atomically
+# replacing snapshot.current, a one-line file naming it (app.snapshot_path()).
+# Workers switch connections, caches and the columnar engine on their next
+# request; the previous SNAPSHOT_KEEP files are kept for requests still
+# reading them. snapshot.db, the tracked file deploys without a pointer serve
+# (Render / procfile), is then replaced by a copy of the published file
+# unless --no-legacy-db is given.
+SNAPSHOT_DIR  = os.path.join(BASE_DIR, "snapshots")
+POINTER_PATH  = os.path.join(BASE_DIR, "snapshot.current")
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+
+def current_snapshot():
+    """The published snapshot file, else a legacy snapshot.db, else None."""
+    try:
+        with open(POINTER_PATH, encoding="utf-8") as fh:
+            name = fh.read().strip()
+        path = os.path.join(os.path.dirname(POINTER_PATH), name)
+        if name and os.path.exists(path):
+            return path
+    except OSError:
+        pass
+    return DB_PATH if os.path.exists(DB_PATH) else None
+
+def new_snapshot_path():
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(SNAPSHOT_DIR, f"snapshot-{stamp}.db")
+
+def publish(path):
+    """Point snapshot.current at `path` (write temp + fsync + rename), then prune old files."""
+    name = os.path.relpath(path, os.path.dirname(POINTER_PATH))
+    tmp = f"{POINTER_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(name + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, POINTER_PATH)
+    print(f"Published {name}")
 
-    conn = sqlite3.connect(DB_PATH)
+    snapshots = sorted(f for f in os.listdir(SNAPSHOT_DIR) if f.startswith("snapshot-") and f.endswith(".db"))
+    for old in snapshots[:-max(SNAPSHOT_KEEP, 1)]:
+        if os.path.join(SNAPSHOT_DIR, old) == os.path.abspath(path):
+            continue
+        try:
+            os.remove(os.path.join(SNAPSHOT_DIR, old))
+        except OSError:
+            pass  # still open somewhere (Windows); next publish retries
 
-    for table_name, csv_file in CSV_TABLES.items():
-        load_csv_to_table(conn, table_name, csv_file)
+def write_legacy_db(path):
+    """Copy `path` to snapshot.db through the backup API (temp file + rename)."""
+    tmp = f"{DB_PATH}.{os.getpid()}.tmp"
+    src = sqlite3.connect(path)
+    try:
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+        os.replace(tmp, DB_PATH)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        src.close()
+    print(f"Copied {os.path.basename(path)} to {os.path.basename(DB_PATH)}")
+
+def full_build(target, geocode=False):
+    # unpublished file until it is complete: no rollback journal, no fsyncs
+    conn = sqlite3.connect(target, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    try:
+        started = perf_counter()
+        conn.execute("BEGIN")
+        loaded = load_csv_tables(conn, CSV_TABLES)
+        conn.execute("COMMIT")
+        for table_name, (rows, secs) in loaded.items():
+            print(f"  {table_name}: {rows} rows in {secs:.2f}s ({rows / max(secs, 1e-9):,.0f} rows/s)")
+        total_rows = sum(rows for rows, _ in loaded.values())
+        secs = perf_counter() - started
+        print(f"Loaded {total_rows} rows in {secs:.2f}s ({total_rows / max(secs, 1e-9):,.0f} rows/s)")
+
+        print("Building customer dimensions...")
+        build_customer_dimensions(conn)
+
+        print("Geocoding customers...")
+        enrich_customer_geo(conn, lookup=geocode)
 
+        print("Flagging categories...")
+        for table_name in FLAGGED_TABLES:
+            if table_exists(conn, table_name):
+                fill_category_flags(conn, table_name)
+
+        print("Building rollups...")
+        build_rollups(conn)
+        register_flagged_tables(conn)
+
+        print("Indexing...")
+        create_indexes(conn)
+
+        print("Fingerprinting sources...")
+        record_sources(conn, {t: (os.path.join(RAW_BASE, f), file_sha1(os.path.join(RAW_BASE, f))[0])
+                              for t, f in CSV_TABLES.items() if t in loaded})
+
+        conn.execute("PRAGMA journal_mode = DELETE")
+    except BaseException:
+        conn.close()  # journal is off, so nothing to roll back: drop the partial file
+        os.remove(target)
+        raise
     conn.close()
-    print("Done. snapshot.db created from rawdata/unlock CSVs.")
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"Peak memory: {peak:.0f} MB")
+    print(f"Done. {os.path.basename(target)} built from the CSVs in {RAW_BASE}.")
+
+def main(argv=None):
+    global RAW_BASE, DB_PATH, POINTER_PATH, SNAPSHOT_DIR
+    parser = argparse.ArgumentParser(description="Build snapshot.db from the rawdata/unlock CSVs.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reload only the CSVs that changed since the last build")
+    parser.add_argument("--geocode", action="store_true",
+                        help="look up customer addresses missing from the geocode cache (network)")
+    parser.add_argument("--raw", default=RAW_BASE, help="directory of the source CSVs (default: rawdata/unlock)")
+    parser.add_argument("--pointer", default=POINTER_PATH,
+                        help="snapshot.current to publish to; snapshots/ is created next to it "
+                             "(app.py: SNAPSHOT_POINTER)")
+    parser.add_argument("--legacy-db", action=argparse.BooleanOptionalAction, default=True,
+                        help="also copy the published snapshot to snapshot.db next to the pointer, "
+                             "the file deploys without snapshot.current serve (default: on)")
+    args = parser.parse_args(argv)
+    RAW_BASE = os.path.abspath(args.raw)
+    if os.path.abspath(args.pointer) != POINTER_PATH:
+        POINTER_PATH = os.path.abspath(args.pointer)
+        SNAPSHOT_DIR = os.path.join(os.path.dirname(POINTER_PATH), "snapshots")
+        DB_PATH = os.path.join(os.path.dirname(POINTER_PATH), "snapshot.db")
+
+    current = current_snapshot()
+    if args.incremental and current is not None:
+        target = refresh(current, geocode=args.geocode)
+        if target is not None:
+            if target != current:
+                publish(target)
+                if args.legacy_db:
+                    write_legacy_db(target)
+            return
+        print(f"{os.path.basename(current)} has no source fingerprints, doing a full build.")
+    target = new_snapshot_path()
+    full_build(target, geocode=args.geocode)
+    publish(target)
+    if args.legacy_db:
+        write_legacy_db(target)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,278 @@
+"""
+Counters and histograms in the Prometheus text format, summed over every
+gunicorn worker.
+
+Each process records into its own in-memory registry, which a background
+thread writes to METRICS_DIR/<pid>-<start>.json every METRICS_FLUSH_SECS
+while it changes (atomically, via a temp file). A scrape, served by whichever worker gets it, flushes its
+own state and sums all the files, so the numbers cover the whole server.
+Files of workers that have exited are folded into archive.json so counters
+never go backwards while gunicorn recycles workers.
+
+METRICS_DIR is set per server start by gunicorn.conf.py (the master's pid and
+start time, inherited by every worker), so a restart starts from zero. Unset
+or "" -- python app.py, flask run, a gunicorn started without that config --
+keeps metrics per process.
+"""
+import atexit
+import json
+import os
+import threading
+from bisect import bisect_left
+from time import sleep, time
+
+try:
+    import fcntl
+except ImportError:  # no cross-process lock (Windows): scrapes don't compact
+    fcntl = None
+
+METRICS_DIR        = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_SECS = float(os.getenv("METRICS_FLUSH_SECS", "1"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS   = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_ARCHIVE = "archive.json"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.series = {}  # label values -> value
+        registry.add(self)
+
+    def inc(self, *labels, value=1):
+        with registry.lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+            registry.changes += 1
+
+    def samples(self, series):
+        for labels, value in sorted(series.items()):
+            yield self.name, self.labels, labels, value
+
+
+class Histogram:
+    """Per-bucket counts (not cumulative) plus sum and count for each label set."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        registry.add(self)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with registry.lock:
+            entry = self.series.get(labels)
+            if entry is None:
+                entry = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+            registry.changes += 1
+
+    def samples(self, series):
+        names = self.labels + ("le",)
+        for labels, entry in sorted(series.items()):
+            total = 0
+            for le, n in zip(self.buckets + ("+Inf",), entry[:-1]):
+                total += n
+                yield f"{self.name}_bucket", names, labels + (_fmt(le),), total
+            yield f"{self.name}_sum", self.labels, labels, entry[-1]
+            yield f"{self.name}_count", self.labels, labels, total
+
+
+class Registry:
+    def __init__(self, directory=METRICS_DIR):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.directory = directory or None
+        self._started()
+        if hasattr(os, "register_at_fork"):
+            # a preloaded app forks workers: each starts empty with its own file
+            os.register_at_fork(after_in_child=self._forked)
+
+    def _started(self):
+        self._file = f"{os.getpid()}-{int(time() * 1000)}.json"
+        self._flusher = None
+        self.changes = 0
+
+    def _forked(self):
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.series.clear()
+        self._started()
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        with self.lock:
+            return {name: [[list(labels), value if isinstance(value, (int, float)) else list(value)]
+                           for labels, value in m.series.items()]
+                    for name, m in self.metrics.items()}
+
+    # ---- cross-process store ----
+    def start_flusher(self):
+        """Start this process's flush thread (once; cheap to call per request)."""
+        if self.directory is None or self._flusher is not None:
+            return
+        with self.lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        written = None
+        while True:
+            sleep(METRICS_FLUSH_SECS)
+            if self.changes != written:
+                written = self.changes
+                self.flush()
+
+    def flush(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_json(os.path.join(self.directory, self._file), {"pid": os.getpid(), "metrics": self.snapshot()})
+        except OSError as e:
+            print("[WARN] metrics flush failed:", e)
+
+    def _files(self):
+        return [n for n in os.listdir(self.directory) if n.endswith(".json") and n != _ARCHIVE]
+
+    def _compact(self):
+        """Fold the files of exited workers into the archive (caller holds the lock)."""
+        archive = _read_json(os.path.join(self.directory, _ARCHIVE)) or {"files": [], "metrics": {}}
+        # files the archive already holds may survive a crash between its
+        # write and their unlink: drop them before it forgets their names
+        _unlink(self.directory, archive["files"])
+        dead = [n for n in self._files() if n not in archive["files"] and not _alive(*_owner(n))]
+        if dead:
+            totals = self._empty()
+            _add(totals, archive["metrics"])
+            for name in dead:
+                _add(totals, (_read_json(os.path.join(self.directory, name)) or {}).get("metrics", {}))
+            _write_json(os.path.join(self.directory, _ARCHIVE), {"files": dead, "metrics": _dump(totals)})
+            _unlink(self.directory, dead)
+
+    def _empty(self):
+        return {name: {} for name in self.metrics}
+
+    def collect(self):
+        """{metric name: {label values: value}} summed over all workers."""
+        if self.directory is None:
+            totals = self._empty()
+            _add(totals, self.snapshot())
+            return totals
+        self.flush()
+        lock = None
+        try:
+            if fcntl is not None:
+                lock = open(os.path.join(self.directory, ".lock"), "a")
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._compact()
+            archive = _read_json(os.path.join(self.directory, _ARCHIVE)) or {"files": [], "metrics": {}}
+            totals = self._empty()
+            _add(totals, archive["metrics"])
+            for name in self._files():
+                if name not in archive["files"]:
+                    _add(totals, (_read_json(os.path.join(self.directory, name)) or {}).get("metrics", {}))
+            return totals
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        totals = self.collect()
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample, names, values, value in metric.samples(totals[name]):
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values))
+                lines.append(f"{sample}{{{labels}}} {_fmt(value)}" if labels else f"{sample} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _add(totals, snapshot):
+    for name, series in snapshot.items():
+        target = totals.get(name)
+        if target is None:
+            continue  # metric no longer exists
+        metric = registry.metrics[name]
+        for labels, value in series:
+            labels = tuple(labels)
+            if len(labels) != len(metric.labels):
+                continue
+            if metric.kind == "counter":
+                target[labels] = target.get(labels, 0) + value
+            elif len(value) == len(metric.buckets) + 2:
+                entry = target.get(labels)
+                target[labels] = list(value) if entry is None else [a + b for a, b in zip(entry, value)]
+
+def _dump(totals):
+    return {name: [[list(labels), value] for labels, value in series.items()] for name, series in totals.items()}
+
+def _owner(name):
+    """(pid, start in epoch secs) from a <pid>-<ms>.json file name."""
+    pid, ms = name[:-len(".json")].split("-")
+    return int(pid), int(ms) / 1000
+
+def _alive(pid, since):
+    """True while the process that wrote a file started at `since` still runs."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    started = _process_start(pid)
+    return started is None or started <= since + 1  # started later: the pid was reused
+
+def _process_start(pid):
+    """Start time of pid in epoch seconds (Linux /proc), else None."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as fh:
+            ticks = int(fh.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat", encoding="ascii") as fh:
+            boot = next(int(line.split()[1]) for line in fh if line.startswith("btime "))
+        return boot + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+def _unlink(directory, names):
+    for name in names:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, obj):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(obj, fh, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _fmt(v):
+    if isinstance(v, float):
+        return str(int(v)) if v.is_integer() else repr(v)
+    return str(v)
+
+
+registry = Registry()
+if registry.directory is not None:
+    atexit.register(registry.flush)  # a worker's last counts survive its exit
@@ -0,0 +1,149 @@
+"""
+Re-run statements from the slow-query log (see SLOW_QUERY_LOG in app.py) for
+before/after comparisons.
+
+Each distinct statement (SQL + parameters) is run --repeat times against the
+database the app is configured for (USE_SQLITE=1 -> the published snapshot)
+and reported with its logged and replayed timings, rows and current plan.
+
+    python replay_slow_queries.py                          # every logged statement, slowest first
+    python replay_slow_queries.py --query sales_map_rows.map_sql --top 5 --plan
+    python replay_slow_queries.py --repeat 5 --save before.json
+    ... add an index / change the SQL / rebuild the snapshot ...
+    python replay_slow_queries.py --repeat 5 --compare before.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+from time import perf_counter
+
+SLOW_QUERY_LOG = (os.getenv("SLOW_QUERY_LOG")
+                  or os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "slow_queries.jsonl"))
+os.environ["SLOW_QUERY_LOG"] = ""   # replays must not log themselves
+os.environ.setdefault("METRICS_DIR", "")
+
+import app as dashboard_app
+
+
+def statement_key(entry):
+    return hashlib.sha1(json.dumps([entry["sql"], entry["params"]], default=str).encode()).hexdigest()[:12]
+
+
+def load_entries(path, query=None, endpoint=None, since=None):
+    """{key: logged entry} for distinct statements, keeping the slowest logging of each."""
+    log = dashboard_app.SlowQueryLog(path)
+    entries = {}
+    for name in log.files():
+        with open(name, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue  # torn line
+                if (query and e.get("query") != query) or (endpoint and e.get("endpoint") != endpoint) \
+                        or (since and e.get("ts", "") < since):
+                    continue
+                key = statement_key(e)
+                seen = entries.get(key)
+                if seen is None:
+                    entries[key] = dict(e, key=key, logged=1)
+                else:
+                    seen["logged"] += 1
+                    if e["duration_ms"] > seen["duration_ms"]:
+                        entries[key] = dict(e, key=key, logged=seen["logged"])
+    return entries
+
+
+def replay(entry, repeat):
+    """Run one logged statement `repeat` times; returns its timings, rows and plan."""
+    times, rows = [], None
+    with dashboard_app.get_connection() as conn:
+        for _ in range(repeat):
+            cur = conn.cursor(dictionary=False, buffered=True)
+            try:
+                t0 = perf_counter()
+                cur.execute(entry["sql"], tuple(entry["params"]))
+                rows = len(cur.fetchall())
+                times.append((perf_counter() - t0) * 1000)
+            finally:
+                cur.close()
+        plan = dashboard_app.explain_query(conn, entry["sql"], tuple(entry["params"]))
+    return {"best_ms": round(min(times), 3), "median_ms": round(statistics.median(times), 3),
+            "rows": rows, "plan": plan}
+
+
+def plan_lines(plan):
+    return [row.get("detail") or json.dumps(row, default=str) for row in plan]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--log", default=SLOW_QUERY_LOG, help="slow-query log (default: $SLOW_QUERY_LOG)")
+    ap.add_argument("--query", help="only this statement label, e.g. daily_sales.sql")
+    ap.add_argument("--endpoint", help="only statements logged by this endpoint")
+    ap.add_argument("--since", help="only entries logged at or after this ISO timestamp")
+    ap.add_argument("--top", type=int, default=0, help="only the N slowest statements")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--plan", action="store_true", help="print the current plan of each statement")
+    ap.add_argument("--save", help="write the results as JSON (input for --compare)")
+    ap.add_argument("--compare", help="JSON from an earlier --save to diff against")
+    args = ap.parse_args(argv)
+
+    backend = "sqlite" if dashboard_app.USE_SQLITE else "mysql"
+    entries = load_entries(args.log, args.query, args.endpoint, args.since)
+    other = [k for k, e in entries.items() if e.get("backend", backend) != backend]
+    for k in other:
+        del entries[k]
+    if other:
+        print(f"skipping {len(other)} statements logged against another backend than {backend}")
+    todo = sorted(entries.values(), key=lambda e: -e["duration_ms"])
+    if args.top:
+        todo = todo[:args.top]
+    if not todo:
+        print("no logged statements match")
+        return 1
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = {r["key"]: r for r in json.load(fh)["results"]}
+
+    results = []
+    print(f"{'key':12}  {'query':34} {'logged':>9} {'best':>9} {'median':>9} {'rows':>7}"
+          + (f" {'before':>9} {'change':>7}" if baseline else ""))
+    for e in todo:
+        r = {"key": e["key"], "query": e["query"], "endpoint": e.get("endpoint"),
+             "logged_ms": e["duration_ms"], "logged": e["logged"], **replay(e, max(args.repeat, 1))}
+        results.append(r)
+        line = f"{r['key']:12}  {r['query'][:34]:34} {r['logged_ms']:9.1f} {r['best_ms']:9.1f} {r['median_ms']:9.1f} {r['rows']:7}"
+        before = baseline.get(r["key"])
+        if before is not None:
+            change = (r["median_ms"] / before["median_ms"] - 1) * 100 if before["median_ms"] else 0.0
+            line += f" {before['median_ms']:9.1f} {change:+6.0f}%"
+            if before["rows"] != r["rows"]:
+                line += f"  rows {before['rows']} -> {r['rows']}"
+        elif baseline:
+            line += f" {'-':>9} {'new':>7}"
+        print(line)
+        if args.plan:
+            old = plan_lines(before["plan"]) if before is not None else None
+            for detail in plan_lines(r["plan"]):
+                print(f"{'':14}{detail}")
+            if old is not None and old != plan_lines(r["plan"]):
+                print(f"{'':14}(was)")
+                for detail in old:
+                    print(f"{'':16}{detail}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fh:
+            json.dump({"backend": backend, "data_version": dashboard_app.data_version(), "repeat": args.repeat,
+                       "results": results}, fh, indent=1, default=str)
+        print(f"saved {len(results)} results to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
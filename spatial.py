@@ -0,0 +1,102 @@
+"""
+KD-tree over customer coordinates for the nearest-customer queries.
+
+Points are stored as unit vectors on the sphere, where straight-line (chord)
+distance grows monotonically with great-circle distance, so k-nearest and
+radius answers are exact for haversine distances while the tree itself only
+does cheap axis-aligned comparisons. Pure Python: building 10^4 points takes
+milliseconds and a query visits O(log n + k) nodes.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_xyz(lat, lng):
+    phi, lam = math.radians(lat), math.radians(lng)
+    c = math.cos(phi)
+    return (c * math.cos(lam), c * math.sin(lam), math.sin(phi))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class KDTree:
+    """
+    Balanced KD-tree of (lat, lng) points with an id each. Nodes live in
+    flat lists (point, split axis, left child, right child; -1 = none).
+    """
+
+    def __init__(self, points, ids):
+        self.ids = list(ids)
+        self.xyz = [to_xyz(lat, lng) for lat, lng in points]
+        self.point, self.axis, self.left, self.right = [], [], [], []
+        self.root = self._build(list(range(len(self.xyz))))
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def _build(self, idx):
+        if not idx:
+            return -1
+        xyz = self.xyz
+        # split on the axis with the widest spread, at the median
+        spreads = [max(xyz[i][a] for i in idx) - min(xyz[i][a] for i in idx) for a in range(3)]
+        axis = spreads.index(max(spreads))
+        idx.sort(key=lambda i: xyz[i][axis])
+        mid = len(idx) // 2
+        node = len(self.point)
+        self.point.append(idx[mid])
+        self.axis.append(axis)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.left[node] = self._build(idx[:mid])
+        self.right[node] = self._build(idx[mid + 1:])
+        return node
+
+    def _search(self, q, k, bound, accept):
+        """Up to k (chord^2, point) nearest to q within chord^2 `bound`, as a max-heap."""
+        heap = []  # (-d2, point)
+        xyz, ids = self.xyz, self.ids
+        stack = [(self.root, 0.0)] if self.root >= 0 else []  # (node, min chord^2 to its region)
+        while stack:
+            node, reach = stack.pop()
+            if reach > (-heap[0][0] if len(heap) == k else bound):
+                continue
+            p = self.point[node]
+            v = xyz[p]
+            d2 = (v[0] - q[0]) ** 2 + (v[1] - q[1]) ** 2 + (v[2] - q[2]) ** 2
+            worst = -heap[0][0] if len(heap) == k else bound
+            if d2 <= worst and (accept is None or accept(ids[p])):
+                if len(heap) == k:
+                    heapq.heapreplace(heap, (-d2, p))
+                else:
+                    heapq.heappush(heap, (-d2, p))
+                worst = -heap[0][0] if len(heap) == k else bound
+            a = self.axis[node]
+            diff = q[a] - v[a]
+            near, far = (self.left[node], self.right[node]) if diff < 0 else (self.right[node], self.left[node])
+            # push far before near so the near side is searched first and tightens `worst`
+            if far >= 0 and diff * diff <= worst:
+                stack.append((far, max(reach, diff * diff)))
+            if near >= 0:
+                stack.append((near, reach))
+        return heap
+
+    def nearest(self, lat, lng, k=1, max_km=None, accept=None):
+        """[(distance_km, id)] of the k points nearest to (lat, lng), closest first."""
+        if k <= 0:
+            return []
+        bound = km_to_chord(max_km) ** 2 if max_km is not None else float("inf")
+        heap = self._search(to_xyz(lat, lng), k, bound, accept)
+        return [(chord_to_km(math.sqrt(-d2)), self.ids[p]) for d2, p in sorted(heap, reverse=True)]
+
+    def within(self, lat, lng, km, accept=None):
+        """[(distance_km, id)] of every point within km of (lat, lng), closest first."""
+        return self.nearest(lat, lng, k=len(self.xyz), max_km=km, accept=accept)
@@ -91,6 +91,24 @@ const fetchJSON = async (u) => {
     return [];
   }
 };
+// ?format=columnar payload -> row objects: {length, columns:{name: values | {dict, codes}}}
+function fromColumnar(p){
+  if (!p || Array.isArray(p) || !p.columns) return p;
+  const names = Object.keys(p.columns);
+  const cols = names.map(n => {
+    const c = p.columns[n];
+    return Array.isArray(c) ? c : c.codes.map(i => c.dict[i]);
+  });
+  const rows = new Array(p.length);
+  for (let i = 0; i < p.length; i++) {
+    const row = {};
+    for (let j = 0; j < names.length; j++) row[names[j]] = cols[j][i];
+    rows[i] = row;
+  }
+  return rows;
+}
+// large row sets (breakdowns, map): fetch column arrays and expand them client-side
+const fetchRows = async (u) => fromColumnar(await fetchJSON(`${u}${u.includes('?') ? '&' : '?'}format=columnar`));
 const setActive = (wrap, attr, val) => {
   if (!wrap) return;
   wrap.querySelectorAll(".btn").forEach(b => {
@@ -449,31 +467,13 @@ async function fetchDailySales(){
   return fetchJSON(`/api/daily_sales?${qs}`);
 }
 
-async function fetchDailyKPIActual(region,BDE){
-  const qs=new URLSearchParams({
-    metric:filters.metric, category:filters.category, region:region, salesman:BDE,
-    sold_to_group:filters.sold_to_group, sold_to:filters.sold_to, ship_to:filters.ship_to,
-    product_group:filters.product_group, pattern:filters.pattern, top_limit:filters.top_limit ||0
-  }).toString();
-  return fetchJSON(`/api/daily_sales?${qs}`);
-}
-
-async function fetchDailyKPITarget(region,BDE){
-  const qs=new URLSearchParams({
-    metric:filters.metric, category:filters.category, region:region, salesman:BDE,
-    sold_to_group:filters.sold_to_group, sold_to:filters.sold_to, ship_to:filters.ship_to,
-    product_group:filters.product_group, pattern:filters.pattern, top_limit:filters.top_limit ||0
-  }).toString();
-  return fetchJSON(`/api/daily_target?${qs}`);
-}
-
 async function fetchDailyBreakdownWithGroup(groupBy){
   const qs = new URLSearchParams({
     metric:filters.metric, category:filters.category, region:filters.region, salesman:filters.salesman,
     sold_to_group:filters.sold_to_group, sold_to:filters.sold_to, ship_to:filters.ship_to,
     product_group:filters.product_group, pattern:filters.pattern, group_by: groupBy, top_limit:filters.top_limit ||0
   }).toString();
-  return fetchJSON(`/api/daily_breakdown?${qs}`);
+  return fetchRows(`/api/daily_breakdown?${qs}`);
 }
 
 
@@ -736,21 +736,17 @@ function dailyKPIFromSeries(sales, targets){
   return last != null ? +last.toFixed(1) : null;
 }
 
-async function fetchMonthlyKPIActual(region,BDE){
-  const qs=new URLSearchParams({
-    metric:filters.metric, category:filters.category, region:region, salesman:BDE,
-    sold_to_group:filters.sold_to_group, sold_to:filters.sold_to, ship_to:filters.ship_to,
-    product_group:filters.product_group, pattern:filters.pattern, top_limit:filters.top_limit ||0
-  }).toString();
-  return fetchJSON(`/api/monthly_sales?${qs}`);
-}
-async function fetchMonthlyKPITarget(region,BDE){
+// monthly + daily actual/target for one region/BDE in a single /api/dashboard round trip
+async function fetchKPISeries(region,BDE){
   const qs=new URLSearchParams({
+    series:"monthly_sales,monthly_target,daily_sales,daily_target",
     metric:filters.metric, category:filters.category, region:region, salesman:BDE,
     sold_to_group:filters.sold_to_group, sold_to:filters.sold_to, ship_to:filters.ship_to,
     product_group:filters.product_group, pattern:filters.pattern, top_limit:filters.top_limit ||0
   }).toString();
-  return fetchJSON(`/api/monthly_target?${qs}`);
+  const d = await fetchJSON(`/api/dashboard?${qs}`);
+  const rows = k => Array.isArray(d?.[k]) ? d[k] : [];
+  return [rows("monthly_sales"), rows("monthly_target"), rows("daily_sales"), rows("daily_target")];
 }
 
 // build & render table
@@ -759,30 +755,12 @@ async function drawMonthlyKPI(){
 
   // All row (no region/salesman filter)
   {
-    const qsSales = new URLSearchParams({
-      metric: filters.metric, category: filters.category, region: "ALL", salesman:"ALL",
-      sold_to_group: filters.sold_to_group, sold_to: filters.sold_to, ship_to: filters.ship_to,
-      product_group: filters.product_group, pattern: filters.pattern, top_limit:filters.top_limit ||0
-    }).toString();
-    const qsTarget = new URLSearchParams({
-      metric: filters.metric,
-      category: filters.category, region: "ALL", salesman:"ALL",
-      sold_to_group: filters.sold_to_group, sold_to: filters.sold_to, ship_to: filters.ship_to,
-      product_group: filters.product_group, pattern: filters.pattern, top_limit:filters.top_limit ||0
-    }).toString();
-
-     // monthly + daily in parallel
     const [
       salesRows,
       targetRows,
       dailySalesRows,
       dailyTargetRows
-    ] = await Promise.all([
-      fetchJSON(`/api/monthly_sales?${qsSales}`),
-      fetchJSON(`/api/monthly_target?${qsTarget}`),
-      fetchJSON(`/api/daily_sales?${qsSales}`),
-      fetchJSON(`/api/daily_target?${qsTarget}`)
-    ]);
+    ] = await fetchKPISeries("ALL", "ALL");
 
     const sales    = salesRows.map(r => +r.value || 0);
     const targets  = targetRows.map(r => +r.value || 0);
@@ -810,12 +788,7 @@ async function drawMonthlyKPI(){
         targetRows,
         dailySalesRows,
         dailyTargetRows
-      ] = await Promise.all([
-        fetchMonthlyKPIActual(region, bde),
-        fetchMonthlyKPITarget(region, bde),
-        fetchDailyKPIActual(region, bde),
-        fetchDailyKPITarget(region, bde)
-      ]);
+      ] = await fetchKPISeries(region, bde);
 
       const sales    = salesRows.map(r => +r.value || 0);
       const targets  = targetRows.map(r => +r.value || 0);
@@ -895,7 +868,7 @@ async function fetchMonthlyBreakdownWithGroup(groupBy){
     product_group:filters.product_group, pattern:filters.pattern, group_by: groupBy, top_limit:filters.top_limit ||0
   };
   const qs=new URLSearchParams(params).toString();
-  return fetchJSON(`/api/monthly_breakdown?${qs}`);
+  return fetchRows(`/api/monthly_breakdown?${qs}`);
 }
 
 async function drawMonthlyTotals(){
@@ -1072,7 +1045,7 @@ async function fetchYearlyBreakdownWithGroup(groupBy) {
     top_limit:filters.top_limit ||0,
     group_by:      groupBy
   }).toString();
-  return fetchJSON(`/api/yearly_breakdown?${qs}`);
+  return fetchRows(`/api/yearly_breakdown?${qs}`);
 }
 
 
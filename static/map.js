@@ -26,6 +26,12 @@ let salesMapLayer = null;
 let shopMonthlyInst = null;
 let shopYearlyInst  = null;
 
+// The server clusters ship_tos per zoom level and viewport (/api/sales_map?zoom=&bbox=),
+// so every pan / zoom asks for just what is on screen.
+let salesMapDrawn = "";   // query of the view currently drawn
+let salesMapSeq = 0;      // drops responses overtaken by a newer view
+let salesMapMoveTimer = null;
+
 function initSalesMap() {
   if (salesMap) return;
 
@@ -42,15 +48,16 @@ function initSalesMap() {
   }).addTo(salesMap);
 
   salesMapLayer = L.layerGroup().addTo(salesMap);
-}
 
-// This is called from refreshAllWithKpi() when we are on the map page
-async function loadSalesMap() {
-  initSalesMap();
-  if (!salesMapLayer) return;
-  salesMapLayer.clearLayers();
+  // redraw the viewport once panning / zooming settles
+  salesMap.on("moveend", () => {
+    clearTimeout(salesMapMoveTimer);
+    salesMapMoveTimer = setTimeout(drawSalesMapView, 150);
+  });
+}
 
-  const qs = new URLSearchParams({
+function salesMapParams() {
+  return new URLSearchParams({
     metric:        filters.metric,
     category:      filters.category,
     region:        filters.region,
@@ -61,69 +68,114 @@ async function loadSalesMap() {
     product_group: filters.product_group,
     pattern:       filters.pattern,
     top_limit:     filters.top_limit || 0
-  }).toString();
+  });
+}
 
-  const data = await fetchJSON(`/api/sales_map?${qs}`);
-  if (!Array.isArray(data) || data.length === 0) {
+// This is called from refreshAllWithKpi() when we are on the map page
+async function loadSalesMap() {
+  initSalesMap();
+  if (!salesMapLayer) return;
+
+  // filters changed: fit the map to everything that matches, then draw the view
+  const qs = salesMapParams();
+  qs.set("zoom", salesMap.getZoom());
+  const data = await fetchJSON(`/api/sales_map?${qs.toString()}`);
+  const points = (data?.points || []).map(r => [+r.latitude, +r.longitude]);
+  (data?.clusters || []).forEach(c => {
+    points.push([c.bounds[1], c.bounds[0]], [c.bounds[3], c.bounds[2]]);
+  });
+
+  salesMapDrawn = "";
+  if (points.length === 1) {
+    salesMap.setView(points[0], 10, { animate: false });
+  } else if (points.length > 1) {
+    salesMap.fitBounds(L.latLngBounds(points).pad(0.1), { animate: false });
+  } else {
+    salesMapLayer.clearLayers();
     salesMap.setView([-25.0, 133.0], 4);
     return;
   }
+  await drawSalesMapView();
+}
 
-  const points = [];
+async function drawSalesMapView() {
+  const qs = salesMapParams();
+  qs.set("zoom", salesMap.getZoom());
+  qs.set("bbox", salesMap.getBounds().pad(0.2).toBBoxString());
+  const key = qs.toString();
+  if (key === salesMapDrawn) return;
+  salesMapDrawn = key;
 
-  data.forEach(row => {
-    const lat = row.lat ?? row.latitude ?? row.Latitude;
-    const lng = row.lng ?? row.longitude ?? row.Longitude;
-    if (lat == null || lng == null) return;
+  const seq = ++salesMapSeq;
+  const data = await fetchJSON(`/api/sales_map?${key}`);
+  if (seq !== salesMapSeq) return;
 
-    const total  = row.total_value ?? row.total ?? 0;
-    const radius = 4 + Math.log10(total + 1) * 3;
+  salesMapLayer.clearLayers();
+  (data?.clusters || []).forEach(addClusterMarker);
+  (data?.points || []).forEach(addShopMarker);
+}
 
-    const regionVal = row.region ?? row.Region;
-    const shipTo = row.ship_to ?? row.Ship_To ?? "";
-    const shipNm = row.ship_to_name ?? row.Ship_To_Name ?? "";
-    const bde    = row.bde ?? row.BDE ?? row.BDE_Name ?? "";
+function addClusterMarker(c) {
+  const size = Math.round(26 + Math.log10(c.count) * 10);
+  const marker = L.marker([c.latitude, c.longitude], {
+    icon: L.divIcon({
+      className: "map-cluster",
+      html: `<span>${c.count}</span>`,
+      iconSize: [size, size]
+    })
+  });
+  marker.bindTooltip(
+    `${c.count} ship-tos<br>Total: ${Number(c.total_value || 0).toLocaleString()}`
+  );
+  // zoom into the cluster's extent
+  marker.on("click", () => {
+    salesMap.fitBounds([[c.bounds[1], c.bounds[0]], [c.bounds[3], c.bounds[2]]], { padding: [30, 30] });
+  });
+  marker.addTo(salesMapLayer);
+}
 
-    const color = getBdeColor(bde);
+function addShopMarker(row) {
+  const lat = row.lat ?? row.latitude ?? row.Latitude;
+  const lng = row.lng ?? row.longitude ?? row.Longitude;
+  if (lat == null || lng == null) return;
 
-    const latNum = +lat;
-    const lngNum = +lng;
+  const total  = row.total_value ?? row.total ?? 0;
+  const radius = 4 + Math.log10(total + 1) * 3;
 
-    const marker = L.circleMarker([latNum, lngNum], {
-      radius,
-      color,
-      fillColor: color,
-      fillOpacity: 0.7,
-      weight: 1
-    });
+  const regionVal = row.region ?? row.Region;
+  const shipTo = row.ship_to ?? row.Ship_To ?? "";
+  const shipNm = row.ship_to_name ?? row.Ship_To_Name ?? "";
+  const bde    = row.bde ?? row.BDE ?? row.BDE_Name ?? "";
 
-    marker.bindPopup(
-      `${shipTo} - ${shipNm}<br>` +
-      `Region: ${regionVal || "-"}<br>` +
-      `BDE: ${bde || "-"}<br>` +
-      `Total: ${Number(total || 0).toLocaleString()}`
-    );
-
-    marker.on("click", () => {
-      const titleEl = document.getElementById("shopTitle");
-      if (titleEl) {
-        titleEl.textContent = (shipNm || shipTo) + " – Monthly / Yearly";
-      }
-      drawShopCharts(shipTo);
-    });
+  const color = getBdeColor(bde);
+
+  const latNum = +lat;
+  const lngNum = +lng;
 
-    marker.addTo(salesMapLayer);
-    points.push([latNum, lngNum]);
+  const marker = L.circleMarker([latNum, lngNum], {
+    radius,
+    color,
+    fillColor: color,
+    fillOpacity: 0.7,
+    weight: 1
   });
 
-  if (points.length === 1) {
-    salesMap.setView(points[0], 10);
-  } else if (points.length > 1) {
-    const bounds = L.latLngBounds(points);
-    salesMap.fitBounds(bounds.pad(0.1));
-  } else {
-    salesMap.setView([-25.0, 133.0], 4);
-  }
+  marker.bindPopup(
+    `${shipTo} - ${shipNm}<br>` +
+    `Region: ${regionVal || "-"}<br>` +
+    `BDE: ${bde || "-"}<br>` +
+    `Total: ${Number(total || 0).toLocaleString()}`
+  );
+
+  marker.on("click", () => {
+    const titleEl = document.getElementById("shopTitle");
+    if (titleEl) {
+      titleEl.textContent = (shipNm || shipTo) + " – Monthly / Yearly";
+    }
+    drawShopCharts(shipTo);
+  });
+
+  marker.addTo(salesMapLayer);
 }
 
 function monthlyMapOptions() {
@@ -179,11 +231,11 @@ async function drawShopCharts(shipToCode) {
     pattern:       filters.pattern
   });
 
-  const [salesRows, targetRows, yearlyRows] = await Promise.all([
-    fetchJSON("/api/monthly_sales?" + params.toString()),
-    fetchJSON("/api/monthly_target?" + params.toString()),
-    fetchJSON("/api/yearly_sales?" + params.toString())
-  ]);
+  params.set("series", "monthly_sales,monthly_target,yearly_sales");
+  const d = await fetchJSON("/api/dashboard?" + params.toString());
+  const salesRows  = Array.isArray(d?.monthly_sales)  ? d.monthly_sales  : [];
+  const targetRows = Array.isArray(d?.monthly_target) ? d.monthly_target : [];
+  const yearlyRows = Array.isArray(d?.yearly_sales)   ? d.yearly_sales   : [];
 
   const monthLabels  = ["Ja","Fe","Ma","Ap","Ma","Ju","Ju","Au","Se","Oc","No","De"];
   const sales   = monthLabels.map((_, i) => Number((salesRows[i]?.value)  || 0));
@@ -0,0 +1,265 @@
+"""
+Synthetic rawdata CSVs at any scale, for make_sqlite_snapshot.py and benchmark.py.
+
+Writes customer, sales_2501_11, sales_2511, sales_21_2511, target2025 and
+profit_2501_10 (plus the category lists) with the same headers as
+rawdata/unlock. Distributions are taken from the sample there: the product
+mix (line / product_group / pattern / material / inch), qty and unit-price
+spread per line, regions, salesmen and coordinates. On top of that:
+  - customer purchase volume is Zipf-distributed (a tenth of the ship_tos carry
+    most rows)
+  - sold_tos own a heavy-tailed number of ship_tos, grouped into sold_to_groups
+  - months follow a seasonal curve, days the sample's trading-day pattern, and
+    sales_21_2511 grows year over year
+
+    python synth_data.py --rows 1e6 --out /tmp/synth-1e6
+    python make_sqlite_snapshot.py --raw /tmp/synth-1e6 --pointer /tmp/synth-1e6/snapshot.current
+"""
+import argparse
+import csv
+import os
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(BASE_DIR, "rawdata", "unlock")
+
+CHUNK = 1_000_000
+# customer volume ~ 1 / (rank + ZIPF_Q) ** ZIPF_S: like the sample, the top
+# ship_to takes ~2% of the rows and the top 10% about 60%
+ZIPF_S, ZIPF_Q = 1.0, 10
+
+# share of the requested rows per fact table
+FACT_SHARES = {
+    "sales_2501_11":  0.45,
+    "sales_21_2511":  0.35,
+    "sales_2511":     0.10,
+    "target2025":     0.05,
+    "profit_2501_10": 0.05,
+}
+
+FACT_HEADERS = {
+    "sales_2511":     ["day", "sold_to", "ship_to", "Line", "product_group", "pattern", "material", "inch", "qty", "amt"],
+    "sales_2501_11":  ["month", "sold_to", "ship_to", "line", "product_group", "pattern", "material", "inch", "qty", "amt"],
+    "sales_21_2511":  ["year", "sold_to", "ship_to", "line", "product_group", "pattern", "material", "inch", "qty", "amt"],
+    "target2025":     ["month", "sold_to", "ship_to", "line", "special", "product_group", "pattern", "qty", "amt"],
+    "profit_2501_10": ["month", "sold_to", "ship_to", "line", "product_group", "pattern", "material", "inch",
+                       "gross", "sales_deduction", "cogs", "operating_cost"],
+}
+
+CUSTOMER_HEADER = ["sold_to_group", "sold_to", "sold_to_name", "ship_to_state", "ship_to", "ship_to_name",
+                   "address", "bde_state", "salesman_id", "salesman_name", "longitude", "latitude"]
+
+# Jan..Dec volume: slow summer start, autumn / spring peaks
+MONTH_WEIGHTS = np.array([0.70, 0.80, 1.00, 1.05, 1.10, 1.00, 0.95, 1.00, 1.05, 1.15, 1.20, 0.90])
+YEAR_GROWTH = 1.06
+YEARS = np.arange(2021, 2026)
+
+
+def default_customers(rows):
+    """Ship_to count for a scale: ~2k at 1e5 rows, ~65k at 1e8."""
+    return int(min(max(6.5 * rows ** 0.5, 2000), 200_000))
+
+
+def _read_sample(name):
+    path = os.path.join(SAMPLE_DIR, name)
+    for encoding in ("utf-8-sig", "cp949"):
+        try:
+            return pd.read_csv(path, encoding=encoding, dtype=str, keep_default_na=False)
+        except UnicodeDecodeError:
+            continue
+
+
+class Sample:
+    """The distributions the generator draws from, estimated from rawdata/unlock."""
+
+    def __init__(self):
+        sales = _read_sample("sales_2511.csv")
+        sales["qty"] = sales["qty"].astype(int)
+        sales["amt"] = sales["amt"].astype(float)
+        sales = sales[sales["qty"] > 0]
+        # catalog weighted by how often each material sells
+        by_material = sales.groupby(["Line", "product_group", "pattern", "material", "inch"], as_index=False)
+        catalog = by_material.agg(rows=("qty", "size"), qty=("qty", "sum"), amt=("amt", "sum"))
+        self.products = catalog[["Line", "product_group", "pattern", "material", "inch"]].to_numpy()
+        self.product_p = (catalog["rows"] / catalog["rows"].sum()).to_numpy()
+        self.unit_price = (catalog["amt"] / catalog["qty"]).to_numpy()
+        self.qty = {line: g["qty"].to_numpy() for line, g in sales.groupby("Line")}
+        days = sales["day"].astype(int).value_counts()
+        self.days = days.index.to_numpy()
+        self.day_p = (days / days.sum()).to_numpy()
+
+        customers = _read_sample("customer.csv")
+        customers = customers[(customers["bde_state"] != "") & (customers["latitude"] != "")]
+        self.customers = customers
+        self.groups = [g for g in customers["sold_to_group"].unique() if g]
+
+        self.iseg = _read_sample("iseg.csv")["Material"].tolist()
+        self.lowprofile = _read_sample("lowprofile.csv")["Material"].tolist()
+        self.suv = _read_sample("suv.csv")
+
+
+def make_customers(sample, n_ship, rng):
+    """(customer rows, purchase weight of each ship_to)."""
+    n_sold = max(n_ship * 2 // 5, 1)
+    # heavy-tailed ship_tos per sold_to: every sold_to has one, the rest go Zipf
+    extra = rng.choice(n_sold, size=n_ship - n_sold, p=_zipf(n_sold, 1.2, rng)) if n_ship > n_sold else []
+    owner = np.concatenate([np.arange(n_sold), extra]).astype(int)
+    owner.sort()
+
+    templates = sample.customers.iloc[rng.integers(0, len(sample.customers), n_sold)].reset_index(drop=True)
+    # about 40% of sold_tos sit in a group, larger groups first
+    group_p = _zipf(len(sample.groups), 1.0, rng)
+    grouped = rng.random(n_sold) < 0.4
+    groups = np.where(grouped, np.array(sample.groups, dtype=object)[rng.choice(len(sample.groups), n_sold, p=group_p)], "")
+
+    sold_codes = np.array([f"S{i:07d}" for i in range(n_sold)], dtype=object)
+    first = np.r_[True, owner[1:] != owner[:-1]]
+    ship_codes = np.where(first, sold_codes[owner], np.array([f"H{i:07d}" for i in range(n_ship)], dtype=object))
+
+    t = templates.iloc[owner].reset_index(drop=True)
+    # ship_tos scatter ~5 km around their sold_to's template location
+    lat = t["latitude"].astype(float).to_numpy() + rng.normal(0, 0.045, n_ship)
+    lng = t["longitude"].astype(float).to_numpy() + rng.normal(0, 0.055, n_ship)
+    customers = pd.DataFrame({
+        "sold_to_group": groups[owner],
+        "sold_to":       sold_codes[owner],
+        "sold_to_name":  [f"CUSTOMER {i:07d} PTY LTD" for i in owner],
+        "ship_to_state": t["ship_to_state"],
+        "ship_to":       ship_codes,
+        "ship_to_name":  [f"CUSTOMER {o:07d} SITE {i:07d}" for i, o in enumerate(owner)],
+        "address":       [f"{1 + i % 400} SYNTHETIC ROAD" for i in range(n_ship)],
+        "bde_state":     t["bde_state"],
+        "salesman_id":   t["salesman_id"],
+        "salesman_name": t["salesman_name"],
+        "longitude":     lng.round(7),
+        "latitude":      lat.round(7),
+    })
+    return customers, _zipf(n_ship, ZIPF_S, rng, ZIPF_Q)
+
+
+def _zipf(n, s, rng, q=0):
+    """Shuffled Zipf-Mandelbrot(s, q) probabilities over n items."""
+    w = 1.0 / (np.arange(1, n + 1) + q) ** s
+    rng.shuffle(w)
+    return w / w.sum()
+
+
+def fact_chunks(table, rows, sample, customers, ship_p, flags, rng):
+    """DataFrames of one fact table, CHUNK rows at a time."""
+    sold_to = customers["sold_to"].to_numpy()
+    ship_to = customers["ship_to"].to_numpy()
+    line_col = "Line" if table == "sales_2511" else "line"
+    done = 0
+    while done < rows:
+        n = min(CHUNK, rows - done)
+        done += n
+        c = rng.choice(len(ship_to), n, p=ship_p)
+        pi = rng.choice(len(sample.products), n, p=sample.product_p)
+        prod = sample.products[pi]
+        line = prod[:, 0]
+        qty = np.empty(n, dtype=np.int64)
+        for name, values in sample.qty.items():
+            mask = line == name
+            qty[mask] = rng.choice(values, mask.sum())
+        amt = np.rint(qty * sample.unit_price[pi] * rng.lognormal(0, 0.12, n)).astype(np.int64)
+
+        df = pd.DataFrame({"sold_to": sold_to[c], "ship_to": ship_to[c], line_col: line,
+                           "product_group": prod[:, 1], "pattern": prod[:, 2],
+                           "material": prod[:, 3], "inch": prod[:, 4]})
+        if table == "sales_2511":
+            df.insert(0, "day", rng.choice(sample.days, n, p=sample.day_p))
+        elif table == "sales_21_2511":
+            w = YEAR_GROWTH ** np.arange(len(YEARS))
+            w[-1] *= MONTH_WEIGHTS[:11].sum() / MONTH_WEIGHTS.sum()  # 2025 runs to November
+            df.insert(0, "year", rng.choice(YEARS, n, p=w / w.sum()))
+        else:
+            months = {"sales_2501_11": 11, "profit_2501_10": 10, "target2025": 12}[table]
+            w = MONTH_WEIGHTS[:months]
+            df.insert(0, "month", rng.choice(np.arange(1, months + 1), n, p=w / w.sum()))
+
+        if table == "target2025":
+            df["special"] = special(df, flags)
+            df["qty"] = np.ceil(qty * 1.1).astype(np.int64)
+            df["amt"] = np.rint(amt * 1.1).astype(np.int64)
+        elif table == "profit_2501_10":
+            df["gross"] = amt
+            df["sales_deduction"] = np.rint(amt * rng.uniform(0.02, 0.08, n)).astype(np.int64)
+            df["cogs"] = np.rint(amt * rng.uniform(0.55, 0.70, n)).astype(np.int64)
+            df["operating_cost"] = np.rint(amt * rng.uniform(0.05, 0.12, n)).astype(np.int64)
+        else:
+            df["qty"], df["amt"] = qty, amt
+        yield df[FACT_HEADERS[table]]
+
+
+def special(df, flags):
+    """target2025.special for each row, using the same category lists as the sales facts."""
+    line = df["line"].to_numpy()
+    out = np.full(len(df), "", dtype=object)
+    out[(line == "PCLT") & (df["inch"].astype(float).to_numpy() >= 18)] = "HighInch"
+    out[df["pattern"].isin(flags["suv"]).to_numpy()] = "SUV"
+    out[df["material"].isin(flags["lowprofile"]).to_numpy() | df["sold_to"].isin(flags["strategic"]).to_numpy()] \
+        = "Low Profile / Strategic TBR"
+    out[df["material"].isin(flags["iseg"]).to_numpy()] = "iSeg"
+    out[df["sold_to"].isin(flags["hm"]).to_numpy()] = "HM"
+    return out
+
+
+def generate(out_dir, rows, customers=None, seed=1):
+    """Write every CSV make_sqlite_snapshot.py loads into out_dir; returns {table: rows}."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    sample = Sample()
+    n_ship = customers or default_customers(rows)
+    started = perf_counter()
+
+    cust, ship_p = make_customers(sample, n_ship, rng)
+    cust.to_csv(os.path.join(out_dir, "customer.csv"), index=False, columns=CUSTOMER_HEADER)
+    sold = cust["sold_to"].unique()
+    flags = {
+        "hm":         rng.choice(sold, max(len(sold) * 6 // 100, 1), replace=False),
+        "strategic":  rng.choice(sold, max(len(sold) // 80, 1), replace=False),
+        "iseg":       sample.iseg,
+        "lowprofile": sample.lowprofile,
+        "suv":        sample.suv["Pattern"].tolist(),
+    }
+    _write_list(out_dir, "hm.csv", "Sold_To", flags["hm"])
+    _write_list(out_dir, "strategic_commercial.csv", "Sold_To", flags["strategic"])
+    _write_list(out_dir, "iseg.csv", "Material", flags["iseg"])
+    _write_list(out_dir, "lowprofile.csv", "Material", flags["lowprofile"])
+    sample.suv.to_csv(os.path.join(out_dir, "suv.csv"), index=False)
+
+    written = {"customer": len(cust)}
+    for table, share in FACT_SHARES.items():
+        n = max(int(rows * share), 1)
+        path = os.path.join(out_dir, f"{table}.csv")
+        t0 = perf_counter()
+        for i, df in enumerate(fact_chunks(table, n, sample, cust, ship_p, flags, rng)):
+            df.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        written[table] = n
+        print(f"  {table}: {n:,} rows in {perf_counter() - t0:.1f}s")
+    print(f"Generated {sum(written.values()):,} rows ({n_ship:,} ship_tos) in {perf_counter() - started:.1f}s -> {out_dir}")
+    return written
+
+
+def _write_list(out_dir, name, header, values):
+    with open(os.path.join(out_dir, name), "w", newline="", encoding="utf-8") as fh:
+        w = csv.writer(fh)
+        w.writerow([header])
+        w.writerows([v] for v in values)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Generate synthetic rawdata CSVs.")
+    ap.add_argument("--rows", type=float, required=True, help="total fact rows, e.g. 1e6")
+    ap.add_argument("--out", required=True, help="directory for the CSVs")
+    ap.add_argument("--customers", type=int, help="ship_to count (default grows with sqrt(rows))")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+    generate(args.out, int(args.rows), args.customers, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import csv
+import importlib
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def build_snapshot(raw, pointer, *args):
+    """make_sqlite_snapshot.py --raw raw --pointer pointer [args], offline; returns the published file."""
+    root = os.path.dirname(pointer)
+    env = dict(os.environ, GEOCODE_CACHE_DB=os.path.join(root, "geocode_cache.db"), ADDRESS_EXPORTS="")
+    subprocess.run([sys.executable, os.path.join(ROOT, "make_sqlite_snapshot.py"), "--raw", raw, "--pointer", pointer,
+                    "--no-legacy-db", *args], cwd=ROOT, env=env, check=True, capture_output=True)
+    with open(pointer) as fh:
+        return os.path.join(root, fh.read().strip())
+
+
+def read_csv(path):
+    with open(path, newline="") as fh:
+        return list(csv.DictReader(fh))
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture(scope="session")
+def raw_data(tmp_path_factory):
+    """~20k synthetic rows (synth_data.py); one ship_to is listed twice in customer.csv (join fan-out)."""
+    pytest.importorskip("numpy")
+    pytest.importorskip("pandas")
+    import synth_data
+
+    raw = str(tmp_path_factory.mktemp("raw"))
+    synth_data.generate(raw, 20000, customers=120, seed=7)
+
+    counts = {}
+    for row in read_csv(os.path.join(raw, "sales_2501_11.csv")):
+        counts[row["ship_to"]] = counts.get(row["ship_to"], 0) + 1
+    busiest = max(sorted(counts), key=counts.get)
+    path = os.path.join(raw, "customer.csv")
+    rows = read_csv(path)
+    dup = dict(next(r for r in rows if r["ship_to"] == busiest))
+    dup.update(bde_state="VIC" if dup["bde_state"] != "VIC" else "NSW", salesman_name="Second Listing")
+    write_csv(path, rows + [dup])
+    return raw
+
+
+@pytest.fixture(scope="session")
+def snapshot(raw_data, tmp_path_factory):
+    """(pointer, published file) of raw_data; the app fixture serves it."""
+    pointer = str(tmp_path_factory.mktemp("published") / "snapshot.current")
+    return pointer, build_snapshot(raw_data, pointer)
+
+
+@pytest.fixture(scope="session")
+def app(snapshot):
+    os.environ.update(USE_SQLITE="1", SNAPSHOT_POINTER=snapshot[0], RESPONSE_CACHE="0",
+                      METRICS_DIR="", SLOW_QUERY_LOG="", COLUMNAR_ENGINE="0")
+    return importlib.import_module("app")
+
+
+@pytest.fixture(scope="session")
+def conn(snapshot):
+    c = sqlite3.connect(snapshot[1])
+    c.row_factory = sqlite3.Row
+    yield c
+    c.close()
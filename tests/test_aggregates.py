@@ -0,0 +1,263 @@
+"""
+The chart endpoints (AGGREGATES in app.py) against a plain-SQL reference of
+what each one returns, on a small synthetic snapshot, for every filter /
+category / metric / top_limit combination below -- answered by SQL on the
+rollups, SQL on the raw facts (USE_ROLLUPS off) and the columnar engine.
+"""
+import itertools
+import json
+
+import pytest
+
+CATEGORIES = ["ALL", "PCLT", "TBR", "18PLUS", "ISEG", "SUV", "LOWPROFILE", "HM"]
+GROUPS = {
+    "product_group": "s.product_group",
+    "region":        "cus.bde_state",
+    "salesman":      "cus.salesman_name",
+    "sold_to_group": "cus.sold_to_group",
+    "sold_to":       "cus.sold_to_name",
+    "pattern":       "s.pattern",
+}
+SERIES = {  # endpoint -> (fact, bucket column, output key, buckets)
+    "daily_sales":   ("sales_2511",    "day",   "day",   range(1, 31)),
+    "monthly_sales": ("sales_2501_11", "month", "month", range(1, 12)),
+    "yearly_sales":  ("sales_21_2511", "year",  "year",  range(2021, 2026)),
+}
+BREAKDOWNS = {
+    "daily_breakdown":   ("sales_2511",    "day"),
+    "monthly_breakdown": ("sales_2501_11", "month"),
+    "yearly_breakdown":  ("sales_21_2511", "year"),
+}
+ENDPOINTS = list(SERIES) + list(BREAKDOWNS) + ["daily_target", "monthly_target", "profit_monthly"]
+MODES = ("rollups", "raw", "columnar")
+
+
+@pytest.fixture
+def client(app, request):
+    app.USE_ROLLUPS = request.param != "raw"
+    app.COLUMNAR_ENGINE = request.param == "columnar" and app.columnar is not None
+    app.ranking_cache.clear()
+    if request.param == "columnar":
+        if app.columnar is None:
+            pytest.skip("columnar engine unavailable")
+        assert app.get_engine(wait=True) is not None
+    yield app.app.test_client()
+    app.USE_ROLLUPS, app.COLUMNAR_ENGINE = True, False
+    app.ranking_cache.clear()
+
+
+# ----------------------------- request matrix ---------------------------------
+def filter_variants(conn):
+    """{} plus one filter on a busy value of each customer / product dimension."""
+    def top(sql):
+        return conn.execute(sql).fetchone()[0]
+
+    busiest = """FROM sales_2501_11 s JOIN customer cus ON cus.ship_to = s.ship_to
+                 WHERE {col} IS NOT NULL GROUP BY {col} ORDER BY COUNT(*) DESC, {col} LIMIT 1"""
+    region = top("SELECT cus.bde_state " + busiest.format(col="cus.bde_state"))
+    salesman = top("SELECT cus.salesman_name " + busiest.format(col="cus.salesman_name"))
+    group = top("SELECT cus.sold_to_group " + busiest.format(col="cus.sold_to_group"))
+    name = top("SELECT cus.sold_to_name " + busiest.format(col="cus.sold_to_name"))
+    ship = top("SELECT s.ship_to " + busiest.format(col="s.ship_to"))
+    pg = top("SELECT s.product_group " + busiest.format(col="s.product_group"))
+    pattern = top("SELECT s.pattern " + busiest.format(col="s.pattern"))
+    return [
+        {},
+        {"region": region},
+        {"salesman": f" {salesman.lower()} "},  # compared case- and space-insensitively
+        {"sold_to_group": group},
+        {"sold_to": name},
+        {"ship_to": ship},
+        {"product_group": pg},
+        {"pattern": pattern},
+        {"region": region, "product_group": pg},
+    ]
+
+
+def requests_for(endpoint, conn):
+    out = []
+    combos = itertools.product(filter_variants(conn), CATEGORIES, ("qty", "amt"), (0, 3))
+    for i, (filters, category, metric, top_limit) in enumerate(combos):
+        args = dict(filters, metric=metric)
+        if category != "ALL":
+            args["category"] = category
+        if top_limit:
+            args["top_limit"] = str(top_limit)
+        if endpoint in BREAKDOWNS:
+            args["group_by"] = list(GROUPS)[i % len(GROUPS)]
+        if endpoint == "daily_target" and i % 3:
+            args["month"] = str((3, 7)[i % 3 - 1])
+        out.append(args)
+    return out
+
+
+# ----------------------------- reference ---------------------------------
+# What the endpoints computed before any rollup, flag column, surrogate key or
+# engine existed: raw facts, customer joined by ship_to, category joins.
+def parse(app, args):
+    from werkzeug.datastructures import MultiDict
+
+    return app.parse_filters(app._ArgsRequest(MultiDict(args)))
+
+
+def customer_where(alias, f):
+    wh, params = [], []
+    if f["region"] != "ALL":
+        wh.append("cus.bde_state = ?"); params.append(f["region"])
+    if f["salesman"] != "ALL":
+        wh.append("UPPER(TRIM(cus.salesman_name)) = UPPER(TRIM(?))"); params.append(f["salesman"])
+    if f["sold_to_group"] != "ALL":
+        wh.append("cus.sold_to_group = ?"); params.append(f["sold_to_group"])
+    if f["sold_to"] != "ALL":
+        sv = f["sold_to"]
+        if sv.isdigit() or sv.upper().startswith("A"):
+            wh.append(f"{alias}.ship_to = ?")
+        else:
+            wh.append("cus.sold_to_name = ?")
+        params.append(sv)
+    if f["ship_to"] != "ALL":
+        wh.append(f"{alias}.ship_to = ?"); params.append(f["ship_to"])
+    return wh, params
+
+
+def product_where(alias, f, wh, params):
+    if f["product_group"] != "ALL":
+        wh.append(f"{alias}.product_group = ?"); params.append(f["product_group"])
+    if f["pattern"] != "ALL":
+        wh.append(f"{alias}.pattern = ?"); params.append(f["pattern"])
+
+
+def sales_filters(app, f, alias="s"):
+    joins = [f"LEFT JOIN customer cus ON cus.ship_to = {alias}.ship_to"]
+    wh, params = customer_where(alias, f)
+    cat_joins, cat_where = app.category_filters(alias, f["category"])
+    joins += cat_joins
+    wh += cat_where
+    product_where(alias, f, wh, params)
+    return joins, wh, params
+
+
+def target_filters(app, f, product=True):
+    joins = ["LEFT JOIN customer cus ON cus.ship_to = t.ship_to"]
+    wh, params = customer_where("t", f)
+    wh += app.category_target_filters("t", f["category"])[1]
+    if product:
+        product_where("t", f, wh, params)
+    return joins, wh, params
+
+
+def where(wh):
+    return ("WHERE " + " AND ".join(wh)) if wh else ""
+
+
+def restrict(alias, wh, params, top):
+    if top:
+        wh.append(f"{alias}.sold_to IN ({','.join('?' * len(top))})")
+        params += top
+
+
+def sales_top(app, conn, f, value, n):
+    joins, wh, params = sales_filters(app, f)
+    return [r[0] for r in conn.execute(f"""
+        SELECT s.sold_to FROM sales_2501_11 s {' '.join(joins)} {where(wh)}
+         GROUP BY s.sold_to ORDER BY SUM(s.{value}) DESC, s.sold_to LIMIT ?""", params + [n])]
+
+
+def reference(app, conn, endpoint, args):
+    f = parse(app, args)
+    value = "qty" if f["metric"] == "qty" else "amt"
+    n = int(args.get("top_limit", 0))
+
+    if endpoint in ("daily_target", "monthly_target"):
+        month = int(args.get("month", 11))
+        joins, wh, params = target_filters(app, f, product=endpoint == "monthly_target")
+        if endpoint == "daily_target":
+            wh.append("t.month = ?"); params.append(month)
+        top = None
+        if n:
+            top = [r[0] for r in conn.execute(f"""
+                SELECT t.sold_to FROM target2025 t {' '.join(joins)} {where(wh)}
+                 GROUP BY t.sold_to ORDER BY SUM(t.{value}) DESC LIMIT ?""", params + [n])]
+        restrict("t", wh, params, top)
+        totals = {} if top == [] else {r[0]: r[1] for r in conn.execute(f"""
+            SELECT t.month, SUM(t.{value}) FROM target2025 t {' '.join(joins)} {where(wh)}
+             GROUP BY t.month""", params)}
+        if endpoint == "monthly_target":
+            return [{"month": m, "value": float(totals[m] or 0) if m in totals else 0} for m in range(1, 13)]
+        days = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}[month]
+        total = float(totals[month] or 0) if month in totals else 0
+        return [{"day": d, "value": total / days} for d in range(1, days + 1)]
+
+    top = sales_top(app, conn, f, value, n) if n else None
+
+    if endpoint == "profit_monthly":
+        joins, wh = app.category_filters("p", f["category"])
+        params = []
+        product_where("p", f, wh, params)
+        restrict("p", wh, params, top)
+        out = [dict(month=m, gross=0, sd=0, cogs=0, op_cost=0) for m in range(1, 13)]
+        if top == []:
+            return out
+        for r in conn.execute(f"""
+                SELECT CAST(p.month AS UNSIGNED), SUM(p.gross), SUM(p.sales_deduction), SUM(p.cogs),
+                       SUM(p.operating_cost)
+                  FROM profit_2501_10 p {' '.join(joins)} {where(wh)}
+                 GROUP BY CAST(p.month AS UNSIGNED)""", params):
+            if 1 <= int(r[0] or 0) <= 12:
+                out[int(r[0]) - 1].update(gross=float(r[1] or 0), sd=float(r[2] or 0),
+                                          cogs=float(r[3] or 0), op_cost=float(r[4] or 0))
+        return out
+
+    joins, wh, params = sales_filters(app, f)
+    restrict("s", wh, params, top)
+    if endpoint in SERIES:
+        fact, col, key, buckets = SERIES[endpoint]
+        totals = {} if top == [] else {r[0]: r[1] for r in conn.execute(f"""
+            SELECT s.{col}, SUM(s.{value}) FROM {fact} s {' '.join(joins)} {where(wh)} GROUP BY s.{col}""", params)}
+        return [{key: b, "value": float(totals[b] or 0) if b in totals else 0} for b in buckets]
+
+    fact, col = BREAKDOWNS[endpoint]
+    group = GROUPS[args["group_by"]]
+    if top == []:
+        return []
+    return [dict(r) for r in conn.execute(f"""
+        SELECT s.{col} AS {col}, {group} AS group_label, SUM(s.{value}) AS value
+          FROM {fact} s {' '.join(joins)} {where(wh)}
+         GROUP BY s.{col}, {group}""", params)]
+
+
+def canonical(endpoint, body):
+    """JSON text with int/float kept apart; breakdown rows sorted (SQL orders them by bucket only)."""
+    if endpoint in BREAKDOWNS:
+        body = sorted(body, key=lambda r: json.dumps(r, sort_keys=True))
+    return json.dumps(body, sort_keys=True)
+
+
+# ----------------------------- tests ---------------------------------
+@pytest.mark.parametrize("client", MODES, indirect=True)
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_endpoint_matches_reference(app, conn, client, endpoint):
+    mismatches = []
+    for args in requests_for(endpoint, conn):
+        resp = client.get(f"/api/{endpoint}", query_string=args)
+        assert resp.status_code == 200, (args, resp.get_data())
+        got, want = canonical(endpoint, resp.get_json()), canonical(endpoint, reference(app, conn, endpoint, args))
+        if got != want:
+            mismatches.append((args, got[:300], want[:300]))
+    assert not mismatches, f"{len(mismatches)} mismatches, first: {mismatches[:3]}"
+
+
+def test_fixture_exercises_the_data(app, conn):
+    """The matrix is only worth something if the filters select rows."""
+    for filters in filter_variants(conn)[1:]:
+        f = parse(app, filters)
+        joins, wh, params = sales_filters(app, f)
+        n = conn.execute(f"SELECT COUNT(*) FROM sales_2501_11 s {' '.join(joins)} {where(wh)}", params).fetchone()[0]
+        assert n > 0, filters
+    assert conn.execute("SELECT COUNT(*) FROM target2025 WHERE special <> ''").fetchone()[0] > 0
+
+
+@pytest.mark.parametrize("endpoint", list(BREAKDOWNS))
+def test_invalid_group_by(app, endpoint):
+    resp = app.app.test_client().get(f"/api/{endpoint}", query_string={"group_by": "nope"})
+    assert resp.status_code == 400
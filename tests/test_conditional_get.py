@@ -0,0 +1,73 @@
+"""ETag / Last-Modified on the chart endpoints (conditional_get) and the encoded-body tags."""
+import gzip
+
+import pytest
+
+URL = "/api/daily_breakdown"
+ARGS = {"group_by": "pattern", "region": "NSW"}
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def test_etag_round_trip(client):
+    first = client.get(URL, query_string=ARGS)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"] and first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get(URL, query_string=ARGS, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    assert again.headers["ETag"] == etag
+
+    other = client.get(URL, query_string=dict(ARGS, group_by="region"), headers={"If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["ETag"] != etag
+
+
+def test_etag_is_keyed_on_normalized_filters(client):
+    a = client.get(URL, query_string=ARGS)
+    b = client.get(URL, query_string={"region": " NSW ", "group_by": "pattern ", "top_limit": "0"})
+    assert a.headers["ETag"] == b.headers["ETag"]
+
+
+def test_gzip_round_trip(app, client, monkeypatch):
+    monkeypatch.setattr(app, "COMPRESS_MIN_BYTES", 1)
+    plain = client.get(URL, query_string=ARGS)
+    zipped = client.get(URL, query_string=ARGS, headers={"Accept-Encoding": "gzip"})
+    assert zipped.status_code == 200
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in zipped.headers["Vary"]
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    # the encoded representation gets its own strong tag ...
+    tag = plain.headers["ETag"].strip('"')
+    assert zipped.headers["ETag"] == f'"{tag}-gzip"'
+
+    # ... which revalidates to a 304 carrying it back
+    again = client.get(URL, query_string=ARGS,
+                       headers={"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == zipped.headers["ETag"]
+    assert "Content-Encoding" not in again.headers
+
+
+def test_if_modified_since(client):
+    first = client.get(URL, query_string=ARGS)
+    modified = first.headers["Last-Modified"]
+    assert client.get(URL, query_string=ARGS, headers={"If-Modified-Since": modified}).status_code == 304
+    assert client.get(URL, query_string=ARGS,
+                      headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"}).status_code == 200
+
+
+def test_new_data_version_changes_the_etag(app, client, monkeypatch):
+    etag = client.get(URL, query_string=ARGS).headers["ETag"]
+    monkeypatch.setattr(app, "data_version", lambda: "published meanwhile")
+    resp = client.get(URL, query_string=ARGS, headers={"If-None-Match": etag})
+    assert resp.status_code == 200 and resp.headers["ETag"] != etag
+
+
+def test_bad_input_is_not_tagged(client):
+    resp = client.get(URL, query_string={"group_by": "nope"})
+    assert resp.status_code == 400 and "ETag" not in resp.headers
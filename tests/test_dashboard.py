@@ -0,0 +1,51 @@
+"""/api/dashboard against the single chart endpoints it batches."""
+import json
+
+import pytest
+
+SERIES = ["daily_sales", "daily_breakdown", "daily_target", "monthly_sales", "monthly_breakdown",
+          "monthly_target", "yearly_sales", "yearly_breakdown", "profit_monthly", "sales_map"]
+
+
+@pytest.fixture(params=[False, True], ids=["uncached", "cached"])
+def client(app, request, monkeypatch):
+    monkeypatch.setattr(app, "RESPONSE_CACHE", request.param)
+    app.response_cache.clear()
+    yield app.app.test_client()
+    app.response_cache.clear()
+
+
+@pytest.mark.parametrize("base", [{}, {"metric": "amt", "top_limit": "3"}, {"category": "PCLT", "format": "columnar"}])
+def test_series_match_their_endpoints(client, base):
+    extra = {"daily_breakdown": {"group_by": "pattern"}, "daily_target": {"month": "3"}, "sales_map": {"zoom": "5"}}
+    body = {"filters": base, "series": [dict({"name": name}, **extra.get(name, {})) for name in SERIES]}
+    for _ in range(2):  # the second round can come from the response cache
+        resp = client.post("/api/dashboard", json=body)
+        assert resp.status_code == 200
+        out = resp.get_json()
+        assert sorted(out) == sorted(SERIES)
+        for name in SERIES:
+            single = client.get(f"/api/{name}", query_string=dict(base, **extra.get(name, {})))
+            assert single.status_code == 200
+            assert out[name] == json.loads(single.get_data()), name
+
+
+def test_failing_series_does_not_fail_the_others(client):
+    resp = client.get("/api/dashboard", query_string={
+        "series": "monthly_sales,daily_breakdown", "group_by": "nope"})
+    assert resp.status_code == 200
+    out = resp.get_json()
+    assert out["daily_breakdown"] == {"error": "invalid group_by", "status": 400}
+    assert len(out["monthly_sales"]) == 11
+
+
+def test_series_errors_are_logged(app, client, monkeypatch, caplog):
+    def boom(f, args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(app.DASHBOARD_SERIES, "monthly_sales", (boom, ("top_limit",)))
+    resp = client.get("/api/dashboard", query_string={"series": "monthly_sales,yearly_sales"})
+    out = resp.get_json()
+    assert out["monthly_sales"] == {"error": "boom", "status": 500}
+    assert len(out["yearly_sales"]) == 5
+    assert any("monthly_sales" in r.getMessage() and r.exc_info for r in caplog.records)
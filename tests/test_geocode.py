@@ -0,0 +1,143 @@
+"""geocode.py against the local stub API (make_stub_server on an ephemeral port)."""
+import csv
+import threading
+import time
+
+import pytest
+
+import geocode
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        kwargs.setdefault("latency", 0)
+        kwargs.setdefault("error_rate", 0)
+        server = geocode.make_stub_server(0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        server.url = f"http://127.0.0.1:{server.server_port}/geocode/json"
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    cache = geocode.GeocodeCache(str(tmp_path / "cache.db"))
+    yield cache
+    cache.close()
+
+
+def addresses(n, prefix="STREET"):
+    return {geocode.address_fingerprint(f"{i} {prefix} RD, TOWN, SA 5000, Australia"):
+            f"{i} {prefix} RD, TOWN, SA 5000, Australia" for i in range(n)}
+
+
+def test_token_bucket_rate():
+    bucket = geocode.TokenBucket(rate=50, burst=5)
+    start = time.monotonic()
+    for _ in range(30):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    # the first 5 are banked, the other 25 come at 50/s
+    assert 25 / 50 * 0.9 <= elapsed < 25 / 50 * 2
+
+
+def test_geocode_many_respects_rate(stub, store):
+    server = stub()
+    todo = addresses(21)
+    results = geocode.geocode_many(todo, store, {}, url=server.url, workers=8, rate=20, burst=1, retries=0)
+    assert len(results) == 21
+    times = sorted(t for t, _, _ in server.requests)
+    # 8 workers, but one token every 50 ms over all of them
+    assert times[-1] - times[0] >= 20 / 20 * 0.9
+
+
+def test_retry_after_503(stub):
+    server = stub(retry_after=1)
+    bucket = geocode.TokenBucket(0, 1)
+    start = time.monotonic()
+    lat, lon, attempts = geocode.geocode_with_retry("1 FLAKY ST, TOWN, SA 5000", bucket, url=server.url,
+                                                    retries=2, backoff=0.01)
+    assert lat is not None and lon is not None
+    assert attempts == 2
+    assert [status for _, _, status in server.requests] == [503, 200]
+    assert time.monotonic() - start >= 0.8  # waited the server's Retry-After, jittered, not the 10 ms backoff
+
+
+def test_backoff_without_retry_after(stub):
+    server = stub(retry_after=None, error_rate=1)
+    bucket = geocode.TokenBucket(0, 1)
+    start = time.monotonic()
+    with pytest.raises(geocode.TransientError):
+        geocode.geocode_with_retry("2 MAIN ST, TOWN, SA 5000", bucket, url=server.url, retries=2, backoff=0.1)
+    assert len(server.requests) == 3
+    assert time.monotonic() - start >= (0.1 + 0.2) * 0.8  # exponential: 0.1 s, then 0.2 s
+
+
+def test_failed_addresses_stay_out_of_the_cache(stub, store):
+    server = stub(retry_after=None, error_rate=1)
+    todo = addresses(3)
+    results = geocode.geocode_many(todo, store, {}, url=server.url, workers=2, rate=0, retries=0)
+    assert results == {}
+    assert len(store) == 0
+
+
+def test_cache_writes_are_batched(stub, store, monkeypatch):
+    server = stub()
+    monkeypatch.setattr(geocode, "CACHE_BATCH", 5)
+    batches = []
+    put_many = store.put_many
+    monkeypatch.setattr(store, "put_many", lambda entries, **kw: (batches.append(len(entries)), put_many(entries, **kw)))
+    todo = addresses(12)
+    todo.update(addresses(1, "NOWHERE"))
+    results = geocode.geocode_many(todo, store, {}, url=server.url, workers=4, rate=0)
+    assert [n for n in batches if n] == [5, 5, 3]
+    assert len(store) == 13
+    fp = next(fp for fp, a in todo.items() if "NOWHERE" in a)
+    assert results[fp] == (None, None, None)
+    assert store.get(fp) == (None, None, None)  # a miss is cached too
+    assert len(server.requests) == 13
+
+
+def write_export(path, streets):
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["Address 1", "City", "Region", "Postal Code", "Country"])
+        for street in streets:
+            writer.writerow([street, "WINGFIELD", "SA", "5013", "AU"])
+
+
+def read_output(path):
+    with open(path, newline="", encoding="utf-8") as fh:
+        return [(r["Address 1"], r["lat"], r["lon"]) for r in csv.DictReader(fh)]
+
+
+def test_main_resumes_from_the_sqlite_cache(stub, tmp_path):
+    server = stub()
+    export, cache, out = tmp_path / "export.csv", tmp_path / "cache.db", tmp_path / "out.csv"
+    args = ["--input", str(export), "--output", str(out), "--cache", str(cache),
+            "--url", server.url, "--rate", "0", "--fallback", "none"]
+
+    write_export(export, [f"{i} LAFITTE ROAD" for i in range(6)] + ["5 Lafitte Rd."])
+    geocode.main(args)
+    first = read_output(out)
+    assert len(server.requests) == 6  # "5 Lafitte Rd." shares the fingerprint of "5 LAFITTE ROAD"
+    assert all(lat and lon for _, lat, lon in first)
+
+    # rerun with two new rows: only those reach the API, the rest come from the cache
+    write_export(export, [f"{i} LAFITTE ROAD" for i in range(8)] + ["5 Lafitte Rd."])
+    geocode.main(args)
+    assert len(server.requests) == 8
+    second = read_output(out)
+    assert second[:6] == first[:6] and second[-1] == first[-1]
+
+    # nothing left to do
+    geocode.main(args)
+    assert len(server.requests) == 8
@@ -0,0 +1,34 @@
+"""make_sqlite_snapshot.py loading pieces."""
+import queue
+
+import pytest
+
+pytest.importorskip("pandas")
+
+import make_sqlite_snapshot as builder
+
+
+def read_chunks(table, path):
+    out = queue.Queue()
+    builder.read_csv_chunks(table, str(path), out)
+    items = []
+    while not out.empty():
+        items.append(out.get())
+    return items
+
+
+def test_non_numeric_cells_load_as_null(tmp_path, capsys):
+    path = tmp_path / "iseg.csv"
+    path.write_text("Material,Note\n100142,a\nTYRE-X,b\n,c\n  200 ,d\n")
+    (table, columns, dtypes, rows), (_, done, _, _) = read_chunks("iseg", path)
+    assert done is None  # finished, not failed
+    assert columns == ["Material", "Note"]
+    assert rows == [(100142.0, "a"), (None, "b"), (None, "c"), (200.0, "d")]
+    assert "iseg.Material: 1 non-numeric values loaded as NULL" in capsys.readouterr().out
+
+
+def test_codes_stay_text(tmp_path):
+    path = tmp_path / "hm.csv"
+    path.write_text("Sold_To\n0100142\n100142\n")
+    (_, _, _, rows), _ = read_chunks("hm", path)
+    assert rows == [("0100142",), ("100142",)]
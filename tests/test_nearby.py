@@ -0,0 +1,128 @@
+"""spatial.KDTree and /api/nearby against brute-force haversine distances."""
+import math
+import random
+
+import pytest
+
+import spatial
+
+
+def haversine(a, b):
+    (lat1, lng1), (lat2, lng2) = a, b
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = (math.sin((p2 - p1) / 2) ** 2
+         + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * spatial.EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def brute(points, q, k=None, km=None, accept=None):
+    """[(distance_km, id)] closest first, like KDTree.nearest / within."""
+    hits = sorted((haversine(q, p), i) for i, p in points.items() if accept is None or accept(i))
+    if km is not None:
+        hits = [h for h in hits if h[0] <= km]
+    return hits if k is None else hits[:k]
+
+
+def assert_same(got, want, points, q):
+    """Same distances in order; each id at the distance brute force gives it (ties may swap ids)."""
+    assert [round(d, 6) for d, _ in got] == [round(d, 6) for d, _ in want]
+    for d, i in got:
+        assert d == pytest.approx(haversine(q, points[i]), abs=1e-6)
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = random.Random(11)
+    pts = {f"P{i}": (rng.uniform(-44, -10), rng.uniform(113, 154)) for i in range(600)}
+    pts.update({"N": (89.9, 10.0), "D1": (-33.0, 151.0), "D2": (-33.0, 151.0)})  # a pole, a duplicate
+    return pts
+
+
+def test_kdtree_nearest(points):
+    tree = spatial.KDTree(points.values(), points.keys())
+    rng = random.Random(3)
+    for _ in range(200):
+        q = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+        k = rng.choice([1, 5, 25])
+        assert_same(tree.nearest(*q, k=k), brute(points, q, k=k), points, q)
+
+
+def test_kdtree_within_and_accept(points):
+    tree = spatial.KDTree(points.values(), points.keys())
+    rng = random.Random(5)
+    odd = lambda i: i[-1] in "13579"
+    for _ in range(100):
+        q = (rng.uniform(-44, -10), rng.uniform(113, 154))
+        km = rng.choice([0, 50, 400, 2000])
+        assert_same(tree.within(*q, km), brute(points, q, km=km), points, q)
+        assert_same(tree.nearest(*q, k=7, max_km=km, accept=odd),
+                    brute(points, q, k=7, km=km, accept=odd), points, q)
+
+
+def test_kdtree_edges():
+    assert spatial.KDTree([], []).nearest(0, 0, k=3) == []
+    tree = spatial.KDTree([(-33.0, 151.0)], ["A"])
+    assert tree.nearest(-33.0, 151.0, k=0) == []
+    (km, _), = tree.nearest(33.0, -29.0, k=1)  # the antipode
+    assert km == pytest.approx(math.pi * spatial.EARTH_RADIUS_KM, rel=1e-9)
+
+
+# ----------------------------- endpoint ---------------------------------
+@pytest.fixture(scope="module")
+def customers(app):
+    """ship_to -> (lat, lng) of the ship_tos with sales, and their /api/sales_map rows."""
+    rows = app.app.test_client().get("/api/sales_map").get_json()
+    return {r["ship_to"]: (float(r["latitude"]), float(r["longitude"])) for r in rows}, rows
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def test_nearest_to_a_point(client, customers):
+    pts, _ = customers
+    for q, k in [((-33.87, 151.21), 10), ((-37.81, 144.96), 3), ((-27.47, 153.03), 500)]:
+        out = client.get("/api/nearby", query_string={"lat": q[0], "lng": q[1], "k": k}).get_json()
+        want = brute(pts, q, k=k)
+        assert [r["distance_km"] for r in out] == [round(d, 3) for d, _ in want]
+        for r in out:
+            assert r["distance_km"] == round(haversine(q, pts[r["ship_to"]]), 3)
+
+
+def test_around_a_customer(client, customers):
+    pts, rows = customers
+    origin = rows[0]["ship_to"]
+    q = pts[origin]
+    out = client.get("/api/nearby", query_string={"origin": origin, "radius_km": 800}).get_json()
+    want = brute(pts, q, km=800, accept=lambda s: s != origin)
+    assert origin not in {r["ship_to"] for r in out}
+    assert [r["distance_km"] for r in out] == [round(d, 3) for d, _ in want]
+
+    capped = client.get("/api/nearby", query_string={"origin": origin, "radius_km": 800, "k": 2}).get_json()
+    assert capped == out[:2]
+
+
+def test_filters_restrict_the_candidates(client, customers):
+    _, rows = customers
+    filtered = client.get("/api/sales_map", query_string={"top_limit": "5"}).get_json()
+    pts = {r["ship_to"]: (float(r["latitude"]), float(r["longitude"])) for r in filtered}
+    assert 0 < len(pts) < len(rows)
+    q = (-30.0, 140.0)
+    out = client.get("/api/nearby", query_string={"lat": q[0], "lng": q[1], "k": 50, "top_limit": "5"}).get_json()
+    assert {r["ship_to"] for r in out} == set(pts)
+    assert [r["distance_km"] for r in out] == [round(d, 3) for d, _ in brute(pts, q)]
+    totals = {r["ship_to"]: r["total_value"] for r in filtered}
+    assert all(r["total_value"] == totals[r["ship_to"]] for r in out)
+
+
+@pytest.mark.parametrize("args, status", [
+    ({"origin": "NOPE"}, 404),
+    ({}, 400),
+    ({"lat": "-33"}, 400),
+    ({"lat": "-33", "lng": "151", "k": "0"}, 400),
+    ({"lat": "-33", "lng": "151", "radius_km": "-1"}, 400),
+    ({"lat": "x", "lng": "151"}, 400),
+])
+def test_bad_queries(client, args, status):
+    assert client.get("/api/nearby", query_string=args).status_code == status
@@ -0,0 +1,93 @@
+"""ResponseCache (LRU by bytes, TTL, data-version flush) and cached_response()."""
+import pytest
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    """Replace app.time() with a settable clock: clock.now = ..."""
+    class Clock:
+        now = 1000.0
+
+    c = Clock()
+    monkeypatch.setattr(app, "time", lambda: c.now)
+    return c
+
+
+def test_lru_eviction_by_bytes(app, clock):
+    cache = app.ResponseCache("test", max_bytes=30, ttl=60)
+    for key in "abc":
+        cache.put(key, b"x" * 10)
+    assert cache.get("a") == b"x" * 10  # a is now the most recently used
+    cache.put("d", b"y" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(k) is not None for k in "acd"] == [True, True, True]
+    status = cache.status()
+    assert status["evictions"] == 1 and status["bytes"] == 30
+
+
+def test_oversized_value_is_not_stored(app, clock):
+    cache = app.ResponseCache("test", max_bytes=30, ttl=60)
+    cache.put("a", b"x" * 31)
+    assert cache.status()["entries"] == 0
+
+
+def test_ttl_expiry(app, clock):
+    cache = app.ResponseCache("test", max_bytes=100, ttl=10)
+    cache.put("a", b"x")
+    clock.now += 9.9
+    assert cache.get("a") == b"x"
+    clock.now += 0.2
+    assert cache.get("a") is None
+    status = cache.status()
+    assert status["expirations"] == 1 and status["entries"] == 0 and status["bytes"] == 0
+
+
+def test_new_data_version_flushes(app, clock):
+    cache = app.ResponseCache("test", max_bytes=100, ttl=60)
+    cache.check_version("v1")
+    cache.put("a", b"x", version="v1")
+    cache.check_version("v1")
+    assert cache.get("a") == b"x"
+    cache.check_version("v2")
+    assert cache.get("a") is None
+    assert cache.status()["invalidations"] == 1
+
+
+def test_put_computed_on_an_old_version_is_dropped(app, clock):
+    cache = app.ResponseCache("test", max_bytes=100, ttl=60)
+    cache.check_version("v1")
+    cache.check_version("v2")  # another thread saw the new snapshot while this one computed
+    cache.put("a", b"old", version="v1")
+    assert cache.get("a") is None
+    cache.put("a", b"new", version="v2")
+    assert cache.get("a") == b"new"
+
+
+@pytest.fixture
+def response_cache(app, monkeypatch):
+    monkeypatch.setattr(app, "RESPONSE_CACHE", True)
+    app.response_cache.clear()
+    yield app.response_cache
+    app.response_cache.clear()
+
+
+def test_cached_response_hits(app, response_cache):
+    client = app.app.test_client()
+    first = client.get("/api/monthly_sales", query_string={"region": "NSW", "top_limit": "3"})
+    hits = response_cache.status()["hits"]
+    second = client.get("/api/monthly_sales", query_string={"top_limit": "3", "region": " NSW "})
+    assert response_cache.status()["hits"] == hits + 1  # same normalized filters
+    assert first.get_data() == second.get_data()
+
+
+def test_response_computed_across_a_flush_is_not_stored(app, response_cache, monkeypatch):
+    real = app.run_aggregate
+
+    def publish_meanwhile(*args, **kwargs):
+        rows = real(*args, **kwargs)
+        response_cache.check_version("published meanwhile")
+        return rows
+
+    monkeypatch.setattr(app, "run_aggregate", publish_meanwhile)
+    assert app.app.test_client().get("/api/monthly_sales").status_code == 200
+    assert response_cache.status()["entries"] == 0
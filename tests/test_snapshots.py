@@ -0,0 +1,143 @@
+"""Publishing a new snapshot under a running app (snapshot.current hot swap)."""
+import contextvars
+import os
+import shutil
+import sqlite3
+import subprocess
+
+import pytest
+
+from conftest import build_snapshot, read_csv, write_csv
+
+
+@pytest.fixture(scope="session")
+def shifted_snapshot(raw_data, snapshot, tmp_path_factory):
+    """
+    raw_data with the salesman sorting last renamed to sort first, so every
+    other dim_salesman id moves up by one. Returns (published file, a salesman
+    whose id moved).
+    """
+    with sqlite3.connect(snapshot[1]) as c:
+        last = c.execute("SELECT key FROM dim_salesman ORDER BY id DESC LIMIT 1").fetchone()[0]
+        moved = c.execute("""
+            SELECT MIN(TRIM(cus.salesman_name)) FROM sales_2511 s JOIN customer cus ON cus.ship_to = s.ship_to
+             WHERE UPPER(TRIM(cus.salesman_name)) <> ? GROUP BY cus.salesman_sk ORDER BY COUNT(*) DESC LIMIT 1
+        """, (last,)).fetchone()[0]
+
+    root = tmp_path_factory.mktemp("shifted")
+    raw = str(root / "raw")
+    shutil.copytree(raw_data, raw)
+    path = os.path.join(raw, "customer.csv")
+    rows = read_csv(path)
+    for row in rows:
+        if row["salesman_name"].strip().upper() == last:
+            row["salesman_name"] = "AAA Renamed"
+    write_csv(path, rows)
+    return build_snapshot(raw, str(root / "snapshot.current")), moved
+
+
+@pytest.fixture
+def publish(app, tmp_path, monkeypatch):
+    """publish(path): point the app at `path`, as make_sqlite_snapshot.publish() does, and have it re-read at once."""
+    pointer = tmp_path / "snapshot.current"
+    monkeypatch.setattr(app, "SNAPSHOT_POINTER", str(pointer))
+
+    def publish(path):
+        pointer.write_text(path + "\n")
+        app._snapshot["checked"] = 0.0
+
+    yield publish
+    app._snapshot["checked"] = 0.0  # back to the session pointer
+
+
+def daily_sales(path, salesman):
+    """/api/daily_sales?salesman= computed on `path` directly."""
+    with sqlite3.connect(path) as c:
+        totals = dict(c.execute("""
+            SELECT s.day, SUM(s.qty) FROM sales_2511 s LEFT JOIN customer cus ON cus.ship_to = s.ship_to
+             WHERE UPPER(TRIM(cus.salesman_name)) = UPPER(TRIM(?)) GROUP BY s.day
+        """, (salesman,)).fetchall())
+    return [{"day": d, "value": float(totals[d]) if d in totals else 0} for d in range(1, 31)]
+
+
+def test_filter_ids_follow_a_snapshot_swap(app, snapshot, shifted_snapshot, publish, monkeypatch):
+    # the pointer is re-read right away, the data version would not be for an hour
+    monkeypatch.setattr(app, "SNAPSHOT_CHECK_SECS", 3600)
+    monkeypatch.setattr(app, "DATA_VERSION_CHECK_SECS", 3600)
+    shifted, salesman = shifted_snapshot
+    client = app.app.test_client()
+
+    publish(snapshot[1])
+    assert client.get("/api/daily_sales", query_string={"salesman": salesman}).get_json() \
+        == daily_sales(snapshot[1], salesman)
+
+    publish(shifted)
+    assert client.get("/api/daily_sales", query_string={"salesman": salesman}).get_json() \
+        == daily_sales(shifted, salesman)
+    assert client.get("/api/daily_sales", query_string={"salesman": "AAA Renamed"}).get_json() \
+        == daily_sales(shifted, "AAA Renamed")
+
+
+def test_request_keeps_its_snapshot(app, snapshot, shifted_snapshot, publish):
+    """A publish during a request leaves its dimension ids and connection on the file it started on."""
+    shifted, salesman = shifted_snapshot
+    publish(snapshot[1])
+    spec = app.AGGREGATES["daily_sales"]
+    with app.app.test_request_context("/api/daily_sales", query_string={"salesman": salesman}):
+        app.pin_request_snapshot()
+        try:
+            publish(shifted)
+            assert contextvars.Context().run(app.snapshot_path) == shifted  # what an unpinned thread sees now
+            assert not app.snapshot_is_current()
+            rows = app.run_aggregate(spec, app.parse_filters(app.request))
+        finally:
+            app.unpin_request_snapshot()
+    assert spec.series(rows) == daily_sales(snapshot[1], salesman)
+
+
+def test_build_keeps_snapshot_db_in_step(raw_data, tmp_path):
+    """snapshot.db (what deploys without a pointer serve) is a copy of the published file."""
+    published = build_snapshot(raw_data, str(tmp_path / "snapshot.current"), "--legacy-db")
+    legacy = tmp_path / "snapshot.db"
+    assert legacy.exists() and str(legacy) != published
+
+    def contents(path):
+        with sqlite3.connect(path) as c:
+            tables = [r[0] for r in c.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+            return {t: c.execute(f'SELECT COUNT(*), TOTAL(rowid) FROM "{t}"').fetchone() for t in tables}
+
+    assert contents(str(legacy)) == contents(published)
+    assert not list(tmp_path.glob("snapshot.db.*.tmp"))
+
+
+def test_failed_build_leaves_the_published_snapshot(raw_data, tmp_path):
+    pointer = tmp_path / "snapshot.current"
+    published = build_snapshot(raw_data, str(pointer))
+    before = (pointer.read_text(), os.stat(published).st_mtime_ns, sorted(os.listdir(tmp_path / "snapshots")))
+
+    raw = tmp_path / "raw"
+    shutil.copytree(raw_data, raw)
+    with open(raw / "sales_2511.csv", "a") as fh:
+        fh.write("1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25\n")  # too many fields
+    with pytest.raises(subprocess.CalledProcessError):
+        build_snapshot(str(raw), str(pointer))
+
+    assert (pointer.read_text(), os.stat(published).st_mtime_ns, sorted(os.listdir(tmp_path / "snapshots"))) == before
+
+
+def test_connections_switch_to_a_published_snapshot(app, snapshot, shifted_snapshot, publish):
+    client = app.app.test_client()
+    publish(snapshot[1])
+    assert client.get("/api/monthly_sales").status_code == 200
+    before = client.get("/api/_pool").get_json()
+    assert before["path"] == snapshot[1]
+
+    publish(shifted_snapshot[0])
+    assert client.get("/api/monthly_sales").status_code == 200
+    after = client.get("/api/_pool").get_json()
+    assert after["path"] == shifted_snapshot[0]
+    assert after["switched"] == before["switched"] + 1
+    assert after["open"] == before["open"]  # the old connection was closed, not leaked
+
+    assert client.get("/api/monthly_sales").status_code == 200
+    assert client.get("/api/_pool").get_json()["switched"] == after["switched"]